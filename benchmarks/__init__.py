@@ -0,0 +1,6 @@
+"""
+Benchmarks for the Inventory service
+
+Each module runs standalone against the database in DATABASE_URI, e.g.
+    python -m benchmarks.reserve_contention --help
+"""
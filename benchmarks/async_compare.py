@@ -0,0 +1,142 @@
+"""
+Async vs Flask Benchmark
+
+Serves the API both ways on local ports: the Flask app under gunicorn with one
+sync worker, as in the Procfile, and the ASGI app of service/asgi.py under
+uvicorn with one worker. Both are then driven by the same many concurrent
+clients, and their throughput and p50/p99 latency are reported side by side.
+The clients are asyncio tasks in this process; when the faster server keeps
+this process at 100% CPU, the client is the limit and not the server.
+
+Like the suite, it recreates the inventory tables of DATABASE_URI
+
+    python -m benchmarks.async_compare --rows 100000 --clients 64 --seconds 10
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import subprocess
+from collections import OrderedDict
+
+import httpx
+
+from benchmarks.common import percentile, quiet
+from benchmarks.suite import populate, key_of, encode_key
+
+URL = "/api/inventory/{}/condition/{}"
+
+SERVERS = OrderedDict([
+    ('flask', [os.path.join(os.path.dirname(sys.executable), 'gunicorn'), '--workers=1',
+               '--bind=127.0.0.1:{port}', '--log-level=warning', 'service:app']),
+    ('asgi', [sys.executable, '-m', 'uvicorn', 'service.asgi:app', '--workers=1',
+              '--port={port}', '--log-level=warning', '--no-access-log'])
+])
+
+################################################################################
+def scenarios(rows):
+    """ Returns the benchmarks as {name: function returning the next (method, path)} """
+    def get_one():
+        return 'GET', URL.format(*key_of(random.randrange(rows), rows))
+
+    def list_page():
+        cursor = encode_key(key_of(random.randrange(rows), rows))
+        return 'GET', "/api/inventory?limit=100&after=" + cursor
+
+    def activate():
+        return 'PUT', URL.format(*key_of(random.randrange(rows), rows)) + "/activate"
+
+    return OrderedDict([('get_one', get_one), ('list_page', list_page), ('activate', activate)])
+
+def start(command, port):
+    """ Starts a server and returns its process once it answers """
+    process = subprocess.Popen([part.format(port=port) for part in command],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                               env=dict(os.environ, LOGGING_LEVEL="WARNING"))
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("{} exited with {}".format(command, process.returncode))
+        try:
+            httpx.get("http://127.0.0.1:{}{}".format(port, URL.format(1, "new")), timeout=1)
+            return process
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError("{} did not start".format(command))
+
+async def drive(base_url, scenario, clients, seconds):
+    """ Runs clients concurrent tasks calling scenario for seconds and returns the numbers """
+    latencies, errors = [], 0
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + seconds
+
+        async def worker():
+            nonlocal errors
+            while loop.time() < deadline:
+                method, path = scenario()
+                started = time.perf_counter()
+                try:
+                    response = await client.request(method, path)
+                    failed = response.status_code >= 300
+                except httpx.HTTPError:
+                    failed = True
+                latencies.append(time.perf_counter() - started)
+                errors += failed
+
+        started = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(clients)])
+        elapsed = time.perf_counter() - started
+    latencies.sort()
+    return OrderedDict([
+        ('ops_per_sec', round(len(latencies) / elapsed, 1)),
+        ('p50_ms', round(percentile(latencies, 50) * 1000, 2)),
+        ('p99_ms', round(percentile(latencies, 99) * 1000, 2)),
+        ('calls', len(latencies)),
+        ('errors', errors)
+    ])
+
+def main():
+    """ Parses the arguments, starts both servers and compares them """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument('--rows', type=int, default=100000, help='records in the table')
+    parser.add_argument('--clients', type=int, default=64, help='concurrent clients')
+    parser.add_argument('--seconds', type=float, default=10.0, help='time spent per benchmark')
+    parser.add_argument('--port', type=int, default=8090, help='first of the two ports to use')
+    parser.add_argument('--only', help='only run benchmarks whose name contains this')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    args = parser.parse_args()
+
+    quiet()
+    random.seed(0)
+    populate(args.rows)
+    results = OrderedDict()
+    for offset, (server, command) in enumerate(SERVERS.items()):
+        port = args.port + offset
+        process = start(command, port)
+        try:
+            for name, scenario in scenarios(args.rows).items():
+                if args.only and args.only not in name:
+                    continue
+                result = asyncio.get_event_loop().run_until_complete(drive(
+                    "http://127.0.0.1:{}".format(port), scenario, args.clients, args.seconds))
+                results.setdefault(name, OrderedDict())[server] = result
+                print("{:<10} {:<6} {:>9} ops/s  p50 {:>8} ms  p99 {:>8} ms  errors {:>5}".format(
+                    name, server, result['ops_per_sec'], result['p50_ms'], result['p99_ms'],
+                    result['errors']), flush=True)
+        finally:
+            process.terminate()
+            process.wait()
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(OrderedDict([('clients', args.clients), ('rows', args.rows),
+                                   ('results', results)]), output, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""
+Helpers shared by the benchmarks
+"""
+import logging
+import threading
+
+from service import app
+
+################################################################################
+class Client():
+    """ Sends requests through the Flask test client or to a running service """
+
+    def __init__(self, url=None):
+        self.url = url
+        self._local = threading.local()
+
+    def _session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            if self.url:
+                import requests
+                session = requests.Session()
+            else:
+                session = app.test_client()
+            self._local.session = session
+        return session
+
+    def request(self, method, path, json=None, headers=None):
+        """ Returns the (status, json body, headers) of a request """
+        session = self._session()
+        if self.url:
+            resp = session.request(method, self.url + path, json=json, headers=headers)
+            body = resp.json() if resp.content else None
+            return resp.status_code, body, resp.headers
+        resp = session.open(path, method=method, json=json, headers=headers)
+        # Reads streamed bodies to the end, like a real client would
+        resp.get_data()
+        return resp.status_code, resp.get_json(), resp.headers
+
+    def warm_up(self, path):
+        """
+        Sends a first request from the calling thread, so the one-off work of
+        the first request is not measured and does not race between workers
+        """
+        self.request('GET', path)
+
+def percentile(values, pct):
+    """ Returns the pct percentile of a sorted list """
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+def quiet():
+    """ Keeps the per-request info logging out of the measurements and the output """
+    app.logger.setLevel(logging.WARNING)
@@ -0,0 +1,171 @@
+"""
+Inventory Data Generator
+
+Generates large, deterministic inventory datasets for benchmarks and capacity
+tests. It is the fast counterpart of tests/inventory_factory.py, and its
+defaults match that factory's fields. The same arguments and --seed always
+produce the same rows.
+
+Each product id is listed in each condition with the probability given by
+--conditions. The other fields are drawn from distributions given as
+    uniform[:low:high]  normal:mean:stddev  exponential:mean  constant:value
+and clamped to the valid range of the field.
+
+The rows are written as CSV (--csv, "-" for stdout) and/or loaded with
+COPY in batches into the inventory table of DATABASE_URI (--load)
+
+    python -m benchmarks.datagen --rows 10000000 --load --truncate
+    python -m benchmarks.datagen --rows 1000000 --seed 7 --csv inventory.csv \\
+        --conditions "new=0.9,used=0.4,open box=0.1" --quantity normal:20:8 --available 0.9
+"""
+import io
+import sys
+import time
+import random
+import argparse
+
+from service import keys
+
+CSV_HEADER = ",".join([keys.KEY_PID, keys.KEY_CND, keys.KEY_QTY, keys.KEY_LVL, keys.KEY_AVL])
+
+################################################################################
+def distribution(spec, low, high):
+    """ Returns a function drawing a clamped integer from a random.Random per spec """
+    kind, _, params = spec.partition(":")
+    params = [float(param) for param in params.split(":")] if params else []
+    if kind == "uniform" and len(params) in (0, 2):
+        first, last = (int(params[0]), int(params[1])) if params else (low, high)
+        draw = lambda rng: rng.randint(first, last)
+    elif kind == "normal" and len(params) == 2:
+        draw = lambda rng: round(rng.gauss(params[0], params[1]))
+    elif kind == "exponential" and len(params) == 1 and params[0] > 0:
+        draw = lambda rng: round(rng.expovariate(1 / params[0]))
+    elif kind == "constant" and len(params) == 1:
+        draw = lambda rng: int(params[0])
+    else:
+        raise argparse.ArgumentTypeError("invalid distribution: {}".format(spec))
+    return lambda rng: min(high, max(low, draw(rng)))
+
+def condition_probabilities(spec):
+    """ Returns the (condition, probability) pairs of "new=0.9,used=0.4,..." """
+    pairs = []
+    for item in spec.split(","):
+        condition, _, probability = item.partition("=")
+        condition = condition.strip()
+        try:
+            probability = float(probability)
+        except ValueError:
+            raise argparse.ArgumentTypeError("invalid condition probability: {}".format(item))
+        if condition not in keys.CONDITIONS or not 0 <= probability <= 1:
+            raise argparse.ArgumentTypeError("invalid condition probability: {}".format(item))
+        pairs.append((condition, probability))
+    return pairs
+
+def generate_rows(rows, seed=0, start_id=1, conditions=None, quantity=None,
+                  restock_level=None, available=0.5):
+    """
+    Yields rows (product_id, condition, quantity, restock_level, available) tuples
+    Args: conditions (list): (condition, probability) pairs, by default every
+                             condition with probability 0.5
+          quantity, restock_level (function): draw a value from a random.Random
+          available (Float): the probability a row is available
+    """
+    if rows <= 0:
+        return
+    rng = random.Random(seed)
+    conditions = conditions or [(condition, 0.5) for condition in keys.CONDITIONS]
+    if not any(probability for _, probability in conditions):
+        raise ValueError("No condition has a chance of being generated")
+    quantity = quantity or distribution("uniform", keys.QTY_LOW, keys.QTY_HIGH)
+    restock_level = restock_level or distribution("uniform", keys.QTY_LOW, keys.RESTOCK_LVL)
+    product_id = start_id
+    while True:
+        for condition, probability in conditions:
+            if rng.random() < probability:
+                yield (product_id, condition, quantity(rng), restock_level(rng),
+                       keys.AVAILABLE_TRUE if rng.random() < available else keys.AVAILABLE_FALSE)
+                rows -= 1
+                if not rows:
+                    return
+        product_id += 1
+
+def csv_lines(rows):
+    """ Yields the CSV lines of generated rows; conditions never need quoting """
+    for row in rows:
+        yield "%d,%s,%d,%d,%d\n" % row
+
+def load(rows, truncate=False, batch_size=keys.COPY_BATCH_SIZE, progress=None):
+    """ Loads generated rows into the inventory table with COPY, batch_size rows per COPY """
+    from service.model import DB, InventoryStats
+    connection = DB.engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        if truncate:
+            cursor.execute("TRUNCATE inventory")
+        lines = csv_lines(rows)
+        loaded = 0
+        while True:
+            batch = list(zip(range(batch_size), lines))
+            if not batch:
+                break
+            cursor.copy_expert(
+                "COPY inventory ({}) FROM STDIN WITH (FORMAT csv)".format(CSV_HEADER),
+                io.StringIO("".join(line for _, line in batch)))
+            connection.commit()
+            loaded += len(batch)
+            if progress:
+                progress(loaded)
+    finally:
+        connection.close()
+    if truncate:
+        # TRUNCATE bypasses the counter triggers
+        InventoryStats.reconcile()
+    return loaded
+
+def main():
+    """ Parses the arguments and writes the dataset """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument('--rows', type=int, required=True, help='number of rows to generate')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    parser.add_argument('--start-id', type=int, default=1, help='first product id')
+    parser.add_argument('--conditions', type=condition_probabilities,
+                        default=",".join("{}=0.5".format(cnd) for cnd in keys.CONDITIONS),
+                        help='chance of a product being listed in each condition')
+    parser.add_argument('--quantity', default="uniform",
+                        type=lambda spec: distribution(spec, keys.QTY_LOW, keys.QTY_HIGH),
+                        help='quantity distribution')
+    parser.add_argument('--restock-level', default="uniform",
+                        type=lambda spec: distribution(spec, keys.QTY_LOW, keys.RESTOCK_LVL),
+                        help='restock level distribution')
+    parser.add_argument('--available', type=float, default=0.5,
+                        help='chance of a row being available')
+    parser.add_argument('--csv', help='write the rows to this CSV file, - for stdout')
+    parser.add_argument('--load', action='store_true',
+                        help='COPY the rows into the inventory table of DATABASE_URI')
+    parser.add_argument('--truncate', action='store_true',
+                        help='empty the inventory table before loading')
+    args = parser.parse_args()
+    if not args.csv and not args.load:
+        parser.error("nothing to do, pass --csv and/or --load")
+
+    def rows():
+        return generate_rows(args.rows, args.seed, args.start_id, args.conditions,
+                             args.quantity, args.restock_level, args.available)
+
+    start = time.perf_counter()
+    if args.csv:
+        output = sys.stdout if args.csv == "-" else open(args.csv, "w")
+        try:
+            output.write(CSV_HEADER + "\n")
+            output.writelines(csv_lines(rows()))
+        finally:
+            if output is not sys.stdout:
+                output.close()
+    if args.load:
+        loaded = load(rows(), args.truncate, progress=lambda loaded: print(
+            "{} rows loaded".format(loaded), file=sys.stderr, flush=True))
+        print("Loaded {} rows in {:.1f}s".format(loaded, time.perf_counter() - start),
+              file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""
+Reserve Contention Benchmark
+
+Many parallel checkouts reserving one unit each from a single hot record.
+Compares the atomic reserve endpoint against a client-side read-modify-write
+(GET, then PUT with If-Match, retrying on 412/409), and checks that neither
+oversells: the number of successful checkouts must equal the stock.
+
+Runs in-process through the Flask test client, or against a running service
+with --url (e.g. --url http://localhost:5000)
+
+    python -m benchmarks.reserve_contention --clients 32 --rounds 20
+"""
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from service import keys
+from service.model import Inventory
+from benchmarks.common import Client, percentile
+
+HOT_PID = 999999
+HOT_CND = "new"
+
+def reserve_atomic(client, path):
+    """ One checkout with the reserve endpoint; returns (reserved, attempts) """
+    code, _, _ = client.request('POST', path + "/reserve", json={keys.KEY_AMT: 1})
+    return code == 200, 1
+
+def reserve_read_modify_write(client, path):
+    """ One checkout with GET then a conditional PUT; returns (reserved, attempts) """
+    attempts = 0
+    while True:
+        attempts += 1
+        code, body, headers = client.request('GET', path)
+        if code != 200 or body[keys.KEY_QTY] < 1 or not body[keys.KEY_AVL]:
+            return False, attempts
+        quantity = body[keys.KEY_QTY] - 1
+        update = {keys.KEY_QTY: quantity,
+                  keys.KEY_AVL: keys.AVAILABLE_TRUE if quantity else keys.AVAILABLE_FALSE}
+        code, _, _ = client.request('PUT', path, json=update,
+                                    headers={'If-Match': headers['ETag']})
+        if code == 200:
+            return True, attempts
+        if code not in (409, 412):
+            return False, attempts
+
+STRATEGIES = {
+    'reserve': reserve_atomic,
+    'read-modify-write': reserve_read_modify_write
+}
+
+def reset(stock):
+    """ Puts the hot record back at the given stock """
+    if Inventory.find_by_product_id_condition(HOT_PID, HOT_CND) is None:
+        Inventory(product_id=HOT_PID, condition=HOT_CND, quantity=stock,
+                  restock_level=0, available=keys.AVAILABLE_TRUE).create()
+    Inventory.update_by_key(HOT_PID, HOT_CND,
+                            {keys.KEY_QTY: stock, keys.KEY_AVL: keys.AVAILABLE_TRUE})
+
+def run(strategy, client, clients, rounds, stock, oversubscribe):
+    """ Runs the rounds of one strategy and prints its numbers """
+    path = "/api/inventory/{}/condition/{}".format(HOT_PID, HOT_CND)
+    checkout = STRATEGIES[strategy]
+    checkouts = stock + oversubscribe
+    latencies = []
+    reserved = attempts = 0
+    elapsed = 0.0
+
+    def timed(_):
+        start = time.perf_counter()
+        result = checkout(client, path)
+        return result, time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        for _ in range(rounds):
+            reset(stock)
+            start = time.perf_counter()
+            results = list(pool.map(timed, range(checkouts)))
+            elapsed += time.perf_counter() - start
+            won = sum(1 for (ok, _), _ in results if ok)
+            remaining = Inventory.find_by_product_id_condition(HOT_PID, HOT_CND)
+            if won != stock or remaining.quantity != 0 or remaining.available:
+                raise SystemExit("{}: {} checkouts for a stock of {}, {} left"\
+                                 .format(strategy, won, stock, remaining.quantity))
+            reserved += won
+            attempts += sum(tries for (_, tries), _ in results)
+            latencies.extend(latency for _, latency in results)
+
+    latencies.sort()
+    print("{:<18} {:>9.0f} {:>9.2f} {:>9.2f} {:>9.2f} {:>9.2f}".format(
+        strategy, len(latencies) / elapsed, attempts / len(latencies),
+        percentile(latencies, 50) * 1000, percentile(latencies, 95) * 1000,
+        percentile(latencies, 99) * 1000))
+    return reserved
+
+def main():
+    """ Parses the arguments and runs every requested strategy """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument('--clients', type=int, default=16, help='parallel checkouts')
+    parser.add_argument('--rounds', type=int, default=10, help='times the stock is refilled')
+    parser.add_argument('--stock', type=int, default=keys.QTY_HIGH, help='stock per round')
+    parser.add_argument('--oversubscribe', type=int, default=10,
+                        help='checkouts per round beyond the stock, which must all fail')
+    parser.add_argument('--strategy', choices=list(STRATEGIES), action='append',
+                        help='strategy to run (default: all)')
+    parser.add_argument('--url', help='base URL of a running service (default: in-process)')
+    args = parser.parse_args()
+
+    client = Client(args.url)
+    reset(args.stock)
+    client.warm_up("/api/inventory/{}/condition/{}".format(HOT_PID, HOT_CND))
+    print("{:<18} {:>9} {:>9} {:>9} {:>9} {:>9}".format(
+        'strategy', 'req/s', 'tries', 'p50 ms', 'p95 ms', 'p99 ms'))
+    for strategy in args.strategy or list(STRATEGIES):
+        run(strategy, client, args.clients, args.rounds, args.stock, args.oversubscribe)
+    Inventory.find_by_product_id_condition(HOT_PID, HOT_CND).delete()
+
+if __name__ == '__main__':
+    main()
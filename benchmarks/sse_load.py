@@ -0,0 +1,181 @@
+"""
+Server-Sent Events Load Test
+
+Serves the ASGI app of service/asgi.py under uvicorn with one worker, opens
+thousands of idle GET /api/inventory/events streams to it, and reports what
+they cost and how fast a change reaches them:
+
+    rss_mb            the worker's resident memory, before and with the streams
+    per_stream_kb     the extra memory per open stream
+    fanout_p50/p99_ms from the answer to a write to the arrival of its event,
+                      over every stream that asked for it
+
+A third of the streams filter on the product written to, a third on other
+products and get nothing, and the rest take every change. The streams are
+sockets of this process, so on a small machine the client's own reading adds
+to the fan-out latency. Each stream is a file descriptor: ulimit -n must be
+above --subscribers.
+
+Like the suite, it recreates the inventory tables of DATABASE_URI
+
+    python -m benchmarks.sse_load --subscribers 5000 --writes 20
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import resource
+import subprocess
+from collections import OrderedDict
+
+import httpx
+
+from benchmarks.common import percentile, quiet
+from benchmarks.suite import populate, key_of
+
+URL = "/api/inventory/{}/condition/{}"
+
+SERVER = [sys.executable, '-m', 'uvicorn', 'service.asgi:app', '--workers=1',
+          '--port={port}', '--log-level=warning', '--no-access-log', '--backlog=4096',
+          '--timeout-graceful-shutdown=5']
+
+################################################################################
+def start(port):
+    """ Starts the server and returns its process once it answers """
+    process = subprocess.Popen([part.format(port=port) for part in SERVER],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                               env=dict(os.environ, LOGGING_LEVEL="WARNING"))
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("{} exited with {}".format(SERVER, process.returncode))
+        try:
+            httpx.get("http://127.0.0.1:{}{}".format(port, URL.format(1, "new")), timeout=1)
+            return process
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError("{} did not start".format(SERVER))
+
+def rss_mb(pid):
+    """ Returns the resident memory of a process, in megabytes """
+    with open("/proc/{}/status".format(pid)) as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    raise RuntimeError("No VmRSS for {}".format(pid))
+
+class Stream():
+    """ One idle subscriber, reading its events off a raw socket """
+
+    def __init__(self, port, query):
+        self.port = port
+        self.query = query
+        self.received = []
+        self.reader = self.writer = None
+
+    async def open(self):
+        """ Connects and waits for the response headers """
+        self.reader, self.writer = await asyncio.open_connection('127.0.0.1', self.port)
+        self.writer.write("GET /api/inventory/events{} HTTP/1.1\r\nHost: localhost\r\n"
+                          "Accept: text/event-stream\r\n\r\n".format(self.query).encode())
+        headers = await self.reader.readuntil(b"\r\n\r\n")
+        if not headers.startswith(b"HTTP/1.1 200"):
+            raise RuntimeError(headers.decode())
+
+    async def read(self):
+        """ Records the arrival time and version of every event until the socket closes """
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                return
+            if line.startswith(b"data: "):
+                self.received.append((time.perf_counter(), json.loads(line[6:])['version']))
+
+    def close(self):
+        """ Closes the socket """
+        self.writer.close()
+
+async def load(port, pid, rows, subscribers, writes, pause):
+    """
+    Opens the streams, writes to one record, and returns the server's memory with
+    the streams open, the fan-out latencies and the number of events that never came
+    """
+    product_id, condition = key_of(random.randrange(rows), rows)
+    others = ",".join(str(other) for other in
+                      {key_of(random.randrange(rows), rows)[0] for _ in range(10)} - {product_id})
+    queries = ["", "?product_id={}".format(product_id), "?product_id=" + others]
+    streams = [Stream(port, queries[number % 3]) for number in range(subscribers)]
+    expected = sum(1 for stream in streams if stream.query != queries[2])
+
+    for index in range(0, subscribers, 500):
+        await asyncio.gather(*[stream.open() for stream in streams[index:index + 500]])
+    readers = [asyncio.ensure_future(stream.read()) for stream in streams]
+    await asyncio.sleep(1)
+    loaded = rss_mb(pid)
+
+    sent = {}
+    async with httpx.AsyncClient(base_url="http://127.0.0.1:{}".format(port)) as client:
+        for number in range(writes):
+            action = "deactivate" if number % 2 else "activate"
+            started = time.perf_counter()
+            response = await client.put(URL.format(product_id, condition) + "/" + action)
+            response.raise_for_status()
+            sent[response.json()['version']] = started
+            await asyncio.sleep(pause)
+    await asyncio.sleep(1)
+
+    latencies = sorted(arrival - sent[version] for stream in streams
+                       for arrival, version in stream.received if version in sent)
+    for stream in streams:
+        stream.close()
+    for reader in readers:
+        reader.cancel()
+    await asyncio.gather(*readers, return_exceptions=True)
+    return loaded, latencies, expected * writes - len(latencies)
+
+def main():
+    """ Parses the arguments, starts the server and loads it with idle streams """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument('--rows', type=int, default=10000, help='records in the table')
+    parser.add_argument('--subscribers', type=int, default=5000, help='open event streams')
+    parser.add_argument('--writes', type=int, default=20, help='writes fanned out')
+    parser.add_argument('--pause', type=float, default=0.5, help='seconds between writes')
+    parser.add_argument('--port', type=int, default=8093, help='port of the started server')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    args = parser.parse_args()
+
+    limit = resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+    if limit <= args.subscribers + 100:
+        parser.error("ulimit -n is {}, raise it above --subscribers".format(limit))
+    quiet()
+    random.seed(0)
+    populate(args.rows)
+    process = start(args.port)
+    try:
+        idle = rss_mb(process.pid)
+        loaded, latencies, missing = asyncio.get_event_loop().run_until_complete(load(
+            args.port, process.pid, args.rows, args.subscribers, args.writes, args.pause))
+    finally:
+        process.terminate()
+        process.wait()
+
+    results = OrderedDict([
+        ('subscribers', args.subscribers),
+        ('rss_mb', OrderedDict([('idle', round(idle, 1)), ('loaded', round(loaded, 1))])),
+        ('per_stream_kb', round((loaded - idle) * 1024 / args.subscribers, 1)),
+        ('fanout_p50_ms', round(percentile(latencies, 50) * 1000, 1)),
+        ('fanout_p99_ms', round(percentile(latencies, 99) * 1000, 1)),
+        ('events', len(latencies)),
+        ('missing', missing)
+    ])
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+
+if __name__ == '__main__':
+    main()
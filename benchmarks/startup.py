@@ -0,0 +1,112 @@
+"""
+Startup Benchmark
+
+Times how long a fresh process takes to get the service ready, with the tables
+created at startup (DB_CREATE_SCHEMA=true, the default) and without
+(DB_CREATE_SCHEMA=false, the schema being created once with flask create-schema):
+
+    interpreter   python -c pass, the floor under everything else
+    import        python -c "import service", what every worker and test process pays
+    first_answer  gunicorn started with one worker, as in the Procfile, until
+                  its first answer to a GET
+
+Every run is a new process, so the numbers include the interpreter and the
+connection to DATABASE_URI. Unlike the other benchmarks it does not touch the data
+
+    python -m benchmarks.startup --runs 10
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+from collections import OrderedDict
+
+import httpx
+
+from service import keys
+from benchmarks.common import percentile
+
+PATH = "/api/inventory/1/condition/new"
+
+GUNICORN = [os.path.join(os.path.dirname(sys.executable), 'gunicorn'), '--workers=1',
+            '--bind=127.0.0.1:{port}', '--log-level=warning']
+
+################################################################################
+def environment(create_schema):
+    """ Returns the environment of a started process """
+    return dict(os.environ, **{keys.KEY_DB_CREATE_SCHEMA: str(create_schema).lower()})
+
+def run(command, create_schema):
+    """ Returns how long a command took to exit """
+    started = time.perf_counter()
+    subprocess.run(command, env=environment(create_schema), check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - started
+
+def first_answer(command, create_schema, port):
+    """ Returns how long a server took from its start to its first answer """
+    started = time.perf_counter()
+    process = subprocess.Popen([part.format(port=port) for part in command],
+                               env=environment(create_schema),
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while process.poll() is None:
+            try:
+                httpx.get("http://127.0.0.1:{}{}".format(port, PATH), timeout=5)
+                return time.perf_counter() - started
+            except httpx.TransportError:
+                time.sleep(0.005)
+        raise RuntimeError("{} exited with {}".format(command, process.returncode))
+    finally:
+        process.terminate()
+        process.wait()
+
+def scenarios(port):
+    """ Returns the benchmarks as {name: function timing one run} """
+    def interpreter(create_schema):
+        return run([sys.executable, '-c', 'pass'], create_schema)
+
+    def import_service(create_schema):
+        return run([sys.executable, '-c', 'import service'], create_schema)
+
+    def gunicorn(create_schema):
+        return first_answer(GUNICORN + ['service:app'], create_schema, port)
+
+    return OrderedDict([('interpreter', interpreter), ('import', import_service),
+                        ('first_answer', gunicorn)])
+
+def measure(timer, create_schema, runs):
+    """ Returns the p50 and the slowest of runs timings, in milliseconds """
+    samples = sorted(timer(create_schema) for _ in range(runs))
+    return OrderedDict([('p50_ms', round(percentile(samples, 50) * 1000, 1)),
+                        ('max_ms', round(samples[-1] * 1000, 1))])
+
+def main():
+    """ Parses the arguments and times every startup both ways """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument('--runs', type=int, default=10, help='processes started per benchmark')
+    parser.add_argument('--port', type=int, default=8092, help='port of the started servers')
+    parser.add_argument('--only', help='only run benchmarks whose name contains this')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    args = parser.parse_args()
+
+    # The schema must exist for the lazy runs to answer
+    run([sys.executable, '-c', 'import service'], True)
+    results = OrderedDict()
+    for name, timer in scenarios(args.port).items():
+        if args.only and args.only not in name:
+            continue
+        for mode, create_schema in (('eager', True), ('lazy', False)):
+            result = measure(timer, create_schema, args.runs)
+            results.setdefault(name, OrderedDict())[mode] = result
+            print("{:<13} {:<6} p50 {:>8} ms  max {:>8} ms".format(
+                name, mode, result['p50_ms'], result['max_ms']), flush=True)
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(OrderedDict([('runs', args.runs), ('results', results)]), output, indent=2)
+
+if __name__ == '__main__':
+    main()
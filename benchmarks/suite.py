@@ -0,0 +1,237 @@
+"""
+Benchmark Suite
+
+Times the model and API hot paths and compares them against a stored baseline,
+so an upgrade of Flask, flask-restplus or SQLAlchemy that slows them down is
+caught before it ships. Every benchmark reports ops/s, p50/p99 latency, the
+non-2xx responses and the peak RSS of the process so far.
+
+It runs against the Postgres database in DATABASE_URI and, like the tests,
+drops and recreates the inventory tables, so point it at a scratch database
+
+    python -m benchmarks.suite --rows 1000,100000 --output results.json \\
+        --baseline benchmarks/baseline.json
+    python -m benchmarks.suite --rows 1000,100000,1000000 --save-baseline benchmarks/baseline.json
+"""
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import resource
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import flask
+import flask_restplus
+import sqlalchemy
+
+from service import keys, validation
+from service.model import Inventory, DB
+from service.routes import encode_cursor
+from benchmarks.common import Client, percentile, quiet
+
+RECORD = {keys.KEY_PID: 1, keys.KEY_CND: "new", keys.KEY_QTY: 10,
+          keys.KEY_LVL: 5, keys.KEY_AVL: keys.AVAILABLE_TRUE}
+
+################################################################################
+def measure(operation, seconds, clients=1, batch=1):
+    """
+    Calls operation(i) for about seconds from the given number of threads, with
+    batch calls per timed sample, and returns its numbers; operation returns
+    False (or a non-2xx status) when it failed
+    """
+    deadline = time.perf_counter() + seconds
+    counter = iter(range(sys.maxsize))
+
+    def worker():
+        samples, errors = [], 0
+        while True:
+            start = time.perf_counter()
+            for _ in range(batch):
+                result = operation(next(counter))
+                if result is False or (isinstance(result, int) and result >= 300):
+                    errors += 1
+            end = time.perf_counter()
+            samples.append((end - start) / batch)
+            if end >= deadline and len(samples) >= 3:
+                return samples, errors
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        results = list(pool.map(lambda _: worker(), range(clients)))
+    elapsed = time.perf_counter() - start
+    samples = sorted(sample for result in results for sample in result[0])
+    calls = len(samples) * batch
+    return OrderedDict([
+        ('ops_per_sec', round(calls / elapsed, 1)),
+        ('p50_ms', round(percentile(samples, 50) * 1000, 4)),
+        ('p99_ms', round(percentile(samples, 99) * 1000, 4)),
+        ('calls', calls),
+        ('errors', sum(result[1] for result in results)),
+        # ru_maxrss is in kilobytes on Linux
+        ('peak_rss_mb', round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1))
+    ])
+
+def populate(rows):
+    """ Recreates the tables with rows records spread over the conditions """
+    DB.session.remove()
+    DB.drop_all()
+    DB.create_all()
+    DB.session.execute(sqlalchemy.text(
+        "INSERT INTO inventory (product_id, condition, quantity, restock_level, available) "
+        "SELECT g / :conditions, (:names)[g % :conditions + 1], g % :quantity, :level, g % 2 "
+        "FROM generate_series(:conditions, (:rows + 1) * :conditions - 1) g "
+        "LIMIT :rows"), {'rows': rows, 'conditions': len(keys.CONDITIONS),
+                         'names': keys.CONDITIONS, 'quantity': keys.QTY_HIGH,
+                         'level': keys.RESTOCK_LVL // 2})
+    DB.session.commit()
+    DB.session.execute("ANALYZE inventory")
+    DB.session.commit()
+
+def key_of(i, rows):
+    """ Returns the (product_id, condition) of the i-th populated record """
+    i = i % rows + len(keys.CONDITIONS)
+    return i // len(keys.CONDITIONS), keys.CONDITIONS[i % len(keys.CONDITIONS)]
+
+######################################################################
+# BENCHMARKS
+######################################################################
+# Each benchmark generator yields (name, operation, concurrent, batch) in the
+# order they run; the work between the yields prepares the next benchmark
+
+def model_benchmarks():
+    """ The per-record model work, without the database """
+    inventory = Inventory().deserialize(RECORD)
+    yield 'model.serialize', lambda i: inventory.serialize(), False, 1000
+    yield 'model.deserialize', lambda i: Inventory().deserialize(RECORD), False, 1000
+    yield 'model.validate_data', lambda i: inventory.validate_data(), False, 100
+    records = [dict(RECORD, product_id=pid) for pid in range(1000)]
+    yield 'model.validate_records@1000', lambda i: validation.validate_records(records), False, 1
+    yield 'model.validate_data@1000', \
+        lambda i: [Inventory().deserialize(record).validate_data() for record in records], False, 1
+
+def api_benchmarks(client, rows):
+    """ The API over a table of rows records """
+    url = "/api/inventory/{}/condition/{}"
+
+    def get_one(i):
+        return client.request('GET', url.format(*key_of(random.randrange(rows), rows)))[0]
+    yield 'api.get_one', get_one, False, 1
+
+    yield 'api.list_json', lambda i: client.request('GET', "/api/inventory")[0], False, 1
+    ndjson = {'Accept': keys.KEY_CONTENT_TYPE_NDJSON}
+    yield 'api.list_ndjson', \
+        lambda i: client.request('GET', "/api/inventory", headers=ndjson)[0], False, 1
+
+    def list_page(i):
+        cursor = encode_key(key_of(random.randrange(rows), rows))
+        return client.request('GET', "/api/inventory?limit=100&after=" + cursor)[0]
+    yield 'api.list_page', list_page, False, 1
+
+    def put(i):
+        pid, cnd = key_of(random.randrange(rows), rows)
+        body = dict(RECORD, product_id=pid, condition=cnd, quantity=i % keys.QTY_HIGH)
+        return client.request('PUT', url.format(pid, cnd), json=body)[0]
+    yield 'api.put', put, True, 1
+
+    DB.session.execute("UPDATE inventory SET quantity = 0")
+    DB.session.commit()
+
+    def restock(i):
+        path = url.format(*key_of(random.randrange(rows), rows)) + "/restock"
+        return client.request('PUT', path, json={keys.KEY_AMT: 1})[0]
+    yield 'api.restock', restock, True, 1
+
+    def post(i):
+        body = dict(RECORD, product_id=rows + 1 + i)
+        return client.request('POST', "/api/inventory", json=body)[0]
+    yield 'api.post', post, True, 1
+
+def encode_key(key):
+    """ Returns the page cursor of a (product_id, condition) key """
+    return encode_cursor({keys.KEY_PID: key[0], keys.KEY_CND: key[1]})
+
+######################################################################
+# BASELINE
+######################################################################
+def compare(results, baseline, tolerance):
+    """ Returns the benchmarks that got slower than the baseline by more than tolerance """
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        if result['ops_per_sec'] < base['ops_per_sec'] * (1 - tolerance):
+            regressions.append("{}: {} ops/s, baseline {}".format(
+                name, result['ops_per_sec'], base['ops_per_sec']))
+        if result['p99_ms'] > base['p99_ms'] * (1 + tolerance):
+            regressions.append("{}: p99 {} ms, baseline {}".format(
+                name, result['p99_ms'], base['p99_ms']))
+    return regressions
+
+def environment():
+    """ Returns the versions the results were measured with """
+    return OrderedDict([
+        ('python', platform.python_version()),
+        ('flask', flask.__version__),
+        ('flask_restplus', flask_restplus.__version__),
+        ('sqlalchemy', sqlalchemy.__version__),
+        ('machine', platform.machine()),
+        ('timestamp', time.strftime("%Y-%m-%dT%H:%M:%S"))
+    ])
+
+def main():
+    """ Parses the arguments, runs the suite and compares it against the baseline """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument('--rows', default="1000,100000",
+                        help='comma separated table sizes to run the API benchmarks at')
+    parser.add_argument('--seconds', type=float, default=2.0, help='time spent per benchmark')
+    parser.add_argument('--clients', type=int, default=8,
+                        help='parallel clients of the write benchmarks')
+    parser.add_argument('--only', help='only run benchmarks whose name contains this')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='compare against the results in this JSON file')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='slowdown against the baseline that counts as a regression')
+    parser.add_argument('--save-baseline', help='write the results as the new baseline')
+    args = parser.parse_args()
+
+    quiet()
+    random.seed(0)
+    client = Client()
+    results = OrderedDict()
+
+    def run(benchmarks, suffix=""):
+        for name, operation, concurrent, batch in benchmarks:
+            name += suffix
+            if args.only and args.only not in name:
+                continue
+            result = measure(operation, args.seconds, args.clients if concurrent else 1, batch)
+            results[name] = result
+            print("{:<32} {:>12} ops/s  p50 {:>9} ms  p99 {:>9} ms  errors {:>5}  rss {:>7} MB"
+                  .format(name, result['ops_per_sec'], result['p50_ms'], result['p99_ms'],
+                          result['errors'], result['peak_rss_mb']), flush=True)
+
+    run(model_benchmarks())
+    for rows in [int(rows) for rows in args.rows.split(",")]:
+        populate(rows)
+        client.warm_up("/api/inventory/1/condition/new")
+        run(api_benchmarks(client, rows), "@{}".format(rows))
+
+    report = OrderedDict([('environment', environment()), ('results', results)])
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, 'w') as output:
+                json.dump(report, output, indent=2)
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            regressions = compare(results, json.load(baseline)['results'], args.tolerance)
+        for regression in regressions:
+            print("REGRESSION " + regression)
+        if regressions:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
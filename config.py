@@ -1,5 +1,6 @@
 import os
 import logging
+import tempfile
 from service import keys
 
 # Get configuration from environment
@@ -12,6 +13,50 @@ DATABASE_URI = os.getenv(
 SQLALCHEMY_DATABASE_URI = DATABASE_URI
 SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+# Read-through cache for single Inventory lookups. Each process has its own, and a
+# write only clears the cache of the process that made it, so the other workers
+# (and the ASGI mode) answer stale records and ETags for up to CACHE_TTL seconds.
+# Only enable it when a single worker serves the API
+CACHE_ENABLED = os.getenv(keys.KEY_CACHE_ENABLED, "false").lower() in ["1", "true", "yes"]
+CACHE_MAXSIZE = int(os.getenv(keys.KEY_CACHE_MAXSIZE, "10000"))
+CACHE_TTL = float(os.getenv(keys.KEY_CACHE_TTL, "30"))
+
+# Connection pool, sized per gunicorn worker: each worker holds up to
+# DB_POOL_SIZE + DB_MAX_OVERFLOW connections
+DB_POOL_SIZE = int(os.getenv(keys.KEY_DB_POOL_SIZE, "5"))
+DB_MAX_OVERFLOW = int(os.getenv(keys.KEY_DB_MAX_OVERFLOW, "10"))
+DB_POOL_TIMEOUT = float(os.getenv(keys.KEY_DB_POOL_TIMEOUT, "30"))
+# Seconds before a connection is replaced, -1 never. The ASGI mode's asyncpg pool
+# has no maximum age and closes connections idle that long instead
+DB_POOL_RECYCLE = int(os.getenv(keys.KEY_DB_POOL_RECYCLE, "1800"))
+DB_POOL_PRE_PING = os.getenv(keys.KEY_DB_POOL_PRE_PING, "true").lower() in ["1", "true", "yes"]
+# Milliseconds, 0 turns the statement timeout off
+DB_STATEMENT_TIMEOUT = int(os.getenv(keys.KEY_DB_STATEMENT_TIMEOUT, "0"))
+
+# Create the missing tables when the service starts. Turned off, starting does no
+# database I/O and the schema is created once per deploy with: flask create-schema
+DB_CREATE_SCHEMA = os.getenv(keys.KEY_DB_CREATE_SCHEMA, "true").lower() in ["1", "true", "yes"]
+
+# One log line per request: successes are sampled at this rate (0 to 1), while
+# errors and requests slower than REQUEST_LOG_SLOW_MS are always logged
+REQUEST_LOG_SAMPLE_RATE = float(os.getenv(keys.KEY_REQUEST_LOG_SAMPLE_RATE, "1.0"))
+REQUEST_LOG_SLOW_MS = float(os.getenv(keys.KEY_REQUEST_LOG_SLOW_MS, "1000"))
+
+# Seconds the change feed keeps a change for: flask prune-changes deletes older ones
+CHANGES_RETENTION = int(os.getenv(keys.KEY_CHANGES_RETENTION, str(7 * 24 * 3600)))
+
+# Server-Sent Events of the ASGI mode: events a subscriber may fall behind by before
+# it is dropped, seconds between reads of the feed without a notification, and
+# seconds between the comments that keep an idle stream open
+SSE_BUFFER_SIZE = int(os.getenv(keys.KEY_SSE_BUFFER_SIZE, "1000"))
+SSE_POLL_INTERVAL = float(os.getenv(keys.KEY_SSE_POLL_INTERVAL, "1"))
+SSE_KEEPALIVE = float(os.getenv(keys.KEY_SSE_KEEPALIVE, "15"))
+
+# Opt-in profiling of requests sent with X-Profile: 1 and the API key
+PROFILING_ENABLED = os.getenv(keys.KEY_PROFILING_ENABLED, "false").lower() in ["1", "true", "yes"]
+PROFILE_DIR = os.getenv(keys.KEY_PROFILE_DIR,
+                        os.path.join(tempfile.gettempdir(), "inventory-profiles"))
+
 # Secret for session management
 SECRET_KEY = os.getenv(keys.KET_SECRET, "sup3r-s3cr3t")
 LOGGING_LEVEL = logging.INFO
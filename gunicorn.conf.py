@@ -0,0 +1,32 @@
+"""
+Gunicorn configuration for the Inventory service
+
+Read by gunicorn from the working directory. Workers share their Prometheus
+metrics through files in prometheus_multiproc_dir, which is emptied when the
+server starts so samples of an earlier run are not reported again.
+With --preload the app is imported once in the master and the workers are forked
+from it, which boots them faster; run it with DB_CREATE_SCHEMA=false so the
+master does no database I/O
+"""
+import os
+import shutil
+import tempfile
+
+METRICS_DIR = os.environ.setdefault('prometheus_multiproc_dir',
+                                    os.path.join(tempfile.gettempdir(), 'inventory-metrics'))
+
+def on_starting(server):
+    """ Starts with an empty metrics directory """
+    shutil.rmtree(METRICS_DIR, ignore_errors=True)
+    os.makedirs(METRICS_DIR)
+
+def post_fork(server, worker):
+    """ Drops the pooled connections a preloaded app inherited from the master """
+    if server.cfg.preload_app:
+        from service.model import DB
+        DB.engine.dispose()
+
+def child_exit(server, worker):
+    """ Drops the live gauges of a worker that exited """
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -17,7 +17,7 @@ app.config['LOGGING_LEVEL'] = logging.INFO
 app.config['API_KEY'] = os.getenv('API_KEY')
 
 # Import the service After the Flask app is created
-from service import routes, keys
+from service import routes, keys, commands, metrics, profiling, request_log
 
 # Set up logging for production
 print("Setting up logging for {}...".format(__name__))
@@ -28,12 +28,15 @@ if __name__ != "__main__":
         app.logger.handlers = GUNICORN_LOGGER.handlers
         app.logger.setLevel(GUNICORN_LOGGER.level)
     app.logger.info("Logging established")
+# The request log (service.requests) propagates to app.logger, so it uses these
+# handlers and this level too
+request_log.init_app(app)
 
 app.logger.info(70 * "*")
 app.logger.info("  I N V E N T O R Y   S T O R E   S E R V I C E  ".center(70, "*"))
 app.logger.info(70 * "*")
 
-# make our sqlalchemy tables
+# make our sqlalchemy tables, unless DB_CREATE_SCHEMA leaves that to flask create-schema
 routes.init_db()
 
 app.logger.info("Service inititalized!")
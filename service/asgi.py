@@ -0,0 +1,612 @@
+"""
+ASGI serving mode for Inventory
+
+Serves the /api/inventory routes of routes.py from an asyncio event loop, so a
+single worker keeps answering other requests while Postgres runs a query. The
+queries go through an asyncpg connection pool; they are the statements the
+model builds (find_by_filters, find_page, update_statement, ...) compiled for
+asyncpg, and records are validated and serialized by the same code as the
+Flask app, so both modes answer alike. Run it with
+
+    uvicorn service.asgi:app --port 8081 --timeout-graceful-shutdown 5
+
+The pool is sized by DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_RECYCLE and
+DB_STATEMENT_TIMEOUT. asyncpg has no maximum connection age, so here
+DB_POOL_RECYCLE closes the connections left idle that long instead, and
+turns that off at -1 or 0. This mode has no lookup cache. The routes that
+stay with the Flask app are the Swagger docs, /metrics, and /api/inventory/pool,
+/cache, /export and /import, which read or drive the state of its own workers
+or stream through a sync database session.
+
+It also serves GET /api/inventory/events, the change feed as Server-Sent Events
+(see events.py), which a sync worker could not hold open by the thousand.
+"""
+import re
+import json
+import hashlib
+import logging
+from functools import partial
+from contextlib import asynccontextmanager
+import asyncpg
+from flask_api import status
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import Query
+from starlette.applications import Starlette
+from starlette.endpoints import HTTPEndpoint
+from starlette.exceptions import HTTPException
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header, parse_etags, quote_etag
+
+from service import app as flask_app, keys, serializer
+from service.events import ChangeBroadcaster
+from service.model import Inventory, InventoryChange, InventoryChangeHorizon, InventoryStats, \
+    DataValidationError, PreconditionFailedError, OutOfStockError, CHANGE_SEQ
+from service.routes import encode_cursor, decode_cursor, encode_change_cursor, \
+    decode_change_cursor, amount_error, precondition_versions, bulk_result
+
+LOGGER = logging.getLogger("flask.app")
+
+# Statements are compiled for psycopg2, whose %(name)s binds become asyncpg's $n.
+# Queries are built on a Query(Inventory) without a session, which needs no Flask app context
+DIALECT = postgresql.psycopg2.dialect()
+BIND = re.compile(r"%\((\w+)\)s")
+
+TABLE = Inventory.__table__
+FIND_ONE = "SELECT {} FROM inventory WHERE product_id = $1 AND condition = $2".format(
+    ", ".join(serializer.FIELDS))
+CHANGE_MARKER = "SELECT last_value, is_called FROM {}".format(CHANGE_SEQ.name)
+NEXT_CHANGE = "SELECT nextval('{}')".format(CHANGE_SEQ.name)
+HORIZON = "SELECT txid, change_id FROM {} WHERE id = 1".format(
+    InventoryChangeHorizon.__tablename__)
+
+####################################################################################################
+#  D A T A B A S E
+####################################################################################################
+def compile_statement(statement):
+    """ Returns the SQL and positional arguments of a SQLAlchemy statement, for asyncpg """
+    compiled = statement.compile(dialect=DIALECT)
+    names = []
+
+    def number(match):
+        names.append(match.group(1))
+        return "${}".format(len(names))
+
+    sql = BIND.sub(number, compiled.string).replace("%%", "%")
+    return sql, [compiled.params[name] for name in names]
+
+def row_tuple(record):
+    """ Returns an Inventory record read by asyncpg as a serializer row tuple """
+    return tuple(record[field] for field in serializer.FIELDS)
+
+async def find_one(connection, pid, condition):
+    """ Returns the Inventory record with the given key, None if there is none """
+    return await connection.fetchrow(FIND_ONE, pid, condition)
+
+async def changed(connection):
+    """ Advances the table change marker once a write is committed, like Inventory.changed """
+    await connection.fetchval(NEXT_CHANGE)
+
+async def update_by_key(connection, pid, condition, values, versions=None, criteria=None,
+                        failure=None):
+    """ Inventory.update_by_key on an asyncpg connection """
+    LOGGER.debug("Updating (%s, %s) with %s", pid, condition, values)
+    sql, args = compile_statement(Inventory.update_statement(pid, condition, values,
+                                                             versions, criteria))
+    record = await connection.fetchrow(sql, *args)
+    if record is None:
+        current = await find_one(connection, pid, condition)
+        error = Inventory.update_failure(pid, condition, current and current[keys.KEY_VER],
+                                         versions, failure)
+        if error is None:
+            return None
+        raise error
+    await changed(connection)
+    return record
+
+async def fetch_changes(pool, after, limit):
+    """ InventoryChange.feed on an asyncpg pool, returning the records """
+    sql, args = compile_statement(InventoryChange.feed(after, limit,
+                                                       Query(InventoryChange)).statement)
+    return await pool.fetch(sql, *args)
+
+async def fetch_last_change(pool):
+    """ InventoryChange.last on an asyncpg pool, returning the record or None """
+    sql, args = compile_statement(InventoryChange.last(Query(InventoryChange)).statement)
+    return await pool.fetchrow(sql, *args)
+
+####################################################################################################
+#  U T I L I T Y   F U N C T I O N S
+####################################################################################################
+def abort(code, message):
+    """ Ends the request with a {"message": ...} error, like api.abort """
+    raise HTTPException(code, str(message))
+
+async def handle_http_error(request, error):
+    """ Answers the errors raised by abort() """
+    return JSONResponse({'message': error.detail}, error.status_code)
+
+def json_response(body, code=status.HTTP_200_OK, headers=None):
+    """ Returns a response with an already encoded JSON body """
+    return Response(body, code, headers, media_type=keys.KEY_CONTENT_TYPE_JSON)
+
+def record_response(record, code=status.HTTP_200_OK, headers=None):
+    """ Returns the JSON response of an Inventory record with its version as the ETag """
+    headers = dict(headers or {}, ETag=quote_etag(str(record[keys.KEY_VER])))
+    return json_response(serializer.dump_row(row_tuple(record)), code, headers)
+
+def not_modified(etag):
+    """ Returns an empty 304 NOT MODIFIED response for the given entity tag """
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={'ETag': quote_etag(etag)})
+
+async def payload(request):
+    """ Returns the decoded JSON body of a request, aborting with 400 if it is not JSON """
+    try:
+        return await request.json()
+    except ValueError:
+        abort(status.HTTP_400_BAD_REQUEST, "The browser (or proxy) sent a request that "
+              "this server could not understand.")
+
+def int_arg(request, name, low=None, high=None):
+    """ Returns an integer query string argument, None if absent, aborting with 400 if invalid """
+    value = request.query_params.get(name)
+    if value is None:
+        return None
+    try:
+        value = int(value)
+    except ValueError:
+        abort(status.HTTP_400_BAD_REQUEST, "Invalid data: {} must be an integer".format(name))
+    if (low is not None and value < low) or (high is not None and value > high):
+        abort(status.HTTP_400_BAD_REQUEST, "Invalid data: {} out of range".format(name))
+    return value
+
+def product_ids_arg(request):
+    """ Returns the set of the product_id arguments, repeated or comma separated, None if absent """
+    values = [value for arg in request.query_params.getlist(keys.KEY_PID)
+              for value in arg.split(",") if value.strip()]
+    if not values:
+        return None
+    try:
+        product_ids = {int(value) for value in values}
+    except ValueError:
+        abort(status.HTTP_400_BAD_REQUEST, "Invalid data: product_id must be an integer")
+    if len(product_ids) > keys.SSE_MAX_PRODUCT_IDS:
+        abort(status.HTTP_400_BAD_REQUEST, "Invalid data: too many product_id")
+    return product_ids
+
+def expected_versions(request, body=None):
+    """ routes.expected_versions for a Starlette request """
+    versions = precondition_versions(parse_etags(request.headers.get('if-match')), body)
+    if versions == []:
+        abort(status.HTTP_412_PRECONDITION_FAILED, "No current version matches the precondition")
+    return versions
+
+async def amount_from(connection, body, product_id, condition):
+    """ routes.amount_from on an asyncpg connection """
+    error = amount_error(body)
+    if error:
+        # A missing record takes precedence over a bad body
+        if not await find_one(connection, product_id, condition):
+            abort(status.HTTP_404_NOT_FOUND,
+                  "Inventory with ({}, {})".format(product_id, condition))
+        abort(status.HTTP_400_BAD_REQUEST, error)
+    return int(body[keys.KEY_AMT])
+
+def not_found(record, product_id, condition):
+    """ Aborts with 404 when an update found no record """
+    if record is None:
+        abort(status.HTTP_404_NOT_FOUND, "Inventory with ({}, {})".format(product_id, condition))
+
+async def list_response(request, inventories):
+    """ routes.list_response for an Inventory query built without a session """
+    params = request.query_params
+    accept = parse_accept_header(request.headers.get('accept'), MIMEAccept)
+    mimetype = accept.best_match([keys.KEY_CONTENT_TYPE_JSON, keys.KEY_CONTENT_TYPE_NDJSON])
+    limit = int_arg(request, keys.KEY_LIMIT, 1, keys.PAGE_LIMIT_MAX)
+    after = None
+    if params.get(keys.KEY_AFTER):
+        try:
+            after = decode_cursor(params[keys.KEY_AFTER])
+        except ValueError:
+            abort(status.HTTP_400_BAD_REQUEST, "Invalid data: malformed cursor")
+    sql, args = compile_statement(Inventory.rows(Inventory.find_page(inventories, limit,
+                                                                     after)).statement)
+    pool = request.app.state.pool
+
+    async with pool.acquire() as connection:
+        marker = "{}:{}".format(*await connection.fetchrow(CHANGE_MARKER))
+        full_path = "{}?{}".format(request.url.path, request.url.query)
+        etag = hashlib.md5("{}|{}|{}".format(marker, full_path, mimetype).encode()).hexdigest()
+        if parse_etags(request.headers.get('if-none-match')).contains(etag):
+            return not_modified(etag)
+        if mimetype != keys.KEY_CONTENT_TYPE_NDJSON:
+            rows = [tuple(record) for record in await connection.fetch(sql, *args)]
+
+    if mimetype == keys.KEY_CONTENT_TYPE_NDJSON:
+        LOGGER.debug("Streaming inventories")
+        return StreamingResponse(stream_ndjson(pool, sql, args),
+                                 media_type=keys.KEY_CONTENT_TYPE_NDJSON,
+                                 headers={'ETag': quote_etag(etag)})
+    headers = {'ETag': quote_etag(etag)}
+    if limit and len(rows) == limit:
+        headers[keys.KEY_NEXT_CURSOR] = encode_cursor(serializer.row_dict(rows[-1]))
+    LOGGER.debug("Returning %s inventories", len(rows))
+    return json_response(serializer.dump_rows(rows), headers=headers)
+
+####################################################################################################
+#  PATH: /inventory
+####################################################################################################
+class InventoryBase(HTTPEndpoint):
+    """
+    GET     /inventory - Return all Inventories
+    CREATE  /inventory - Create a new Inventory
+    """
+    #------------------------------------------------------------------
+    # LIST ALL INVENTORIES
+    #------------------------------------------------------------------
+    async def get(self, request):
+        """ Returns a collection of the inventory records """
+        LOGGER.debug("A GET request for ALL inventories with: %s", request.query_params)
+        return await list_response(request, Inventory.find_by_filters(
+            int_arg(request, keys.KEY_PID), request.query_params.get(keys.KEY_CND),
+            int_arg(request, keys.KEY_QTY), int_arg(request, keys.KEY_AVL), Query(Inventory)))
+
+    #------------------------------------------------------------------
+    # ADD A NEW INVENTORY
+    #------------------------------------------------------------------
+    async def post(self, request):
+        """ Creates an Inventory """
+        LOGGER.debug("Request to create an Inventory record")
+        body = await payload(request)
+        try:
+            inventory = Inventory().deserialize(body)
+            inventory.validate_data()
+        except DataValidationError as err:
+            abort(status.HTTP_400_BAD_REQUEST, err)
+        sql, args = compile_statement(postgresql.insert(TABLE).values({
+            keys.KEY_PID: int(inventory.product_id),
+            keys.KEY_CND: inventory.condition,
+            keys.KEY_QTY: int(inventory.quantity),
+            keys.KEY_LVL: int(inventory.restock_level),
+            keys.KEY_AVL: int(inventory.available)
+        }).on_conflict_do_nothing().returning(*TABLE.c))
+        async with request.app.state.pool.acquire() as connection:
+            record = await connection.fetchrow(sql, *args)
+            if record is None:
+                abort(status.HTTP_409_CONFLICT, "Inventory with ({}, {})".format(
+                    inventory.product_id, inventory.condition))
+            await changed(connection)
+        location = request.url_for('inventory', product_id=record[keys.KEY_PID],
+                                   condition=record[keys.KEY_CND])
+        LOGGER.debug("Inventory (%s, %s) created.", inventory.product_id, inventory.condition)
+        return record_response(record, status.HTTP_201_CREATED, {'Location': str(location)})
+
+####################################################################################################
+#  PATH: /inventory/low-stock
+####################################################################################################
+class InventoryLowStock(HTTPEndpoint):
+    """
+    GET     /inventory/low-stock - Return the Inventories due for a restock
+    """
+    async def get(self, request):
+        """ Returns the inventory records whose quantity is at or below their restock level """
+        condition = request.query_params.get(keys.KEY_CND)
+        LOGGER.debug("A GET request for low stock inventories with condition %s", condition)
+        return await list_response(request, Inventory.find_below_restock_level(
+            condition, Query(Inventory)))
+
+####################################################################################################
+#  PATH: /inventory/changes
+####################################################################################################
+class InventoryChanges(HTTPEndpoint):
+    """
+    GET     /inventory/changes - Return the changes to the Inventories after a cursor
+    """
+    async def get(self, request):
+        """ Returns the changes to the inventory records after a cursor, oldest first """
+        since = request.query_params.get(keys.KEY_SINCE)
+        limit = int_arg(request, keys.KEY_LIMIT, 1, keys.PAGE_LIMIT_MAX)
+        LOGGER.debug("A GET request for the inventory changes since %s", since)
+        after = None
+        if since:
+            try:
+                after = decode_change_cursor(since)
+            except ValueError:
+                abort(status.HTTP_400_BAD_REQUEST, "Invalid data: malformed cursor")
+        pool = request.app.state.pool
+        records = await fetch_changes(pool, after, limit or keys.CHANGES_LIMIT_DEFAULT)
+        # Read after the changes, like InventoryChange.since
+        horizon = await pool.fetchrow(HORIZON)
+        if after is not None and horizon is not None and after < tuple(horizon):
+            abort(status.HTTP_410_GONE, "Changes after the cursor were pruned")
+        changes = [InventoryChange(**dict(record)) for record in records]
+        headers = {}
+        if changes:
+            headers[keys.KEY_NEXT_CURSOR] = encode_change_cursor(changes[-1])
+        elif since:
+            headers[keys.KEY_NEXT_CURSOR] = since
+        return json_response(json.dumps([change.serialize() for change in changes]),
+                             headers=headers)
+
+####################################################################################################
+#  PATH: /inventory/stats
+####################################################################################################
+class InventoryStatsResource(HTTPEndpoint):
+    """
+    GET     /inventory/stats - Return the Inventory totals per condition
+    """
+    async def get(self, request):
+        """ Returns the record count, total quantity and available count of each condition """
+        LOGGER.debug("Request for the inventory stats")
+        sql, args = compile_statement(InventoryStats.summary_query().statement)
+        return JSONResponse(InventoryStats.totals(await request.app.state.pool.fetch(sql, *args)))
+
+####################################################################################################
+#  PATH: /inventory/bulk
+####################################################################################################
+class InventoryBulk(HTTPEndpoint):
+    """
+    CREATE  /inventory/bulk - Create many Inventories in one transaction
+    """
+    async def post(self, request):
+        """ Creates a batch of Inventories, like Inventory.create_bulk """
+        LOGGER.info("Request to create Inventory records in bulk")
+        records = await payload(request)
+        if not isinstance(records, list):
+            abort(status.HTTP_400_BAD_REQUEST, "Invalid data: expected a list of records")
+        rows, index_of, invalid, conflicts = Inventory.bulk_rows(records)
+        created = []
+        async with request.app.state.pool.acquire() as connection:
+            async with connection.transaction():
+                for statement in Inventory.bulk_statements(rows):
+                    sql, args = compile_statement(statement)
+                    created.extend(tuple(record) for record in await connection.fetch(sql, *args))
+            if created:
+                await changed(connection)
+        body, code = bulk_result(created, invalid,
+                                 Inventory.bulk_conflicts(index_of, created, conflicts))
+        return JSONResponse(body, code)
+
+####################################################################################################
+#  PATH: /inventory/{product_id}/condition/{condition}
+####################################################################################################
+class InventoryResource(HTTPEndpoint):
+    """
+    GET     /inventory/{product_id}/condition/{condition} - Return an Inventory
+    PUT     /inventory/{product_id}/condition/{condition} - Update an Inventory
+    DELETE  /inventory/{product_id}/condition/{condition} - Delete an Inventory
+    """
+    #------------------------------------------------------------------
+    # RETRIEVE AN INVENTORY
+    #------------------------------------------------------------------
+    async def get(self, request):
+        """ Retrieve a single Inventory """
+        pid, cnd = request.path_params[keys.KEY_PID], request.path_params[keys.KEY_CND]
+        async with request.app.state.pool.acquire() as connection:
+            record = await find_one(connection, pid, cnd)
+        if record is None:
+            abort(status.HTTP_404_NOT_FOUND, "Inventory ({}, {}) NOT FOUND".format(pid, cnd))
+        etag = str(record[keys.KEY_VER])
+        if parse_etags(request.headers.get('if-none-match')).contains(etag):
+            return not_modified(etag)
+        return record_response(record)
+
+    #------------------------------------------------------------------
+    # UPDATE AN (EXISTING) INVENTORY
+    #------------------------------------------------------------------
+    async def put(self, request):
+        """ Update an Inventory """
+        pid, cnd = request.path_params[keys.KEY_PID], request.path_params[keys.KEY_CND]
+        LOGGER.debug("Request to update inventory with key (%s, %s)", pid, cnd)
+        body = await payload(request)
+        async with request.app.state.pool.acquire() as connection:
+            current = await find_one(connection, pid, cnd)
+            if current is None:
+                abort(status.HTTP_404_NOT_FOUND, "Inventory with ({}, {})".format(pid, cnd))
+            versions = expected_versions(request, body)
+            if versions is not None and current[keys.KEY_VER] not in versions:
+                abort(status.HTTP_412_PRECONDITION_FAILED, "Inventory ({}, {}) is at version {}"
+                      .format(pid, cnd, current[keys.KEY_VER]))
+            data = dict(current)
+            if isinstance(body, dict):
+                data.update((key, body[key]) for key in data if key in body)
+            try:
+                updated = Inventory().deserialize(data)
+                updated.validate_data()
+                record = await update_by_key(connection, pid, cnd, {
+                    keys.KEY_PID: int(updated.product_id),
+                    keys.KEY_CND: updated.condition,
+                    keys.KEY_QTY: int(updated.quantity),
+                    keys.KEY_LVL: int(updated.restock_level),
+                    keys.KEY_AVL: int(updated.available)
+                }, [current[keys.KEY_VER]])
+            except DataValidationError as err:
+                abort(status.HTTP_400_BAD_REQUEST, err)
+            except PreconditionFailedError as err:
+                # Without a client precondition the record simply changed under us
+                abort(status.HTTP_409_CONFLICT if versions is None
+                      else status.HTTP_412_PRECONDITION_FAILED, err)
+        not_found(record, pid, cnd)
+        return record_response(record)
+
+    #------------------------------------------------------------------
+    # DELETE AN INVENTORY
+    #------------------------------------------------------------------
+    async def delete(self, request):
+        """ Delete an Inventory """
+        pid, cnd = request.path_params[keys.KEY_PID], request.path_params[keys.KEY_CND]
+        LOGGER.debug("Request to delete inventory with key (%s, %s)", pid, cnd)
+        async with request.app.state.pool.acquire() as connection:
+            deleted = await connection.fetchval(
+                "DELETE FROM inventory WHERE product_id = $1 AND condition = $2 RETURNING 1",
+                pid, cnd)
+            if deleted:
+                await changed(connection)
+        return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+####################################################################################################
+#  PATH: /inventory/{product_id}/condition/{condition}/restock, reserve, activate, deactivate
+####################################################################################################
+class InventoryResourceRestock(HTTPEndpoint):
+    """
+    PUT     /inventory/{product_id}/condition/{condition}/restock - Restock an Inventory
+    """
+    async def put(self, request):
+        """ Restock an Inventory's Quantity """
+        pid, cnd = request.path_params[keys.KEY_PID], request.path_params[keys.KEY_CND]
+        body = await payload(request)
+        async with request.app.state.pool.acquire() as connection:
+            amount = await amount_from(connection, body, pid, cnd)
+            values, criteria, failure = Inventory.restock_update(amount)
+            try:
+                record = await update_by_key(connection, pid, cnd, values,
+                                             expected_versions(request, body), criteria, failure)
+            except DataValidationError as err:
+                abort(status.HTTP_400_BAD_REQUEST, err)
+            except PreconditionFailedError as err:
+                abort(status.HTTP_412_PRECONDITION_FAILED, err)
+        not_found(record, pid, cnd)
+        return record_response(record)
+
+class InventoryResourceReserve(HTTPEndpoint):
+    """
+    POST    /inventory/{product_id}/condition/{condition}/reserve - Reserve stock
+    """
+    async def post(self, request):
+        """ Reserve an Inventory's Quantity """
+        pid, cnd = request.path_params[keys.KEY_PID], request.path_params[keys.KEY_CND]
+        body = await payload(request)
+        async with request.app.state.pool.acquire() as connection:
+            amount = await amount_from(connection, body, pid, cnd)
+            values, criteria, failure = Inventory.reserve_update(pid, cnd, amount)
+            try:
+                record = await update_by_key(connection, pid, cnd, values,
+                                             expected_versions(request, body), criteria, failure)
+            except OutOfStockError as err:
+                abort(status.HTTP_409_CONFLICT, err)
+            except PreconditionFailedError as err:
+                abort(status.HTTP_412_PRECONDITION_FAILED, err)
+        not_found(record, pid, cnd)
+        return record_response(record)
+
+class InventoryResourceAvailability(HTTPEndpoint):
+    """
+    PUT     /inventory/{product_id}/condition/{condition}/activate - Make an Inventory available
+    PUT     /inventory/{product_id}/condition/{condition}/deactivate - Make it unavailable
+    """
+    async def put(self, request):
+        """ Sets an Inventory's availability """
+        pid, cnd = request.path_params[keys.KEY_PID], request.path_params[keys.KEY_CND]
+        available = keys.AVAILABLE_TRUE if request.url.path.endswith('/activate') \
+            else keys.AVAILABLE_FALSE
+        async with request.app.state.pool.acquire() as connection:
+            try:
+                record = await update_by_key(connection, pid, cnd, {keys.KEY_AVL: available},
+                                             expected_versions(request))
+            except PreconditionFailedError as err:
+                abort(status.HTTP_412_PRECONDITION_FAILED, err)
+        not_found(record, pid, cnd)
+        return record_response(record)
+
+####################################################################################################
+#  PATH: /inventory/events
+####################################################################################################
+class InventoryEvents(HTTPEndpoint):
+    """
+    GET     /inventory/events - Stream the inventory changes as Server-Sent Events
+    """
+    async def get(self, request):
+        """
+        Streams the changes committed from now on, of the product_id given only if any.
+        A client reconnecting with Last-Event-ID (or a since change cursor) first gets
+        the changes it missed
+        """
+        product_ids = product_ids_arg(request)
+        cursor = request.headers.get(keys.KEY_LAST_EVENT_ID) or \
+            request.query_params.get(keys.KEY_SINCE)
+        after = None
+        if cursor:
+            try:
+                after = decode_change_cursor(cursor)
+            except ValueError:
+                abort(status.HTTP_400_BAD_REQUEST, "Invalid data: malformed cursor")
+            horizon = await request.app.state.pool.fetchrow(HORIZON)
+            if horizon is not None and after < tuple(horizon):
+                abort(status.HTTP_410_GONE, "Changes after {} have been pruned".format(cursor))
+        broadcaster = request.app.state.broadcaster
+        # Subscribed before catching up, so no change falls between the two
+        subscriber = broadcaster.subscribe(product_ids)
+        LOGGER.debug("Streaming inventory changes of %s after %s", product_ids, after)
+        return StreamingResponse(
+            broadcaster.stream(subscriber, after, flask_app.config[keys.KEY_SSE_KEEPALIVE]),
+            media_type=keys.KEY_CONTENT_TYPE_SSE,
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+async def stream_ndjson(pool, sql, args):
+    """ Streams the rows of a query as newline delimited JSON, one chunk per batch read """
+    async with pool.acquire() as connection:
+        # asyncpg cursors only live inside a transaction
+        async with connection.transaction():
+            lines = []
+            async for record in connection.cursor(sql, *args, prefetch=keys.STREAM_BATCH_SIZE):
+                lines.append(serializer.dump_row(tuple(record)))
+                if len(lines) == keys.STREAM_BATCH_SIZE:
+                    yield "\n".join(lines) + "\n"
+                    lines = []
+            if lines:
+                yield "\n".join(lines) + "\n"
+
+####################################################################################################
+#  A P P L I C A T I O N
+####################################################################################################
+def pool_options(config):
+    """ Returns the asyncpg pool options matching the SQLAlchemy pool settings of the config """
+    options = {
+        'min_size': 1,
+        'max_size': config[keys.KEY_DB_POOL_SIZE] + config[keys.KEY_DB_MAX_OVERFLOW],
+        # An idle time rather than SQLAlchemy's age; 0 is asyncpg's "never", -1 SQLAlchemy's
+        'max_inactive_connection_lifetime': max(config[keys.KEY_DB_POOL_RECYCLE], 0)
+    }
+    if config.get(keys.KEY_DB_STATEMENT_TIMEOUT):
+        options['server_settings'] = {
+            'statement_timeout': str(config[keys.KEY_DB_STATEMENT_TIMEOUT])}
+    return options
+
+@asynccontextmanager
+async def lifespan(asgi_app):
+    """
+    Opens the connection pool and starts following the change feed when the server
+    starts, and stops both when it stops
+    """
+    dsn = flask_app.config[keys.KEY_SQL_ALC]
+    asgi_app.state.pool = await asyncpg.create_pool(dsn, **pool_options(flask_app.config))
+    LOGGER.info("Async connection pool opened")
+    broadcaster = ChangeBroadcaster(partial(fetch_changes, asgi_app.state.pool),
+                                    partial(fetch_last_change, asgi_app.state.pool),
+                                    flask_app.config[keys.KEY_SSE_BUFFER_SIZE],
+                                    flask_app.config[keys.KEY_SSE_POLL_INTERVAL])
+    asgi_app.state.broadcaster = broadcaster
+    try:
+        # LISTEN needs a connection of its own, kept out of the pool
+        await broadcaster.start(await asyncpg.connect(dsn))
+        yield
+    finally:
+        await broadcaster.stop()
+        await asgi_app.state.pool.close()
+
+PATH = '/api/inventory/{product_id:int}/condition/{condition}'
+
+app = Starlette(routes=[
+    Route('/api/inventory', InventoryBase),
+    Route('/api/inventory/low-stock', InventoryLowStock),
+    Route('/api/inventory/changes', InventoryChanges),
+    Route('/api/inventory/stats', InventoryStatsResource),
+    Route('/api/inventory/bulk', InventoryBulk),
+    Route('/api/inventory/events', InventoryEvents),
+    Route(PATH, InventoryResource, name='inventory'),
+    Route(PATH + '/restock', InventoryResourceRestock),
+    Route(PATH + '/reserve', InventoryResourceReserve),
+    Route(PATH + '/activate', InventoryResourceAvailability),
+    Route(PATH + '/deactivate', InventoryResourceAvailability),
+], exception_handlers={HTTPException: handle_http_error}, lifespan=lifespan)
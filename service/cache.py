@@ -0,0 +1,94 @@
+"""
+Cache for Inventory
+
+A bounded in-process read-through cache for single Inventory lookups
+Entries are evicted least recently used first and expire after a TTL, which
+also bounds how stale a record can be in workers that did not see the write
+"""
+import time
+import threading
+from collections import OrderedDict
+
+################################################################################
+class LRUCache():
+    """
+    Thread-safe LRU cache whose entries expire ttl seconds after being stored
+    Cached values are shared between callers and must not be mutated
+    """
+
+    def __init__(self, maxsize=1024, ttl=30.0, enabled=True):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.configure(maxsize, ttl, enabled)
+
+    def configure(self, maxsize, ttl, enabled=True):
+        """ Resizes the cache and resets it """
+        with self._lock:
+            self.maxsize = maxsize
+            self.ttl = ttl
+            self.enabled = enabled and maxsize > 0
+            self._entries.clear()
+            self.generation = 0
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    ######################################################################
+    def get(self, key):
+        """ Returns the value stored for key or None on a miss """
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, generation=None):
+        """
+        Stores value for key, evicting the least recently used entry when full
+        Args: generation (Integer): the generation read before loading value;
+              the value is dropped if an invalidation happened since then
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, *keys):
+        """ Removes the given keys from the cache """
+        with self._lock:
+            self.generation += 1
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        """ Removes every entry from the cache """
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+
+    ######################################################################
+    def stats(self):
+        """ Returns the cache settings and its hit/miss/eviction counters """
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
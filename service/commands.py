@@ -0,0 +1,56 @@
+"""
+Inventory Commands
+
+Maintenance commands for the Inventory service, run with
+    FLASK_APP=service:app flask <command>
+"""
+import sys
+import csv
+import click
+from service import app, keys
+from service.importer import import_csv, COLUMNS
+from service.model import Inventory, InventoryStats, InventoryChange
+
+@app.cli.command('create-schema')
+def create_schema():
+    """ Creates the tables, indexes and triggers the service needs, if they do not exist """
+    Inventory.create_schema()
+    click.echo("Inventory schema created")
+
+@app.cli.command('reconcile-stats')
+def reconcile_stats():
+    """ Recomputes the inventory stats counters from the inventory table """
+    drifted = InventoryStats.reconcile()
+    click.echo("Inventory stats reconciled, {} counters had drifted".format(drifted))
+
+@app.cli.command('import-csv')
+@click.argument('source', type=click.File('r', encoding='utf-8'))
+@click.option('--rejects', type=click.File('w', encoding='utf-8'),
+              help='Write the rejected rows to this CSV file, with their line and error')
+def import_inventory(source, rejects):
+    """ Creates or updates the inventory records of a CSV file, - for stdin """
+    writer = None
+    if rejects:
+        writer = csv.writer(rejects)
+        writer.writerow([keys.KEY_LINE, keys.KEY_MESSAGE] + COLUMNS)
+
+    def reject(line, row, message):
+        writer.writerow([line, message] + row)
+
+    def progress(report):
+        click.echo("{} rows read, {} rejected".format(
+            report[keys.KEY_ROWS], report[keys.KEY_REJECTED]), file=sys.stderr)
+
+    report = import_csv(source, progress=progress, reject=reject if writer else None)
+    click.echo("Imported {rows} rows: {created} created, {updated} updated, "
+               "{unchanged} unchanged, {rejected} rejected".format(**report))
+
+@app.cli.command('prune-changes')
+@click.option('--retention', type=int,
+              help='Seconds to keep changes for, CHANGES_RETENTION by default')
+def prune_changes(retention):
+    """ Deletes the changes older than the retention from the change feed """
+    if retention is None:
+        retention = app.config[keys.KEY_CHANGES_RETENTION]
+    deleted = InventoryChange.prune(retention)
+    click.echo("{} inventory changes pruned".format(deleted))
@@ -0,0 +1,203 @@
+"""
+Server-Sent Events for Inventory
+
+Pushes the changes of the change feed (GET /inventory/changes) to the
+subscribers of GET /api/inventory/events in the ASGI serving mode, where an
+idle stream costs tens of kilobytes instead of a worker.
+
+Each worker follows the feed with one ChangeBroadcaster. Its own connection
+LISTENs on the channel the change log trigger notifies once per committed
+write. On every notification, or every SSE_POLL_INTERVAL seconds for changes a
+concurrent transaction held back, it reads the changes after its position
+once, encodes each as an event once, and hands them to every subscriber.
+Subscribers keep at most SSE_BUFFER_SIZE events each; one that falls further
+behind is dropped and its stream ends. Every event id is a change feed cursor,
+so the client reconnects with Last-Event-ID and catches up from the feed
+before it gets the live events again.
+
+The streams never end on their own, and uvicorn waits for its connections to
+close before it stops, so serve them with --timeout-graceful-shutdown: the
+streams still open when it runs out are cancelled, and the clients reconnect
+to another worker.
+"""
+import json
+import asyncio
+import logging
+from collections import deque
+from service import keys
+from service.model import InventoryChange
+from service.routes import encode_change_cursor
+
+LOGGER = logging.getLogger("flask.app")
+
+################################################################################
+def encode_event(record):
+    """ Returns the (position, product_id, text) of a change read by asyncpg """
+    change = InventoryChange(**record)
+    return (change.position(), change.product_id,
+            "id: {}\ndata: {}\n\n".format(encode_change_cursor(change),
+                                          json.dumps(change.serialize())))
+
+class Subscriber():
+    """ The bounded buffer of the events a stream has not sent yet """
+
+    def __init__(self, product_ids, buffer_size):
+        self.product_ids = product_ids
+        self.buffer_size = buffer_size
+        self.events = deque()
+        self.ready = asyncio.Event()
+        self.dropped = False
+
+    def offer(self, events):
+        """ Buffers the events the subscriber asked for, returns False once it has fallen behind """
+        if self.product_ids is not None:
+            events = [event for event in events if event[1] in self.product_ids]
+        if not events:
+            return True
+        if len(self.events) + len(events) > self.buffer_size:
+            self.dropped = True
+            self.ready.set()
+            return False
+        self.events.extend(events)
+        self.ready.set()
+        return True
+
+    async def take(self, timeout):
+        """ Returns the buffered events, waiting up to timeout seconds for some; [] on timeout """
+        if not self.events and not self.dropped:
+            self.ready.clear()
+            try:
+                await asyncio.wait_for(self.ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                return []
+        events = list(self.events)
+        self.events.clear()
+        return events
+
+class ChangeBroadcaster():
+    """
+    Follows the change feed for one worker and fans the changes out to its subscribers
+    fetch is a coroutine function returning the asyncpg records of the changes after a
+    (txid, id) position, like InventoryChange.since, and last one returning the record
+    of the last change, like InventoryChange.last, or None
+    """
+
+    def __init__(self, fetch, last, buffer_size, poll_interval):
+        self.fetch = fetch
+        self.last = last
+        self.buffer_size = buffer_size
+        self.poll_interval = poll_interval
+        self.subscribers = set()
+        self.position = None
+        self.dropped = 0
+        self.wakeup = asyncio.Event()
+        self.listener = None
+        self.task = None
+
+    async def start(self, listener):
+        """ Starts following the feed from its current end, woken by a LISTENing connection """
+        self.position = await self.tail()
+        self.listener = listener
+        await listener.add_listener(keys.CHANGES_CHANNEL, self.notified)
+        self.task = asyncio.ensure_future(self.run())
+        LOGGER.info("Listening for inventory changes")
+
+    async def stop(self):
+        """ Stops following the feed and closes the listening connection """
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        if self.listener:
+            await self.listener.close()
+
+    def notified(self, connection, pid, channel, payload):
+        """ Called by asyncpg when a write to the inventory table has been committed """
+        self.wakeup.set()
+
+    async def tail(self):
+        """ Returns the position of the last change of the feed """
+        record = await self.last()
+        return None if record is None else (record['txid'], record['id'])
+
+    async def run(self):
+        """ Reads and broadcasts the new changes whenever woken, or every poll_interval """
+        while True:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            try:
+                await self.poll()
+            except asyncio.CancelledError:
+                raise
+            except Exception as err:  # pylint: disable=broad-except
+                # The database may be restarting; the next round tries again
+                LOGGER.error("Reading the inventory changes failed: %s", err)
+
+    async def poll(self):
+        """ Broadcasts the changes after the current position """
+        while True:
+            records = await self.fetch(self.position, keys.PAGE_LIMIT_MAX)
+            if not records:
+                return
+            events = [encode_event(record) for record in records]
+            self.position = events[-1][0]
+            self.broadcast(events)
+            if len(records) < keys.PAGE_LIMIT_MAX:
+                return
+
+    def broadcast(self, events):
+        """ Hands events to every subscriber, dropping those that have fallen behind """
+        for subscriber in list(self.subscribers):
+            if not subscriber.offer(events):
+                self.subscribers.discard(subscriber)
+                self.dropped += 1
+
+    def subscribe(self, product_ids=None):
+        """ Returns a new Subscriber of the changes, of the given product_ids only if not None """
+        subscriber = Subscriber(product_ids, self.buffer_size)
+        self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        """ Stops handing events to a subscriber """
+        self.subscribers.discard(subscriber)
+
+    async def stream(self, subscriber, after, keepalive):
+        """
+        Yields the text of a subscriber's event stream: the changes after the
+        position after (from the feed, if not None), then the live ones until it
+        is dropped, with a comment every keepalive seconds without any
+        """
+        try:
+            yield "retry: {}\n\n".format(keys.SSE_RETRY_MS)
+            last = after
+            while after is not None:
+                events = [encode_event(record)
+                          for record in await self.fetch(last, keys.PAGE_LIMIT_MAX)]
+                if events:
+                    last = events[-1][0]
+                    wanted = [event[2] for event in events if subscriber.product_ids is None
+                              or event[1] in subscriber.product_ids]
+                    if wanted:
+                        yield "".join(wanted)
+                if len(events) < keys.PAGE_LIMIT_MAX:
+                    break
+            while not subscriber.dropped:
+                events = await subscriber.take(keepalive)
+                if subscriber.dropped:
+                    break
+                if not events:
+                    yield ": keepalive\n\n"
+                    continue
+                # Live events already sent while catching up are skipped
+                text = "".join(event[2] for event in events if last is None or event[0] > last)
+                last = events[-1][0] if last is None else max(last, events[-1][0])
+                if text:
+                    yield text
+        finally:
+            self.unsubscribe(subscriber)
@@ -0,0 +1,120 @@
+"""
+Export for Inventory
+
+Streams the inventory table, or the part of it matching the list filters, as
+CSV or Parquet. The rows are read through a server-side cursor in a single
+REPEATABLE READ, READ ONLY transaction, so the whole dump is one point-in-time
+snapshot. Only one batch is held in memory at a time; each batch is encoded
+and sent before the next one is fetched.
+
+The CSV has a header line, can be loaded back with POST /inventory/import and
+its columns are those of GET /inventory. Parquet needs pyarrow, which is only
+imported when a Parquet export is asked for.
+"""
+import io
+import csv
+import logging
+import importlib.util
+from service import keys, serializer
+from service.model import DB
+
+LOGGER = logging.getLogger("flask.app")
+
+FORMAT_CSV = 'csv'
+FORMAT_PARQUET = 'parquet'
+
+CONTENT_TYPES = {
+    FORMAT_CSV: keys.KEY_CONTENT_TYPE_CSV,
+    FORMAT_PARQUET: keys.KEY_CONTENT_TYPE_PARQUET
+}
+
+################################################################################
+def available(export_format):
+    """ Returns True if the libraries an export format needs are installed """
+    if export_format == FORMAT_PARQUET:
+        return importlib.util.find_spec('pyarrow') is not None
+    return export_format in CONTENT_TYPES
+
+def snapshot_batches(statement, batch_size):
+    """
+    Yields the rows of a statement in lists of batch_size, read through a
+    server-side cursor in one REPEATABLE READ, READ ONLY transaction
+    The connection is given back as soon as the rows run out or the
+    generator is closed, e.g. when the client goes away
+    """
+    connection = DB.engine.connect().execution_options(isolation_level="REPEATABLE READ")
+    try:
+        with connection.begin():
+            connection.execute("SET TRANSACTION READ ONLY")
+            result = connection.execute(statement.execution_options(stream_results=True))
+            while True:
+                rows = result.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield rows
+    finally:
+        connection.close()
+
+def csv_chunks(batches):
+    """ Yields the CSV text of batches of row tuples, starting with the header """
+    yield ",".join(serializer.FIELDS) + "\r\n"
+    for rows in batches:
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        yield buffer.getvalue()
+
+class ChunkSink(io.RawIOBase):
+    """ A write-only file that hands out what was written to it since it was last asked """
+
+    def __init__(self):
+        super().__init__()
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def take(self):
+        """ Returns the bytes written since the last take() """
+        data, self.chunks = b"".join(self.chunks), []
+        return data
+
+def parquet_chunks(batches):
+    """ Yields the Parquet file of batches of row tuples, one row group per batch """
+    import pyarrow
+    import pyarrow.parquet
+
+    types = {keys.KEY_CND: pyarrow.string(), keys.KEY_VER: pyarrow.int64()}
+    schema = pyarrow.schema([(field, types.get(field, pyarrow.int32()))
+                             for field in serializer.FIELDS])
+    sink = ChunkSink()
+    writer = pyarrow.parquet.ParquetWriter(sink, schema)
+    try:
+        for rows in batches:
+            columns = [pyarrow.array(column, type=field.type)
+                       for column, field in zip(zip(*rows), schema)]
+            writer.write_table(pyarrow.Table.from_arrays(columns, schema=schema))
+            yield sink.take()
+    finally:
+        # Writes the footer; without it the file is unreadable
+        writer.close()
+    yield sink.take()
+
+def export(query, export_format):
+    """
+    Returns a generator of the chunks of an export of the query's rows
+    Args: query (Query): the Inventory row query, as returned by Inventory.rows()
+          export_format (String): FORMAT_CSV or FORMAT_PARQUET
+    """
+    LOGGER.info("Exporting inventories as %s", export_format)
+    if export_format == FORMAT_PARQUET:
+        return parquet_chunks(snapshot_batches(query.statement, keys.PARQUET_ROW_GROUP_SIZE))
+    return csv_chunks(snapshot_batches(query.statement, keys.STREAM_BATCH_SIZE))
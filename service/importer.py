@@ -0,0 +1,169 @@
+"""
+CSV import for Inventory
+
+Loads a CSV of Inventory records, too large for POST /inventory/bulk, in one
+transaction. The file is read as a stream, COPY_BATCH_SIZE rows at a time. Each
+chunk is checked with the batch validation and its valid rows are COPYed into
+a temporary staging table. Once the whole file is staged, it is merged into
+the inventory table with a single INSERT ... ON CONFLICT DO UPDATE.
+
+The first line names the columns, in any order:
+    product_id,condition,quantity,restock_level,available
+and may also name the version column of an export, which is ignored.
+A product listed twice in the file takes the values of its last line. Rows
+that equal the stored record are left alone, so their version does not move.
+Rejected rows are reported with their line number and the message
+POST /inventory would have answered with.
+"""
+import io
+import csv
+import logging
+from collections import OrderedDict
+from service import keys, validation
+from service.model import Inventory, DataValidationError, DB, CACHE, VERSION_SEQ
+
+LOGGER = logging.getLogger("flask.app")
+
+COLUMNS = [keys.KEY_PID, keys.KEY_CND, keys.KEY_QTY, keys.KEY_LVL, keys.KEY_AVL]
+
+STAGING_DDL = (
+    "CREATE TEMP TABLE inventory_import ("
+    " line bigint, product_id integer, condition varchar(100), quantity integer,"
+    " restock_level integer, available integer"
+    ") ON COMMIT DROP")
+
+STAGING_COPY = "COPY inventory_import (line, {}) FROM STDIN WITH (FORMAT csv)".format(
+    ", ".join(COLUMNS))
+
+# The last line of every key wins; unchanged records are skipped so their version stays,
+# and the others get a new one like any other update (the column's onupdate is ORM only).
+# xmax is 0 on a freshly inserted row, which tells the inserts from the updates
+MERGE = """
+WITH merged AS (
+    INSERT INTO inventory AS inv ({columns})
+    SELECT DISTINCT ON (product_id, condition) {columns}
+    FROM inventory_import
+    ORDER BY product_id, condition, line DESC
+    ON CONFLICT (product_id, condition) DO UPDATE
+    SET quantity = EXCLUDED.quantity,
+        restock_level = EXCLUDED.restock_level,
+        available = EXCLUDED.available,
+        version = nextval('{sequence}')
+    WHERE (inv.quantity, inv.restock_level, inv.available)
+        IS DISTINCT FROM (EXCLUDED.quantity, EXCLUDED.restock_level, EXCLUDED.available)
+    RETURNING xmax = 0 AS inserted
+)
+SELECT count(*) FILTER (WHERE inserted), count(*) FILTER (WHERE NOT inserted) FROM merged
+""".format(columns=", ".join(COLUMNS), sequence=VERSION_SEQ.name)
+
+################################################################################
+def new_report():
+    """ Returns an empty import report """
+    return OrderedDict([
+        (keys.KEY_ROWS, 0),
+        (keys.KEY_CREATED, 0),
+        (keys.KEY_UPDATED, 0),
+        (keys.KEY_UNCHANGED, 0),
+        (keys.KEY_REJECTED, 0),
+        (keys.KEY_ERRORS, [])
+    ])
+
+def read_chunks(stream, chunk_size=keys.COPY_BATCH_SIZE):
+    """
+    Yields the rows of a CSV text stream, or any iterable of its lines, as (lines, rows) chunks
+    Raises: DataValidationError if the header does not name the Inventory columns
+    """
+    reader = csv.reader(stream)
+    header = [name.strip() for name in next(reader, [])]
+    # An export also has the versions, which the import leaves to the database
+    if sorted(name for name in header if name != keys.KEY_VER) != sorted(COLUMNS) \
+            or len(header) > len(set(header)):
+        raise DataValidationError("Invalid CSV header: expected the columns {}".format(COLUMNS))
+    order = [header.index(column) for column in COLUMNS]
+
+    lines, rows = [], []
+    for row in reader:
+        if not row:
+            continue
+        lines.append(reader.line_num)
+        rows.append([row[index] for index in order] if len(row) == len(header)
+                    else MalformedRow(row, len(header)))
+        if len(rows) == chunk_size:
+            yield lines, rows
+            lines, rows = [], []
+    if rows:
+        yield lines, rows
+
+class MalformedRow(list):
+    """ The fields of a CSV row that does not have as many fields as the header """
+
+    def __init__(self, fields, expected):
+        super().__init__(fields)
+        self.expected = expected
+
+def validate_chunk(rows):
+    """ Returns a dict mapping the index of every invalid row of a chunk to its error message """
+    columns = {column: [validation.MISSING if isinstance(row, MalformedRow) else row[position]
+                        for row in rows]
+               for position, column in enumerate(COLUMNS)}
+    errors = validation.validate_columns(columns)
+    for index, row in enumerate(rows):
+        if isinstance(row, MalformedRow):
+            errors[index] = "Invalid CSV row: expected {} fields, found {}".format(
+                row.expected, len(row))
+    return errors
+
+def import_csv(stream, chunk_size=keys.COPY_BATCH_SIZE, progress=None, reject=None):
+    """
+    Imports a CSV text stream of Inventory records in one transaction
+    Args: progress (function): called with the report after every chunk
+          reject (function): called with the line, row and message of every rejected row
+    Returns: the report, listing the first IMPORT_MAX_ERRORS rejected rows
+    Raises: DataValidationError if the header does not name the Inventory columns
+    """
+    LOGGER.info("Importing inventory CSV")
+    report = new_report()
+    session = DB.session
+    try:
+        # A long import must not be cut off by the per-statement timeout of the API
+        session.execute("SET LOCAL statement_timeout = 0")
+        session.execute(STAGING_DDL)
+        cursor = session.connection().connection.cursor()
+        for lines, rows in read_chunks(stream, chunk_size):
+            errors = validate_chunk(rows)
+            staged = io.StringIO()
+            writer = csv.writer(staged)
+            for index, row in enumerate(rows):
+                message = errors.get(index)
+                if message is None:
+                    writer.writerow([lines[index]] + row)
+                    continue
+                if len(report[keys.KEY_ERRORS]) < keys.IMPORT_MAX_ERRORS:
+                    report[keys.KEY_ERRORS].append({keys.KEY_LINE: lines[index],
+                                                    keys.KEY_MESSAGE: message})
+                if reject:
+                    reject(lines[index], row, message)
+            staged.seek(0)
+            cursor.copy_expert(STAGING_COPY, staged)
+            report[keys.KEY_ROWS] += len(rows)
+            report[keys.KEY_REJECTED] += len(errors)
+            if progress:
+                progress(report)
+
+        created, updated = session.execute(MERGE).first()
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+
+    report[keys.KEY_CREATED] = created
+    report[keys.KEY_UPDATED] = updated
+    report[keys.KEY_UNCHANGED] = report[keys.KEY_ROWS] - report[keys.KEY_REJECTED] \
+        - created - updated
+    if created or updated:
+        # Too many keys to drop one by one
+        CACHE.clear()
+        Inventory.changed()
+    LOGGER.info("Imported %s rows: %s created, %s updated, %s rejected",
+                report[keys.KEY_ROWS], created, updated, report[keys.KEY_REJECTED])
+    return report
@@ -0,0 +1,94 @@
+"""
+Metrics for Inventory
+
+Prometheus request and database metrics, served at /metrics
+Under gunicorn each worker writes its samples to files in the directory named
+by the prometheus_multiproc_dir environment variable (see gunicorn.conf.py),
+and a scrape of any worker aggregates the samples of all of them
+"""
+import os
+import time
+from flask import Response, g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from prometheus_client import Counter, Histogram, CollectorRegistry, REGISTRY, \
+    CONTENT_TYPE_LATEST, generate_latest, multiprocess
+from service import app, keys
+
+REQUESTS = Counter('inventory_http_requests_total',
+                   'HTTP requests by resource, method and status',
+                   ['resource', 'method', 'status'])
+ERRORS = Counter('inventory_http_request_errors_total',
+                 'HTTP requests answered with a server error, by resource and method',
+                 ['resource', 'method'])
+LATENCY = Histogram('inventory_http_request_duration_seconds',
+                    'HTTP request latency by resource and method',
+                    ['resource', 'method'])
+DB_LATENCY = Histogram('inventory_db_query_duration_seconds',
+                       'Database statement latency by statement type',
+                       ['statement'])
+
+def resource_name():
+    """ Returns the name of the Resource class (or view function) serving the request """
+    view = app.view_functions.get(request.endpoint)
+    if view is None:
+        return 'unmatched'
+    return getattr(view, 'view_class', view).__name__
+
+def statement_type(statement):
+    """ Returns the SQL verb of a statement, keeping the label values to a known few """
+    verb = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else ''
+    return verb if verb in keys.METRICS_STATEMENTS else 'OTHER'
+
+######################################################################
+# REQUEST METRICS
+######################################################################
+@app.before_request
+def start_request_timer():
+    """ Remembers when the request started """
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request(response):
+    """ Counts the request and records its latency (to the first byte of streamed bodies) """
+    start = g.pop('request_start', None)
+    if start is not None:
+        resource = resource_name()
+        LATENCY.labels(resource, request.method).observe(time.perf_counter() - start)
+        REQUESTS.labels(resource, request.method, response.status_code).inc()
+        if response.status_code >= 500:
+            ERRORS.labels(resource, request.method).inc()
+    return response
+
+######################################################################
+# DATABASE METRICS
+######################################################################
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    """ Remembers when the statement started """
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def record_query(conn, cursor, statement, parameters, context, executemany):
+    """ Records the latency of the statement """
+    start = conn.info['query_start'].pop()
+    DB_LATENCY.labels(statement_type(statement)).observe(time.perf_counter() - start)
+
+@event.listens_for(Engine, 'handle_error')
+def drop_query_timer(context):
+    """ Forgets the start of a statement that failed """
+    if context.connection is not None and context.connection.info.get('query_start'):
+        context.connection.info['query_start'].pop()
+
+######################################################################
+# GET METRICS
+######################################################################
+@app.route('/metrics')
+def metrics():
+    """ Returns the metrics of every worker in the Prometheus text format """
+    if keys.KEY_METRICS_DIR in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), headers={'Content-Type': CONTENT_TYPE_LATEST})
@@ -3,19 +3,42 @@ Models for Inventory
 All of the models are stored in this module
 """
 import logging
+import datetime
 from flask_sqlalchemy import SQLAlchemy, sqlalchemy
-from service import keys
+from sqlalchemy.dialects import postgresql
+from service import keys, validation
+from service.cache import LRUCache
+from service.pool import engine_options
+from service.serializer import FIELDS
 LOGGER = logging.getLogger("flask.app")
 
 # Create the SQLAlchemy object to be initialized later in init_db()
 DB = SQLAlchemy()
 
+# Advanced after every committed write; its value is a cheap table-level change marker
+CHANGE_SEQ = DB.Sequence('inventory_change_seq', metadata=DB.Model.metadata)
+
+# Every insert and update draws a new record version, unique across the table's lifetime
+VERSION_SEQ = DB.Sequence('inventory_version_seq', metadata=DB.Model.metadata)
+
+# Cache of serialized Inventory records by (product_id, condition), configured in init_db()
+CACHE = LRUCache()
+
 class DataValidationError(Exception):
     """ Used for an data validation errors when deserializing """
 
 class DBError(Exception):
     """ Used for an DB connectivity errors """
 
+class PreconditionFailedError(Exception):
+    """ Used when a record is no longer at the version a client expected """
+
+class OutOfStockError(Exception):
+    """ Used when a record does not hold enough available stock for a reservation """
+
+class ChangesPrunedError(Exception):
+    """ Used when changes after a change feed cursor have been pruned """
+
 ################################################################################
 class Inventory(DB.Model):
     """
@@ -23,18 +46,62 @@ class Inventory(DB.Model):
     """
     app = None
 
+    # Secondary indexes for the list filters; product_id is served by the primary key
+    __table_args__ = (
+        DB.Index('ix_inventory_condition_available_quantity', 'condition', 'available', 'quantity'),
+        DB.Index('ix_inventory_available_quantity', 'available', 'quantity'),
+        DB.Index('ix_inventory_quantity', 'quantity'),
+        # Only the few records due for a restock, in key order for paging
+        DB.Index('ix_inventory_low_stock', 'product_id', 'condition',
+                 postgresql_where=sqlalchemy.text('quantity <= restock_level')),
+    )
+
     # Table Schema
     product_id = DB.Column(DB.Integer, primary_key=True)
     condition = DB.Column(DB.String(100), primary_key=True)
     quantity = DB.Column(DB.Integer)
     restock_level = DB.Column(DB.Integer)
     available = DB.Column(DB.Integer)
+    version = DB.Column(DB.BigInteger, nullable=False,
+                        server_default=sqlalchemy.text("nextval('{}')".format(VERSION_SEQ.name)),
+                        onupdate=sqlalchemy.func.nextval(VERSION_SEQ.name))
+
+    # Read the version the database assigned with RETURNING instead of a later SELECT
+    __mapper_args__ = {'eager_defaults': True}
 
     def __repr__(self):
         return "<<product_id %d>" % (self.product_id)
 
     ######################################################################
     # UTILITY
+    @staticmethod
+    def cache_key(pid, condition):
+        """ Returns the key a record is cached under """
+        return int(pid), condition
+
+    @staticmethod
+    def etag(data):
+        """ Returns a strong entity tag for a serialized Inventory record, its version """
+        return str(data[keys.KEY_VER])
+
+    @classmethod
+    def changed(cls, *cache_keys):
+        """
+        Drops the given records from the cache and advances the table change marker
+        Called once a write is committed, so the marker never runs ahead of what readers can see
+        """
+        CACHE.invalidate(*cache_keys)
+        DB.session.execute("SELECT nextval('{}')".format(CHANGE_SEQ.name))
+        # nextval may take an xid, and the session outlives the request: left open, that
+        # transaction would hold back the change feed of every reader (txid_snapshot_xmin)
+        DB.session.commit()
+
+    @classmethod
+    def change_marker(cls):
+        """ Returns a value that changes whenever a write to the table has been committed """
+        row = DB.session.execute("SELECT last_value, is_called FROM {}".format(CHANGE_SEQ.name))
+        return "{}:{}".format(*row.first())
+
     def serialize(self):
         """ Serializes an Inventory record into a dictionary """
         return {
@@ -42,7 +109,8 @@ class Inventory(DB.Model):
             keys.KEY_QTY: self.quantity,
             keys.KEY_LVL: self.restock_level,
             keys.KEY_CND: self.condition,
-            keys.KEY_AVL: self.available
+            keys.KEY_AVL: self.available,
+            keys.KEY_VER: self.version
         }
 
     # Args: data (dict): A dictionary containing the resource data
@@ -61,15 +129,33 @@ class Inventory(DB.Model):
             raise DataValidationError("Invalid Inventory record: body contained bad or no data")
 
     @classmethod
-    def init_db(cls, app):
-        """ Initializes the database session """
-        try:
-            LOGGER.info("Initializing database")
-            cls.app = app
+    def init_db(cls, app, create_schema=True):
+        """ Initializes the database session and, if create_schema, creates the tables """
+        cls.init_app(app)
+        if create_schema:
+            cls.create_schema()
+
+    @classmethod
+    def init_app(cls, app):
+        """ Binds the model to the Flask app without connecting to the database """
+        LOGGER.info("Initializing database")
+        cls.app = app
+        CACHE.configure(app.config.get(keys.KEY_CACHE_MAXSIZE, 0),
+                        app.config.get(keys.KEY_CACHE_TTL, 0),
+                        app.config.get(keys.KEY_CACHE_ENABLED, False))
+
+        # This is where we initialize SQLAlchemy from the Flask app
+        options = app.config.setdefault(keys.KEY_SQL_ALC_ENGINE_OPTIONS, {})
+        for key, value in engine_options(app.config).items():
+            options.setdefault(key, value)
+        DB.init_app(app)
+        app.app_context().push()
 
-            # This is where we initialize SQLAlchemy from the Flask app
-            DB.init_app(app)
-            app.app_context().push()
+    @classmethod
+    def create_schema(cls):
+        """ Creates the tables, sequences, indexes and triggers that do not exist yet """
+        try:
+            LOGGER.info("Creating database schema")
             DB.create_all()  # make our sqlalchemy tables
         except sqlalchemy.exc.ArgumentError as err:
             raise DBError("Invalid DB connection: {}".format(err))
@@ -114,110 +200,683 @@ class Inventory(DB.Model):
         """
         Validating Product ID format
         """
-        pid = self.product_id
-        if isinstance(pid, str):
-            return pid.isdigit() and int(pid) >= 0
-        return isinstance(pid, int) and pid >= 0
+        return validation.valid_integer(self.product_id, 0, keys.INT_HIGH)
 
     def validate_data_condition(self):
         """
         validating Condition format
         """
-        cnd = self.condition
-        return isinstance(cnd, str) and cnd in keys.CONDITIONS
+        return validation.valid_condition(self.condition)
 
     def validate_data_quantity(self):
         """
         Validating Quantity format
         """
-        qty = self.quantity
-        if isinstance(qty, str):
-            return qty.isdigit() and (keys.QTY_LOW <= int(qty) <= keys.QTY_HIGH)
-        return isinstance(qty, int) and (keys.QTY_LOW <= qty <= keys.QTY_HIGH)
+        return validation.valid_integer(self.quantity, keys.QTY_LOW, keys.QTY_HIGH)
 
     def validate_data_restock_level(self):
         """
         Validating Restock level format
         """
-        lvl = self.restock_level
-        if isinstance(lvl, str):
-            return lvl.isdigit() and (keys.QTY_LOW <= int(lvl) <= keys.RESTOCK_LVL)
-        return isinstance(lvl, int) and (keys.QTY_LOW <= lvl <= keys.RESTOCK_LVL)
+        return validation.valid_integer(self.restock_level, keys.QTY_LOW, keys.RESTOCK_LVL)
 
     def validate_data_available(self):
         """
         Validating Available format
         """
-        avl = self.available
-        if isinstance(avl, str):
-            return avl.isdigit() and int(avl) in [keys.AVAILABLE_TRUE, keys.AVAILABLE_FALSE]
-        return isinstance(avl, int) and avl in [keys.AVAILABLE_TRUE, keys.AVAILABLE_FALSE]
+        return validation.valid_integer(self.available, keys.AVAILABLE_FALSE,
+                                        keys.AVAILABLE_TRUE)
 
     ######################################################################
     def create(self):
         """
         Creates an Inventory record to the database
         """
-        LOGGER.info("Creating {}".format(self.product_id))
+        LOGGER.debug("Creating %s", self.product_id)
+        key = self.cache_key(self.product_id, self.condition)
         DB.session.add(self)
         DB.session.commit()
+        self.changed(key)
+
+    @classmethod
+    def create_bulk(cls, records):
+        """
+        Creates a batch of Inventory records in a single transaction
+        Args: records (list): dictionaries containing the resource data
+        Returns: (created, invalid, conflicts) where created is the list of
+                 (product_id, condition) keys inserted, invalid maps a record's
+                 index to its validation error and conflicts lists the indexes
+                 of records that already exist
+        """
+        LOGGER.info("Creating %s records in bulk", len(records))
+        rows, index_of, invalid, conflicts = cls.bulk_rows(records)
+        created = []
+        try:
+            for stmt in cls.bulk_statements(rows):
+                created.extend(tuple(row) for row in DB.session.execute(stmt))
+            DB.session.commit()
+        except sqlalchemy.exc.SQLAlchemyError:
+            # The session outlives the request, so it must not stay in the failed transaction
+            DB.session.rollback()
+            raise
+        if created:
+            cls.changed(*created)
+        return created, invalid, cls.bulk_conflicts(index_of, created, conflicts)
+
+    @classmethod
+    def bulk_rows(cls, records):
+        """
+        Validates a batch of records for create_bulk
+        Returns: (rows, index_of, invalid, conflicts) the column values of the valid
+                 records, the index of each of their keys, the invalid records'
+                 errors and the indexes of the keys repeated within the batch
+        """
+        columns, invalid = validation.validate_records(records)
+        pids, conditions, quantities, levels, availables = [
+            columns[field] for field in (keys.KEY_PID, keys.KEY_CND, keys.KEY_QTY,
+                                         keys.KEY_LVL, keys.KEY_AVL)]
+        rows, index_of, conflicts = [], {}, []
+        for index in range(len(records)):
+            if index in invalid:
+                continue
+            key = (int(pids[index]), conditions[index])
+            if key in index_of:
+                conflicts.append(index)
+                continue
+            index_of[key] = index
+            rows.append({
+                keys.KEY_PID: key[0],
+                keys.KEY_CND: key[1],
+                keys.KEY_QTY: int(quantities[index]),
+                keys.KEY_LVL: int(levels[index]),
+                keys.KEY_AVL: int(availables[index])
+            })
+        return rows, index_of, invalid, conflicts
+
+    @classmethod
+    def bulk_statements(cls, rows):
+        """ Yields the INSERT ... RETURNING key statements of create_bulk, one per batch """
+        # One multi-row INSERT per batch; rows that already exist are skipped
+        # by the database instead of being looked up one at a time
+        table = cls.__table__
+        for start in range(0, len(rows), keys.BULK_BATCH_SIZE):
+            yield postgresql.insert(table)\
+                .values(rows[start:start + keys.BULK_BATCH_SIZE])\
+                .on_conflict_do_nothing(index_elements=[table.c.product_id, table.c.condition])\
+                .returning(table.c.product_id, table.c.condition)
+
+    @staticmethod
+    def bulk_conflicts(index_of, created, conflicts):
+        """ Returns the sorted indexes of the records create_bulk did not insert as conflicts """
+        inserted = set(created)
+        return sorted(conflicts + [index for key, index in index_of.items()
+                                   if key not in inserted])
 
     ######################################################################
     def update(self):
         """
         Updates an Inventory record to the database
         """
-        LOGGER.info("Updating {}".format(self.product_id))
+        LOGGER.debug("Updating %s", self.product_id)
+        # The key may be part of the update, so drop what was cached under the old one too
+        old_key = sqlalchemy.inspect(self).identity
+        key = self.cache_key(self.product_id, self.condition)
         DB.session.commit()
+        self.changed(key, *([self.cache_key(*old_key)] if old_key else []))
+
+    @classmethod
+    def update_by_key(cls, pid, condition, values, versions=None, criteria=None, failure=None):
+        """
+        Applies values to an Inventory record with a single guarded UPDATE ... RETURNING
+        The guards are evaluated by the database, so concurrent writers never need row locks
+        Args: values (dict): the new column values, which may be SQL expressions
+              versions (list): the versions the record must be at, or None for any version
+              criteria (ClauseElement): an extra condition the record must meet
+              failure (Exception): raised when the record exists at an expected
+                                   version but does not meet criteria
+        Returns: the updated Inventory or None if the record does not exist
+        """
+        LOGGER.debug("Updating (%s, %s) with %s", pid, condition, values)
+        stmt = cls.update_statement(pid, condition, values, versions, criteria)
+        row = DB.session.execute(stmt).first()
+        DB.session.commit()
+        if row is None:
+            current = cls.find_by_product_id_condition(pid, condition)
+            error = cls.update_failure(pid, condition, current and current.version,
+                                       versions, failure)
+            if error is None:
+                return None
+            raise error
+        cls.changed(cls.cache_key(pid, condition))
+        return cls(**dict(row))
+
+    @classmethod
+    def update_statement(cls, pid, condition, values, versions=None, criteria=None):
+        """ Returns the guarded UPDATE ... RETURNING of update_by_key, for any driver to run """
+        table = cls.__table__
+        stmt = table.update()\
+            .where(table.c.product_id == pid)\
+            .where(table.c.condition == condition)\
+            .values(values)\
+            .returning(*table.c)
+        if versions is not None:
+            stmt = stmt.where(table.c.version.in_(versions))
+        if criteria is not None:
+            stmt = stmt.where(criteria)
+        return stmt
+
+    @staticmethod
+    def update_failure(pid, condition, version, versions=None, failure=None):
+        """
+        Returns the error of a guarded UPDATE that matched no row, given the
+        current version of the record, or None if the record does not exist
+        """
+        if version is None:
+            return None
+        if failure is None or (versions is not None and version not in versions):
+            return PreconditionFailedError("Inventory ({}, {}) is at version {}"\
+                                           .format(pid, condition, version))
+        return failure
+
+    @classmethod
+    def restock(cls, pid, condition, amount, versions=None):
+        """
+        Adds amount to an Inventory record's quantity with a single conditional UPDATE
+        The quantity bounds are enforced by the database, so concurrent restocks
+        of the same record can't lose each other's updates
+        Returns: the restocked Inventory or None if the record does not exist
+        """
+        LOGGER.debug("Restocking (%s, %s) by %s", pid, condition, amount)
+        values, criteria, failure = cls.restock_update(amount)
+        return cls.update_by_key(pid, condition, values, versions, criteria, failure)
+
+    @classmethod
+    def restock_update(cls, amount):
+        """ Returns the (values, criteria, failure) of update_by_key for a restock """
+        quantity = cls.__table__.c.quantity + amount
+        return {keys.KEY_QTY: quantity}, quantity.between(keys.QTY_LOW, keys.QTY_HIGH), \
+            DataValidationError("Error in data: {}".format(["Quantity"]))
+
+    @classmethod
+    def reserve(cls, pid, condition, amount, versions=None):
+        """
+        Takes amount out of an available Inventory record's quantity with a single
+        conditional UPDATE, marking the record unavailable when it runs out
+        Concurrent reservations queue on the row lock, so stock is never oversold
+        Returns: the reserved Inventory or None if the record does not exist
+        """
+        LOGGER.debug("Reserving %s of (%s, %s)", amount, pid, condition)
+        values, criteria, failure = cls.reserve_update(pid, condition, amount)
+        return cls.update_by_key(pid, condition, values, versions, criteria, failure)
+
+    @classmethod
+    def reserve_update(cls, pid, condition, amount):
+        """ Returns the (values, criteria, failure) of update_by_key for a reservation """
+        table = cls.__table__
+        quantity = table.c.quantity - amount
+        # SET expressions all see the row before the update
+        available = sqlalchemy.case([(quantity == keys.QTY_LOW, keys.AVAILABLE_FALSE)],
+                                    else_=table.c.available)
+        return {keys.KEY_QTY: quantity, keys.KEY_AVL: available}, \
+            sqlalchemy.and_(table.c.available == keys.AVAILABLE_TRUE, quantity >= keys.QTY_LOW), \
+            OutOfStockError("Inventory ({}, {}) does not hold {} available"\
+                            .format(pid, condition, amount))
 
     ######################################################################
     def delete(self):
         """ Removes an Inventory record from the data store """
-        LOGGER.info("Deleting {}".format(self.product_id))
+        LOGGER.debug("Deleting %s", self.product_id)
+        key = self.cache_key(self.product_id, self.condition)
         DB.session.delete(self)
         DB.session.commit()
+        self.changed(key)
 
     ######################################################################
     @classmethod
     def find_all(cls):
         """ Returns all of the Inventory records in the database """
-        LOGGER.info("Processing GET all Inventory records")
+        LOGGER.debug("Processing GET all Inventory records")
         return cls.query.all()
 
     @classmethod
-    def find_by_product_id(cls, product_id):
+    def find_by_product_id(cls, product_id, query=None):
         """ Returns the Inventory record with the given product_id
         Args: product_id (Integer): the product_id of the Inventory records you want to match
+              query (Query): an Inventory query to narrow down instead of all the records
         """
-        LOGGER.info("Processing GET query for {}...".format(product_id))
-        return cls.query.filter(cls.product_id == product_id)
+        LOGGER.debug("Processing GET query for %s...", product_id)
+        return (cls.query if query is None else query).filter(cls.product_id == product_id)
 
     @classmethod
-    def find_by_condition(cls, condition):
+    def find_by_condition(cls, condition, query=None):
         """ Returns the Inventory record with the given condition
         Args: condition (String): the condition of the Inventory records you want to match
+              query (Query): an Inventory query to narrow down instead of all the records
         """
-        LOGGER.info("Processing GET query for {}...".format(condition))
-        return cls.query.filter(cls.condition == condition)
+        LOGGER.debug("Processing GET query for %s...", condition)
+        return (cls.query if query is None else query).filter(cls.condition == condition)
 
     @classmethod
-    def find_by_available(cls, available):
+    def find_by_available(cls, available, query=None):
         """ Returns the Inventory record with the given availability
         Args: available (Integer): the availability of the Inventory records you want to match
+              query (Query): an Inventory query to narrow down instead of all the records
         """
-        LOGGER.info("Processing GET query for {}...".format(available))
-        return cls.query.filter(cls.available == available)
+        LOGGER.debug("Processing GET query for %s...", available)
+        return (cls.query if query is None else query).filter(cls.available == available)
 
     @classmethod
-    def find_by_quantity(cls, quantity):
+    def find_by_quantity(cls, quantity, query=None):
         """ Returns the Inventory record with quantity >= the given quantity
         Args: quantity (Integer): the Inventory records with the minimum quantity
+              query (Query): an Inventory query to narrow down instead of all the records
+        """
+        LOGGER.debug("Processing GET query for %s...", quantity)
+        return (cls.query if query is None else query).filter(cls.quantity >= quantity)
+
+    @classmethod
+    def find_by_filters(cls, product_id=None, condition=None, quantity=None, available=None,
+                        query=None):
+        """ Returns the Inventory records matching every given filter in a single query
+        Args: product_id (Integer), condition (String), quantity (Integer, minimum) and
+              available (Integer); filters left as None (or out of range) are not applied
+              query (Query): an Inventory query to narrow down instead of all the records
+        """
+        query = cls.query if query is None else query
+        if product_id is not None:
+            query = cls.find_by_product_id(product_id, query)
+        if condition:
+            query = cls.find_by_condition(condition, query)
+        if quantity is not None and quantity >= keys.QTY_LOW:
+            query = cls.find_by_quantity(quantity, query)
+        if available in [keys.AVAILABLE_TRUE, keys.AVAILABLE_FALSE]:
+            query = cls.find_by_available(available, query)
+        return query
+
+    @classmethod
+    def find_below_restock_level(cls, condition=None, query=None):
+        """ Returns the Inventory records whose quantity is at or below their restock level
+        Args: condition (String): only return records in this condition
+              query (Query): an Inventory query to narrow down instead of all the records
+        """
+        LOGGER.debug("Processing low stock query for condition %s...", condition)
+        # Matches the predicate of ix_inventory_low_stock, so only that index is read
+        query = (cls.query if query is None else query).filter(cls.quantity <= cls.restock_level)
+        if condition is not None:
+            query = cls.find_by_condition(condition, query)
+        return query
+
+    @classmethod
+    def find_page(cls, query, limit=None, after=None):
+        """ Returns the records of a query ordered by their (product_id, condition) key
+        Args: query (Query): the Inventory query to page through
+              limit (Integer): the maximum number of records to return
+              after (tuple): the (product_id, condition) key the page starts after
+        """
+        LOGGER.debug("Processing GET page of %s after %s...", limit, after)
+        query = query.order_by(cls.product_id, cls.condition)
+        if after:
+            # A row-value comparison so the primary key index can seek to the page
+            query = query.filter(sqlalchemy.tuple_(cls.product_id, cls.condition) >
+                                 sqlalchemy.tuple_(*after))
+        if limit:
+            query = query.limit(limit)
+        return query
+
+    @classmethod
+    def rows(cls, query):
+        """ Returns the query reading plain tuples of the serialized fields, in FIELDS order
+        Args: query (Query): the Inventory query to read
+        """
+        return query.with_entities(*[getattr(cls, field) for field in FIELDS])
+
+    @classmethod
+    def stream(cls, query):
+        """ Iterates over the records of a query through a server-side cursor
+        Args: query (Query): the Inventory query to read
+        """
+        LOGGER.debug("Processing streamed GET...")
+        return query.yield_per(keys.STREAM_BATCH_SIZE)
+
+    @classmethod
+    def find_cached(cls, pid, condition):
+        """ Returns the serialized Inventory record with the given key, read through the cache
+        Args: pid (Integer), condition (String): the key of the Inventory record
         """
-        LOGGER.info("Processing GET query for {}...".format(quantity))
-        return cls.query.filter(cls.quantity >= quantity)
+        key = cls.cache_key(pid, condition)
+        data = CACHE.get(key)
+        if data is None:
+            generation = CACHE.generation
+            inventory = cls.find_by_product_id_condition(pid, condition)
+            if not inventory:
+                return None
+            data = inventory.serialize()
+            CACHE.set(key, data, generation)
+        return data
 
     @classmethod
     def find_by_product_id_condition(cls, pid, condition):
         """ Finds an Inventory record by its product_id and condition """
-        LOGGER.info("Processing GET for product_id {} and condition {}".format(pid, condition))
+        LOGGER.debug("Processing GET for product_id %s and condition %s", pid, condition)
         return cls.query.get((pid, condition))
+
+################################################################################
+class InventoryStats(DB.Model):
+    """
+    Per condition totals of the Inventory table
+    Kept current by statement-level triggers on the inventory table, so every
+    write adjusts them in its own transaction. Each condition is split over
+    keys.STATS_SLOTS rows by product_id, so writers to different products
+    rarely wait on the same counter row
+    """
+    __tablename__ = 'inventory_stats'
+
+    condition = DB.Column(DB.String(100), primary_key=True)
+    slot = DB.Column(DB.Integer, primary_key=True)
+    skus = DB.Column(DB.BigInteger, nullable=False, default=0)
+    units = DB.Column(DB.BigInteger, nullable=False, default=0)
+    available = DB.Column(DB.BigInteger, nullable=False, default=0)
+
+    @classmethod
+    def summary(cls):
+        """ Returns the skus, units and available totals of every condition """
+        LOGGER.debug("Processing GET for inventory stats")
+        return cls.totals(cls.summary_query().with_session(DB.session()))
+
+    @classmethod
+    def summary_query(cls):
+        """ Returns the query of the (condition, skus, units, available) sums, without a session """
+        return sqlalchemy.orm.Query([cls.condition, sqlalchemy.func.sum(cls.skus),
+                                     sqlalchemy.func.sum(cls.units),
+                                     sqlalchemy.func.sum(cls.available)]).group_by(cls.condition)
+
+    @staticmethod
+    def totals(rows):
+        """ Returns the summary of the rows of summary_query """
+        totals = {cnd: {keys.KEY_SKUS: 0, keys.KEY_UNITS: 0, keys.KEY_AVL: 0}
+                  for cnd in keys.CONDITIONS}
+        for condition, skus, units, available in rows:
+            totals[condition] = {keys.KEY_SKUS: int(skus), keys.KEY_UNITS: int(units),
+                                 keys.KEY_AVL: int(available)}
+        return totals
+
+    @classmethod
+    def counters(cls):
+        """ Returns the set of non-zero counter rows """
+        return {row for row in DB.session.query(cls.condition, cls.slot, cls.skus,
+                                                cls.units, cls.available) if any(row[2:])}
+
+    @classmethod
+    def reconcile(cls):
+        """
+        Recomputes every counter from the inventory table
+        Writers are blocked while it runs, so the counters can't miss a concurrent change
+        Returns: the number of counter rows that had drifted
+        """
+        LOGGER.info("Reconciling inventory stats")
+        DB.session.execute("LOCK TABLE {} IN SHARE MODE".format(Inventory.__tablename__))
+        before = cls.counters()
+        DB.session.execute(cls.__table__.delete())
+        DB.session.execute(STATS_RECOMPUTE)
+        after = cls.counters()
+        DB.session.commit()
+        drifted = len({row[:2] for row in before ^ after})
+        LOGGER.info("Reconciled inventory stats, %s counters had drifted", drifted)
+        return drifted
+
+# Adds the (condition, slot) sums of a set of signed row deltas to the counters
+STATS_UPSERT = """
+INSERT INTO inventory_stats AS s (condition, slot, skus, units, available)
+SELECT condition, slot, sum(skus), sum(units), sum(available) FROM ({deltas}) d
+GROUP BY condition, slot
+HAVING sum(skus) <> 0 OR sum(units) <> 0 OR sum(available) <> 0
+ORDER BY condition, slot
+ON CONFLICT (condition, slot) DO UPDATE SET skus = s.skus + EXCLUDED.skus,
+    units = s.units + EXCLUDED.units, available = s.available + EXCLUDED.available"""
+
+STATS_DELTAS = """
+SELECT condition, product_id % {slots} AS slot, {sign} AS skus,
+       {sign} * coalesce(quantity, 0) AS units,
+       {sign} * (CASE WHEN available = {available} THEN 1 ELSE 0 END) AS available
+FROM {rows}"""
+
+def stats_deltas(rows, sign):
+    """ Returns the signed counter deltas of the rows of a transition table """
+    return STATS_DELTAS.format(slots=keys.STATS_SLOTS, sign=sign, rows=rows,
+                               available=keys.AVAILABLE_TRUE)
+
+STATS_RECOMPUTE = sqlalchemy.text(STATS_UPSERT.format(deltas=stats_deltas("inventory", 1)))
+
+STATS_TRIGGER_DDL = """
+CREATE OR REPLACE FUNCTION inventory_stats_apply() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        {insert};
+    ELSIF TG_OP = 'UPDATE' THEN
+        {update};
+    ELSE
+        {delete};
+    END IF;
+    RETURN NULL;
+END $$;
+DROP TRIGGER IF EXISTS inventory_stats_insert ON inventory;
+DROP TRIGGER IF EXISTS inventory_stats_update ON inventory;
+DROP TRIGGER IF EXISTS inventory_stats_delete ON inventory;
+CREATE TRIGGER inventory_stats_insert AFTER INSERT ON inventory
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE PROCEDURE inventory_stats_apply();
+CREATE TRIGGER inventory_stats_update AFTER UPDATE ON inventory
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE inventory_stats_apply();
+CREATE TRIGGER inventory_stats_delete AFTER DELETE ON inventory
+    REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE PROCEDURE inventory_stats_apply();
+""".format(
+    insert=STATS_UPSERT.format(deltas=stats_deltas("new_rows", 1)),
+    update=STATS_UPSERT.format(deltas=stats_deltas("new_rows", 1) + " UNION ALL " +
+                               stats_deltas("old_rows", -1)),
+    delete=STATS_UPSERT.format(deltas=stats_deltas("old_rows", -1)))
+
+def install_stats_triggers(target, connection, **kw):
+    """
+    Installs the counter triggers, and fills the counters when their table is
+    new, which is also how an existing inventory table is brought under them
+    """
+    LOGGER.info("Installing inventory stats triggers on %s", target.name)
+    if not connection.dialect.has_table(connection, Inventory.__tablename__) or \
+       not connection.dialect.has_table(connection, InventoryStats.__tablename__):
+        return
+    connection.execute(sqlalchemy.text(STATS_TRIGGER_DDL))
+    if target is InventoryStats.__table__:
+        connection.execute(InventoryStats.__table__.delete())
+        connection.execute(STATS_RECOMPUTE)
+
+sqlalchemy.event.listen(Inventory.__table__, 'after_create', install_stats_triggers)
+sqlalchemy.event.listen(InventoryStats.__table__, 'after_create', install_stats_triggers)
+
+################################################################################
+class InventoryChange(DB.Model):
+    """
+    Append-only log of the writes to the Inventory table
+
+    Filled by statement-level triggers on the inventory table, so every write
+    is logged in its own transaction, whichever path made it. Each change holds
+    the record as the write left it (only its key and last version once
+    deleted). The log is read in (txid, id) order, and a change is only handed
+    out once every transaction older than the oldest running one has ended, so
+    a reader moving a cursor forward never skips a change that commits late
+    """
+    __tablename__ = 'inventory_changes'
+
+    __table_args__ = (
+        DB.Index('ix_inventory_changes_txid_id', 'txid', 'id'),
+        DB.Index('ix_inventory_changes_changed_at', 'changed_at'),
+    )
+
+    id = DB.Column(DB.BigInteger, primary_key=True)
+    txid = DB.Column(DB.BigInteger, nullable=False,
+                     server_default=sqlalchemy.text("txid_current()"))
+    changed_at = DB.Column(DB.DateTime(timezone=True), nullable=False,
+                           server_default=sqlalchemy.func.now())
+    operation = DB.Column(DB.String(10), nullable=False)
+    product_id = DB.Column(DB.Integer, nullable=False)
+    condition = DB.Column(DB.String(100), nullable=False)
+    quantity = DB.Column(DB.Integer)
+    restock_level = DB.Column(DB.Integer)
+    available = DB.Column(DB.Integer)
+    version = DB.Column(DB.BigInteger)
+
+    def position(self):
+        """ Returns the (txid, id) position of the change in the log """
+        return self.txid, self.id
+
+    def serialize(self):
+        """ Serializes a change into a dictionary """
+        return {
+            keys.KEY_OPERATION: self.operation,
+            keys.KEY_PID: self.product_id,
+            keys.KEY_CND: self.condition,
+            keys.KEY_QTY: self.quantity,
+            keys.KEY_LVL: self.restock_level,
+            keys.KEY_AVL: self.available,
+            keys.KEY_VER: self.version,
+            keys.KEY_CHANGED_AT: self.changed_at.isoformat()
+        }
+
+    @classmethod
+    def feed(cls, after=None, limit=keys.CHANGES_LIMIT_DEFAULT, query=None):
+        """
+        Returns the query of the changes that follow a position of the log, in log order
+        Args: after (tuple): the (txid, id) position of the last change read,
+                             None to start with the oldest change kept
+              limit (Integer): the maximum number of changes to return
+              query (Query): an InventoryChange query to narrow down instead of all the changes
+        """
+        query = cls.visible(query)
+        if after is not None:
+            query = query.filter(sqlalchemy.tuple_(cls.txid, cls.id) > sqlalchemy.tuple_(*after))
+        return query.order_by(cls.txid, cls.id).limit(limit)
+
+    @classmethod
+    def last(cls, query=None):
+        """
+        Returns the query of the last change of the log that feed hands out
+        Args: query (Query): an InventoryChange query to narrow down instead of all the changes
+        """
+        return cls.visible(query).order_by(cls.txid.desc(), cls.id.desc()).limit(1)
+
+    @classmethod
+    def visible(cls, query=None):
+        """ Returns the query of the changes no later commit can come before """
+        # Transactions before the oldest running one have all ended,
+        # so no change can show up below it
+        visible = sqlalchemy.func.txid_snapshot_xmin(sqlalchemy.func.txid_current_snapshot())
+        return (cls.query if query is None else query).filter(cls.txid < visible)
+
+    @classmethod
+    def since(cls, after=None, limit=keys.CHANGES_LIMIT_DEFAULT):
+        """
+        Returns the changes that follow a position of the log, in log order
+        Raises: ChangesPrunedError if changes after the position were pruned
+        """
+        LOGGER.debug("Processing GET changes after %s...", after)
+        changes = cls.feed(after, limit).all()
+        # Read after the changes: a prune that ended before them is seen here,
+        # a later one cut nothing
+        horizon = InventoryChangeHorizon.position()
+        if after is not None and horizon is not None and tuple(after) < horizon:
+            raise ChangesPrunedError("Changes after the cursor were pruned")
+        return changes
+
+    @classmethod
+    def prune(cls, retention):
+        """
+        Deletes the changes older than retention seconds, up to a position of the
+        log, which the horizon remembers so readers behind it can be told
+        Returns: the number of changes deleted
+        """
+        LOGGER.info("Pruning the inventory changes older than %s seconds", retention)
+        # A large prune must not be cut off by the per-statement timeout of the API
+        DB.session.execute("SET LOCAL statement_timeout = 0")
+        cutoff = sqlalchemy.func.now() - datetime.timedelta(seconds=retention)
+        visible = sqlalchemy.func.txid_snapshot_xmin(sqlalchemy.func.txid_current_snapshot())
+        last = DB.session.query(cls.txid, cls.id)\
+            .filter(cls.changed_at < cutoff, cls.txid < visible)\
+            .order_by(cls.changed_at.desc()).first()
+        if last is None:
+            DB.session.commit()
+            return 0
+        deleted = DB.session.query(cls).filter(
+            sqlalchemy.tuple_(cls.txid, cls.id) <= sqlalchemy.tuple_(*last))\
+            .delete(synchronize_session=False)
+        InventoryChangeHorizon.advance(tuple(last))
+        DB.session.commit()
+        LOGGER.info("Pruned %s inventory changes", deleted)
+        return deleted
+
+class InventoryChangeHorizon(DB.Model):
+    """ The position of the last change pruned from the log, in its single row """
+    __tablename__ = 'inventory_change_horizon'
+
+    id = DB.Column(DB.Integer, primary_key=True, autoincrement=False)
+    txid = DB.Column(DB.BigInteger, nullable=False)
+    change_id = DB.Column(DB.BigInteger, nullable=False)
+
+    @classmethod
+    def position(cls):
+        """ Returns the (txid, id) of the last change pruned, None if none was """
+        row = DB.session.query(cls.txid, cls.change_id).filter(cls.id == 1).first()
+        return tuple(row) if row else None
+
+    @classmethod
+    def advance(cls, position):
+        """ Moves the horizon to a (txid, id) position, in the caller's transaction """
+        statement = postgresql.insert(cls.__table__).values(id=1, txid=position[0],
+                                                            change_id=position[1])
+        DB.session.execute(statement.on_conflict_do_update(
+            index_elements=[cls.id], set_={'txid': statement.excluded.txid,
+                                           'change_id': statement.excluded.change_id}))
+
+# One change per written row, in key order within a statement
+CHANGES_INSERT = """
+INSERT INTO inventory_changes
+    (operation, product_id, condition, quantity, restock_level, available, version)
+SELECT {operation}, product_id, condition, {values}, version FROM {rows}
+ORDER BY product_id, condition"""
+
+CHANGES_TRIGGER_DDL = """
+CREATE OR REPLACE FUNCTION inventory_changes_log() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        {delete};
+    ELSE
+        {write};
+    END IF;
+    -- Wakes the listeners once the transaction commits; repeats within it are folded into one
+    PERFORM pg_notify('{channel}', '');
+    RETURN NULL;
+END $$;
+DROP TRIGGER IF EXISTS inventory_changes_insert ON inventory;
+DROP TRIGGER IF EXISTS inventory_changes_update ON inventory;
+DROP TRIGGER IF EXISTS inventory_changes_delete ON inventory;
+CREATE TRIGGER inventory_changes_insert AFTER INSERT ON inventory
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE PROCEDURE inventory_changes_log();
+CREATE TRIGGER inventory_changes_update AFTER UPDATE ON inventory
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE PROCEDURE inventory_changes_log();
+CREATE TRIGGER inventory_changes_delete AFTER DELETE ON inventory
+    REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE PROCEDURE inventory_changes_log();
+""".format(
+    channel=keys.CHANGES_CHANNEL,
+    write=CHANGES_INSERT.format(operation="lower(TG_OP)", rows="new_rows",
+                                values="quantity, restock_level, available"),
+    delete=CHANGES_INSERT.format(operation="'delete'", rows="old_rows",
+                                 values="NULL::integer, NULL::integer, NULL::integer"))
+
+def install_change_triggers(target, connection, **kw):
+    """ Installs the change log triggers once both tables exist """
+    LOGGER.info("Installing inventory change triggers on %s", target.name)
+    if not connection.dialect.has_table(connection, Inventory.__tablename__) or \
+       not connection.dialect.has_table(connection, InventoryChange.__tablename__):
+        return
+    connection.execute(sqlalchemy.text(CHANGES_TRIGGER_DDL))
+
+sqlalchemy.event.listen(Inventory.__table__, 'after_create', install_change_triggers)
+sqlalchemy.event.listen(InventoryChange.__table__, 'after_create', install_change_triggers)
@@ -0,0 +1,74 @@
+"""
+Connection Pool for Inventory
+
+Builds the SQLAlchemy engine options from the app config and times how long
+requests wait for a pooled database connection
+"""
+import time
+import threading
+from sqlalchemy import exc
+from sqlalchemy.pool import QueuePool
+from service import keys
+
+################################################################################
+class TimedQueuePool(QueuePool):
+    """
+    QueuePool that counts checkouts and timeouts and the time spent waiting for a
+    connection, which includes opening a new one when the pool is not yet full
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(TimedQueuePool, self).__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super(TimedQueuePool, self)._do_get()
+        except exc.TimeoutError:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            with self._stats_lock:
+                self.checkouts += 1
+                self.wait_total += waited
+                self.wait_max = max(self.wait_max, waited)
+
+    def stats(self):
+        """ Returns the live connection counts and the checkout wait counters """
+        with self._stats_lock:
+            return {
+                'size': self.size(),
+                'checked_out': self.checkedout(),
+                'idle': self.checkedin(),
+                # QueuePool counts overflow from -pool_size until the pool is full
+                'overflow': max(0, self.overflow()),
+                'max_overflow': self._max_overflow,
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'wait_total': self.wait_total,
+                'wait_max': self.wait_max,
+                'wait_avg': self.wait_total / self.checkouts if self.checkouts else 0.0
+            }
+
+def engine_options(config):
+    """ Returns the SQLAlchemy engine options for the pool settings in a Flask config """
+    options = {
+        'poolclass': TimedQueuePool,
+        'pool_size': config.get(keys.KEY_DB_POOL_SIZE, 5),
+        'max_overflow': config.get(keys.KEY_DB_MAX_OVERFLOW, 10),
+        'pool_timeout': config.get(keys.KEY_DB_POOL_TIMEOUT, 30),
+        'pool_recycle': config.get(keys.KEY_DB_POOL_RECYCLE, -1),
+        'pool_pre_ping': config.get(keys.KEY_DB_POOL_PRE_PING, False)
+    }
+    statement_timeout = config.get(keys.KEY_DB_STATEMENT_TIMEOUT, 0)
+    if statement_timeout:
+        # Milliseconds, set on every new connection by the server
+        options['connect_args'] = {'options': '-c statement_timeout={}'.format(statement_timeout)}
+    return options
@@ -0,0 +1,144 @@
+"""
+Profiling for Inventory
+
+Opt-in profiling of single requests. With PROFILING_ENABLED set, a request sent
+with "X-Profile: 1" and a valid X-Api-Key runs under cProfile, and its SQL
+statements are timed. The results are stored in PROFILE_DIR as
+    <id>.pstats     the cProfile stats, for pstats or snakeviz
+    <id>.collapsed  collapsed stacks for flamegraph.pl or speedscope
+    <id>.sql.json   every statement with its duration in seconds
+and the <id> is sent back in the X-Profile-Id header
+"""
+import os
+import json
+import time
+import uuid
+import hmac
+import pstats
+import cProfile
+import threading
+from collections import defaultdict
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from service import app, keys
+
+# The statements of the request being profiled on this thread
+CAPTURE = threading.local()
+
+################################################################################
+class ProfilerMiddleware():
+    """ WSGI middleware that profiles the requests asking for it """
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        if not self.wants_profile(environ):
+            return self.wsgi_app(environ, start_response)
+
+        profile_id = "{}-{}-{}-{}".format(
+            time.strftime("%Y%m%dT%H%M%S"), environ.get('REQUEST_METHOD', ''),
+            environ.get('PATH_INFO', '').strip('/').replace('/', '.') or 'root',
+            uuid.uuid4().hex[:8])
+
+        def profiled_start_response(status, headers, exc_info=None):
+            headers.append((keys.KEY_PROFILE_ID_HEADER, profile_id))
+            return start_response(status, headers, exc_info)
+
+        def run():
+            body = self.wsgi_app(environ, profiled_start_response)
+            try:
+                # Streamed bodies are produced here, so their queries are profiled too
+                return list(body)
+            finally:
+                if hasattr(body, 'close'):
+                    body.close()
+
+        profiler = cProfile.Profile()
+        CAPTURE.statements = []
+        try:
+            body = profiler.runcall(run)
+        finally:
+            statements, CAPTURE.statements = CAPTURE.statements, None
+            save_profile(profile_id, profiler, statements)
+        return body
+
+    @staticmethod
+    def wants_profile(environ):
+        """ Returns True if profiling is on and the request asks for it with the API key """
+        if not app.config.get(keys.KEY_PROFILING_ENABLED):
+            return False
+        if environ.get('HTTP_' + keys.KEY_PROFILE_HEADER.upper().replace('-', '_')) != '1':
+            return False
+        api_key = app.config.get(keys.KEY_API) or ''
+        sent = environ.get('HTTP_' + keys.KEY_API_HEADER.upper().replace('-', '_'), '')
+        return bool(api_key) and hmac.compare_digest(sent.encode(), api_key.encode())
+
+def save_profile(profile_id, profiler, statements):
+    """
+    Stores the stats, collapsed stacks and SQL timings of a profiled request
+    A profile that cannot be written is only logged, the request it profiled still succeeds
+    """
+    directory = app.config.get(keys.KEY_PROFILE_DIR)
+    path = os.path.join(directory, profile_id)
+    try:
+        os.makedirs(directory, exist_ok=True)
+        profiler.dump_stats(path + '.pstats')
+        stats = pstats.Stats(profiler)
+        with open(path + '.collapsed', 'w') as collapsed:
+            for stack, micros in sorted(collapsed_stacks(stats).items()):
+                collapsed.write("{} {}\n".format(stack, micros))
+        with open(path + '.sql.json', 'w') as sql:
+            json.dump(statements, sql, indent=1)
+    except OSError as err:
+        app.logger.error("Profile of the request not stored as %s: %s", path, err)
+        return
+    app.logger.info("Profile of the request stored as %s", path)
+
+def collapsed_stacks(stats):
+    """
+    Returns the microseconds of self time of every call stack in a pstats.Stats
+    cProfile only keeps caller/callee pairs, so the time of a function called
+    from several places is split between its stacks by how much each call cost
+    """
+    stats.calc_callees()
+    stacks = defaultdict(int)
+
+    def label(func):
+        filename, line, name = func
+        return "{}:{}:{}".format(os.path.basename(filename), line, name)
+
+    def walk(func, path, cumulative):
+        _, _, self_time, total_time, _ = stats.stats[func]
+        share = cumulative / total_time if total_time else 0.0
+        path = path + [label(func)]
+        micros = int(self_time * share * 1e6)
+        if micros:
+            stacks[";".join(path)] += micros
+        for callee, edge in stats.all_callees.get(func, {}).items():
+            # edge is (primitive calls, calls, self time, cumulative time) from func
+            if edge[3] * share >= 1e-6 and label(callee) not in path:
+                walk(callee, path, edge[3] * share)
+
+    for func, (_, _, _, total_time, callers) in stats.stats.items():
+        if not callers:
+            walk(func, [], total_time)
+    return stacks
+
+######################################################################
+# SQL TIMINGS
+######################################################################
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_statement(conn, cursor, statement, parameters, context, executemany):
+    """ Remembers when a profiled statement started """
+    if getattr(CAPTURE, 'statements', None) is not None:
+        CAPTURE.started = time.perf_counter()
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def record_statement(conn, cursor, statement, parameters, context, executemany):
+    """ Records a profiled statement with its duration """
+    if getattr(CAPTURE, 'statements', None) is not None:
+        CAPTURE.statements.append({'statement': statement,
+                                   'seconds': time.perf_counter() - CAPTURE.started})
+
+app.wsgi_app = ProfilerMiddleware(app.wsgi_app)
@@ -0,0 +1,82 @@
+"""
+Request Log for Inventory
+
+One structured line per request, in logfmt, on the requests child of app.logger:
+    method=PUT path=/api/inventory/1/condition/new/restock resource=InventoryResourceRestock
+    status=200 duration_ms=3.27 bytes=98 request_id=- remote=10.0.0.7
+Under gunicorn it goes to gunicorn's error log, at its level, through the
+handlers __init__.py gives app.logger.
+The duration is to the first byte, like the metrics, so for streamed bodies
+bytes is "-".
+
+The line is only formatted when a handler emits it. Successful requests are
+sampled with REQUEST_LOG_SAMPLE_RATE (1.0 logs all of them, 0 none), while
+client errors (as warnings), server errors (as errors) and requests slower than
+REQUEST_LOG_SLOW_MS are always logged.
+"""
+import time
+import random
+import logging
+from flask import g, request
+from service import app, keys
+from service.metrics import resource_name
+
+# app.logger is named after the package (service), not flask.app
+LOGGER = app.logger.getChild("requests")
+
+MESSAGE = ("method=%s path=%s resource=%s status=%d duration_ms=%.2f bytes=%s "
+           "request_id=%s remote=%s")
+
+################################################################################
+class RequestLog():
+    """ Decides which requests are logged, and at which level """
+
+    def __init__(self, sample_rate=1.0, slow_ms=1000.0):
+        self.configure(sample_rate, slow_ms)
+
+    def configure(self, sample_rate, slow_ms):
+        """ Sets the share of successful requests logged and the slow request threshold """
+        self.sample_rate = min(max(float(sample_rate), 0.0), 1.0)
+        self.slow_ms = float(slow_ms)
+
+    def level(self, status_code, duration_ms):
+        """ Returns the level a request is logged at, None if it is not logged """
+        if status_code >= 500:
+            return logging.ERROR
+        if status_code >= 400:
+            return logging.WARNING
+        if duration_ms >= self.slow_ms:
+            return logging.INFO
+        if self.sample_rate >= 1.0 or random.random() < self.sample_rate:
+            return logging.INFO
+        return None
+
+REQUEST_LOG = RequestLog()
+
+def init_app(flask_app):
+    """ Configures the request log from the app config """
+    REQUEST_LOG.configure(flask_app.config.get(keys.KEY_REQUEST_LOG_SAMPLE_RATE, 1.0),
+                          flask_app.config.get(keys.KEY_REQUEST_LOG_SLOW_MS, 1000.0))
+
+######################################################################
+# REQUEST HOOKS
+######################################################################
+@app.before_request
+def start_request_log():
+    """ Remembers when the request started """
+    g.request_log_start = time.perf_counter()
+
+@app.after_request
+def log_request(response):
+    """ Logs the request if it is sampled, failed or was slow """
+    start = g.pop('request_log_start', None)
+    if start is None:
+        return response
+    duration_ms = (time.perf_counter() - start) * 1000
+    level = REQUEST_LOG.level(response.status_code, duration_ms)
+    if level is not None and LOGGER.isEnabledFor(level):
+        LOGGER.log(level, MESSAGE, request.method, request.path, resource_name(),
+                   response.status_code, duration_ms,
+                   "-" if response.is_streamed else response.content_length,
+                   request.headers.get(keys.KEY_REQUEST_ID_HEADER, "-"), request.remote_addr)
+    return response
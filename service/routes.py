@@ -5,14 +5,44 @@ Paths:
 ------
 GET /inventory
     - Returns a list of all inventories in the inventory
+    - Filters with any combination of ?product_id=&condition=&quantity=(>=)&available=
+    - Pages with ?limit=<int>&after=<cursor>, the next cursor is in the X-Next-Cursor header
+    - Streams newline delimited JSON when requested with Accept: application/x-ndjson
+    - Answers If-None-Match with 304 NOT MODIFIED while the table is unchanged
 GET /inventory/<int:product_id>/condition/<string:condition>
     - Returns the inventory record with the given product_id and condition
+    - Answers If-None-Match with 304 NOT MODIFIED while the record is unchanged
+GET /inventory/low-stock
+    - Returns the inventories with quantity <= restock_level, filtered by ?condition= and paged
+      like GET /inventory
+GET /inventory/changes
+    - Returns the creates, updates and deletes of inventory records in the order they were
+      logged, ?since=<cursor>&limit=<int>; the cursor to pass next is in the X-Next-Cursor
+      header, and 410 GONE means changes after the cursor were pruned
+GET /inventory/stats
+    - Returns the record count, total quantity and available count of each condition
+GET /inventory/cache
+    - Returns the hit/miss/eviction counters of the lookup cache
+GET /inventory/pool
+    - Returns the connection counts and checkout waits of the database pool
+GET /inventory/export
+    - Streams the inventory records as ?format=csv (default) or parquet from one snapshot,
+      filtered like GET /inventory
 
 POST /inventory
     - Given the data body this creates an inventory record in the DB
+POST /inventory/bulk
+    - Given a list of records in the body this creates them all in one transaction
+POST /inventory/import
+    - Given a CSV file (text/csv body or multipart "file") this creates or updates its
+      records in one transaction and reports the rejected rows
+POST /inventory/<int:product_id>/condition/<string:condition>/reserve
+    - Given the product_id, condition and amount (body) this updates quantity -= amount
+      only if that much is available, and available = 0 once quantity reaches 0
 
 PUT /inventory/<int:product_id>/condition/<string:condition>
     - Updates the inventory record with the given product_id and condition
+    - Every PUT answers 412 when If-Match (or the version in the body) is not the current version
 PUT /inventory/<int:product_id>/condition/<string:condition>/activate
     - Given the product_id and condition this updates available = 1
 PUT /inventory/<int:product_id>/condition/<string:condition>/deactivate
@@ -25,15 +55,22 @@ DELETE /inventory/<int:product_id>/condition/<string:condition>
 """
 
 import re
+import json
+import codecs
 import uuid
+import base64
+import hashlib
 import logging
 from functools import wraps
-from flask import request, render_template
+from flask import Response, request, render_template, stream_with_context
 from flask_api import status
-from flask_restplus import Api, Resource, fields, reqparse
+from flask_restplus import Api, Resource, fields, inputs, reqparse
+from werkzeug.http import quote_etag
 
-from service import keys
-from service.model import Inventory, DataValidationError
+from service import keys, serializer, exporter
+from service.importer import import_csv
+from service.model import Inventory, DataValidationError, PreconditionFailedError, \
+    OutOfStockError, InventoryStats, InventoryChange, ChangesPrunedError, CACHE, DB
 from . import app
 
 authorizations = {
@@ -71,7 +108,10 @@ inventory_model = api.model('Inventory', {
             description='The level below which restock this item is triggered.\nNote: {}>=0'
             .format(keys.KEY_LVL)),
     keys.KEY_AVL: fields.Integer(required=True,
-            description='Is the Product avaialble?\nNote: Available (1) or Unavailable(0)')
+            description='Is the Product avaialble?\nNote: Available (1) or Unavailable(0)'),
+    keys.KEY_VER: fields.Integer(readOnly=True,
+            description='The version of the record, also sent as its ETag.\n'
+            'Send it back (or the ETag in If-Match) to only update an unchanged record')
 })
 
 restock_model = api.model('Restock', {
@@ -80,6 +120,99 @@ restock_model = api.model('Restock', {
             .format(keys.KEY_AMT)),
 })
 
+reserve_model = api.model('Reserve', {
+    keys.KEY_AMT: fields.Integer(required=True,
+            description='The Amount to take from the available Quantity\nNote: {} > 0'
+            .format(keys.KEY_AMT)),
+})
+
+bulk_error_model = api.model('BulkError', {
+    keys.KEY_INDEX: fields.Integer(readOnly=True,
+            description='Position of the rejected record in the posted list'),
+    keys.KEY_STATUS: fields.Integer(readOnly=True,
+            description='The status the record would have received on its own (400 or 409)'),
+    keys.KEY_MESSAGE: fields.String(readOnly=True,
+            description='Why the record was rejected')
+})
+
+bulk_model = api.model('BulkResult', {
+    keys.KEY_CREATED: fields.Integer(readOnly=True,
+            description='The number of Inventory records created'),
+    keys.KEY_ERRORS: fields.List(fields.Nested(bulk_error_model),
+            description='The records that were not created')
+})
+
+import_error_model = api.model('ImportError', {
+    keys.KEY_LINE: fields.Integer(readOnly=True,
+            description='Line of the rejected row in the CSV file'),
+    keys.KEY_MESSAGE: fields.String(readOnly=True,
+            description='Why the row was rejected')
+})
+
+import_model = api.model('ImportResult', {
+    keys.KEY_ROWS: fields.Integer(readOnly=True, description='The number of rows read'),
+    keys.KEY_CREATED: fields.Integer(readOnly=True,
+            description='The number of Inventory records created'),
+    keys.KEY_UPDATED: fields.Integer(readOnly=True,
+            description='The number of Inventory records changed'),
+    keys.KEY_UNCHANGED: fields.Integer(readOnly=True,
+            description='Valid rows that left their record as it was, or that a later '
+            'row of the same record replaced'),
+    keys.KEY_REJECTED: fields.Integer(readOnly=True,
+            description='The number of rows rejected'),
+    keys.KEY_ERRORS: fields.List(fields.Nested(import_error_model),
+            description='The first {} rejected rows'.format(keys.IMPORT_MAX_ERRORS))
+})
+
+cache_model = api.model('CacheStats', {
+    'enabled': fields.Boolean(readOnly=True, description='Is the lookup cache turned on?'),
+    'size': fields.Integer(readOnly=True, description='The number of cached records'),
+    'maxsize': fields.Integer(readOnly=True, description='The maximum number of cached records'),
+    'ttl': fields.Float(readOnly=True, description='Seconds a cached record is served for'),
+    'hits': fields.Integer(readOnly=True, description='Lookups answered from the cache'),
+    'misses': fields.Integer(readOnly=True, description='Lookups that went to the database'),
+    'evictions': fields.Integer(readOnly=True, description='Records evicted to make room')
+})
+
+pool_model = api.model('PoolStats', {
+    'size': fields.Integer(readOnly=True, description='Connections kept open by the pool'),
+    'checked_out': fields.Integer(readOnly=True, description='Connections in use'),
+    'idle': fields.Integer(readOnly=True, description='Open connections waiting in the pool'),
+    'overflow': fields.Integer(readOnly=True, description='Connections open beyond the pool size'),
+    'max_overflow': fields.Integer(readOnly=True, description='The limit of overflow connections'),
+    'checkouts': fields.Integer(readOnly=True, description='Connections handed out'),
+    'timeouts': fields.Integer(readOnly=True,
+            description='Checkouts that gave up waiting for a connection'),
+    'wait_total': fields.Float(readOnly=True, description='Seconds spent waiting for connections'),
+    'wait_max': fields.Float(readOnly=True, description='The longest wait in seconds'),
+    'wait_avg': fields.Float(readOnly=True, description='The mean wait in seconds')
+})
+
+condition_stats_model = api.model('ConditionStats', {
+    keys.KEY_SKUS: fields.Integer(readOnly=True, description='The number of Inventory records'),
+    keys.KEY_UNITS: fields.Integer(readOnly=True, description='The total Quantity'),
+    keys.KEY_AVL: fields.Integer(readOnly=True, description='The number of available records')
+})
+
+stats_model = api.model('InventoryStats', {
+    cnd: fields.Nested(condition_stats_model, description='Totals of the {} records'.format(cnd))
+    for cnd in keys.CONDITIONS
+})
+
+change_model = api.model('InventoryChange', {
+    keys.KEY_OPERATION: fields.String(readOnly=True,
+            description='What was done to the record: insert, update or delete'),
+    keys.KEY_PID: fields.Integer(readOnly=True, description='The Product ID of the record'),
+    keys.KEY_CND: fields.String(readOnly=True, description='The Condition of the record'),
+    keys.KEY_QTY: fields.Integer(readOnly=True, description='The Quantity after the change'),
+    keys.KEY_LVL: fields.Integer(readOnly=True, description='The Restock Level after the change'),
+    keys.KEY_AVL: fields.Integer(readOnly=True, description='The Availability after the change'),
+    keys.KEY_VER: fields.Integer(readOnly=True,
+            description='The version the change gave the record, its last one for a delete'),
+    keys.KEY_CHANGED_AT: fields.DateTime(readOnly=True,
+            description='When the transaction that made the change started')
+})
+
 # query string arguments
 inventory_args = reqparse.RequestParser()
 inventory_args.add_argument(keys.KEY_PID, type=int,
@@ -90,6 +223,32 @@ inventory_args.add_argument(keys.KEY_QTY, type=int,
                     required=False, help='List Inventory by (>=) Quantity')
 inventory_args.add_argument(keys.KEY_AVL, type=int,
                     required=False, help='List Inventory by Availability')
+FILTER_KEYS = [keys.KEY_PID, keys.KEY_CND, keys.KEY_QTY, keys.KEY_AVL]
+inventory_args.add_argument(keys.KEY_LIMIT, type=inputs.int_range(1, keys.PAGE_LIMIT_MAX),
+                    required=False, help='The maximum number of Inventories to return')
+inventory_args.add_argument(keys.KEY_AFTER, type=str,
+                    required=False, help='Return the page after this cursor')
+
+export_args = inventory_args.copy()
+export_args.remove_argument(keys.KEY_LIMIT)
+export_args.remove_argument(keys.KEY_AFTER)
+export_args.add_argument(keys.KEY_FORMAT, type=str, default=exporter.FORMAT_CSV,
+                    choices=sorted(exporter.CONTENT_TYPES), help='The file format of the export')
+
+low_stock_args = reqparse.RequestParser()
+low_stock_args.add_argument(keys.KEY_CND, type=str,
+                    required=False, help='List Inventory by Condition')
+low_stock_args.add_argument(keys.KEY_LIMIT, type=inputs.int_range(1, keys.PAGE_LIMIT_MAX),
+                    required=False, help='The maximum number of Inventories to return')
+low_stock_args.add_argument(keys.KEY_AFTER, type=str,
+                    required=False, help='Return the page after this cursor')
+
+changes_args = reqparse.RequestParser()
+changes_args.add_argument(keys.KEY_SINCE, type=str, required=False,
+                          help='Return the changes after this cursor, or from the oldest kept')
+changes_args.add_argument(keys.KEY_LIMIT, type=inputs.int_range(1, keys.PAGE_LIMIT_MAX),
+                          default=keys.CHANGES_LIMIT_DEFAULT,
+                          help='The maximum number of changes to return')
 
 
 ####################################################################################################
@@ -117,10 +276,155 @@ def generate_apikey():
 ####################################################################################################
 #  U T I L I T Y   F U N C T I O N S
 ####################################################################################################
-@app.before_first_request
 def init_db(dbname=keys.KEY_DB_NAME):
-    """ Initlaize the model """
-    Inventory.init_db(app)
+    """ Initlaize the model, and create its tables unless DB_CREATE_SCHEMA is off """
+    Inventory.init_db(app, app.config.get(keys.KEY_DB_CREATE_SCHEMA, True))
+
+def encode_cursor(record):
+    """ Encodes the key of a serialized Inventory record into an opaque page cursor """
+    key = json.dumps([record[keys.KEY_PID], record[keys.KEY_CND]])
+    return base64.urlsafe_b64encode(key.encode()).decode()
+
+def decode_cursor(cursor):
+    """
+    Decodes a page cursor into a (product_id, condition) key
+    Raises: ValueError if the cursor is malformed
+    """
+    try:
+        pid, cnd = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (TypeError, ValueError) as err:
+        raise ValueError("Invalid cursor: {}".format(err))
+    if not isinstance(pid, int) or not isinstance(cnd, str):
+        raise ValueError("Invalid cursor: {}".format(cursor))
+    return pid, cnd
+
+def encode_change_cursor(change):
+    """ Encodes the log position of an InventoryChange into an opaque feed cursor """
+    return base64.urlsafe_b64encode(json.dumps(change.position()).encode()).decode()
+
+def decode_change_cursor(cursor):
+    """ Decodes a feed cursor into a (txid, id) log position, raising ValueError if malformed """
+    try:
+        txid, change_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (TypeError, ValueError) as err:
+        raise ValueError("Invalid cursor: {}".format(err))
+    if not isinstance(txid, int) or not isinstance(change_id, int):
+        raise ValueError("Invalid cursor: {}".format(cursor))
+    return txid, change_id
+
+def amount_error(body):
+    """ Returns why a restock or reserve body holds no valid amount, None if it holds one """
+    # Checking for keys.KEY_AMT keyword
+    if not isinstance(body, dict) or keys.KEY_AMT not in body:
+        return "Invalid data: Amount missing"
+    # Checking for amount >= 0
+    if not re.search(r"^\-?\d+$", str(body[keys.KEY_AMT])):
+        return "Invalid data: Amount must be an integer"
+    if int(body[keys.KEY_AMT]) <= 0:
+        return "Invalid data: Amount <= 0"
+    return None
+
+def amount_from(body, product_id, condition):
+    """ Returns the positive amount in a restock or reserve body, aborting with 400 if invalid """
+    error = amount_error(body)
+    if error:
+        # A missing record takes precedence over a bad body
+        if not Inventory.find_by_product_id_condition(product_id, condition):
+            api.abort(status.HTTP_404_NOT_FOUND,
+                "Inventory with ({}, {})".format(product_id, condition))
+        api.abort(status.HTTP_400_BAD_REQUEST, error)
+    return int(body[keys.KEY_AMT])
+
+def etag_header(inventory):
+    """ Returns the ETag header of an Inventory record """
+    return {'ETag': quote_etag(Inventory.etag(inventory.serialize()))}
+
+def precondition_versions(if_match, body=None):
+    """
+    Returns the record versions in If-Match (a werkzeug ETags), or the version in
+    the body, None when there is no precondition and [] when no version can match
+    """
+    if if_match:
+        if if_match.star_tag:
+            return None
+        return [int(tag) for tag in if_match.as_set() if tag.isdigit()]
+    if isinstance(body, dict) and body.get(keys.KEY_VER) is not None:
+        return [int(body[keys.KEY_VER])] if str(body[keys.KEY_VER]).isdigit() else []
+    return None
+
+def expected_versions(body=None):
+    """
+    Returns the record versions a client expects from If-Match, or from the version
+    in the body, and None when the request carries no precondition
+    """
+    versions = precondition_versions(request.if_match, body)
+    if versions == []:
+        api.abort(status.HTTP_412_PRECONDITION_FAILED,
+                  "No current version matches the precondition")
+    return versions
+
+def list_response(inventories, params):
+    """
+    Returns a page of the records of a (not yet executed) Inventory query, or all
+    of them streamed as NDJSON, answering If-None-Match while the table is unchanged
+    """
+    mimetype = request.accept_mimetypes.best_match([keys.KEY_CONTENT_TYPE_JSON,
+                                                    keys.KEY_CONTENT_TYPE_NDJSON])
+    # Read before the query, so the tag can only lag behind the data it's sent with
+    etag = hashlib.md5("{}|{}|{}".format(Inventory.change_marker(), request.full_path,
+                                         mimetype).encode()).hexdigest()
+    if request.if_none_match.contains(etag):
+        return not_modified(etag)
+
+    after = None
+    if params[keys.KEY_AFTER]:
+        try:
+            after = decode_cursor(params[keys.KEY_AFTER])
+        except ValueError:
+            api.abort(status.HTTP_400_BAD_REQUEST, "Invalid data: malformed cursor")
+    limit = params[keys.KEY_LIMIT]
+    # Plain tuples, encoded in one pass without model objects or marshalling
+    rows = Inventory.rows(Inventory.find_page(inventories, limit, after))
+
+    # Full-catalog pulls are streamed as they are read instead of being built up in memory
+    if mimetype == keys.KEY_CONTENT_TYPE_NDJSON:
+        app.logger.debug("Streaming inventories")
+        response = stream_ndjson(Inventory.stream(rows))
+        response.set_etag(etag)
+        return response
+
+    results = rows.all()
+    headers = {'ETag': quote_etag(etag)}
+    if limit and len(results) == limit:
+        headers[keys.KEY_NEXT_CURSOR] = encode_cursor(serializer.row_dict(results[-1]))
+    app.logger.debug("Returning %s inventories", len(results))
+    return json_response(serializer.dump_rows(results), headers=headers)
+
+def bulk_result(created, invalid, conflicts):
+    """ Returns the body and status code answering an Inventory.create_bulk """
+    errors = [{keys.KEY_INDEX: index, keys.KEY_STATUS: status.HTTP_400_BAD_REQUEST,
+               keys.KEY_MESSAGE: message} for index, message in invalid.items()]
+    errors.extend({keys.KEY_INDEX: index, keys.KEY_STATUS: status.HTTP_409_CONFLICT,
+                   keys.KEY_MESSAGE: "Inventory already exists"} for index in conflicts)
+    errors.sort(key=lambda error: error[keys.KEY_INDEX])
+    app.logger.info("%s Inventories created, %s rejected.", len(created), len(errors))
+    code = status.HTTP_207_MULTI_STATUS if errors else status.HTTP_201_CREATED
+    return {keys.KEY_CREATED: len(created), keys.KEY_ERRORS: errors}, code
+
+def not_modified(etag):
+    """ Returns an empty 304 NOT MODIFIED response for the given entity tag """
+    response = Response(status=status.HTTP_304_NOT_MODIFIED)
+    response.set_etag(etag)
+    return response
+
+def stream_ndjson(rows):
+    """ Streams Inventory row tuples as newline delimited JSON, one chunk per batch read """
+    return Response(stream_with_context(serializer.ndjson_chunks(rows)),
+                    mimetype=keys.KEY_CONTENT_TYPE_NDJSON)
+
+def json_response(body, code=status.HTTP_200_OK, headers=None):
+    """ Returns a response with an already encoded JSON body """
+    return Response(body, code, headers, mimetype=keys.KEY_CONTENT_TYPE_JSON)
 
 ####################################################################################################
 # INDEX
@@ -146,44 +450,19 @@ class InventoryBase(Resource):
     #------------------------------------------------------------------
     @api.doc('list_inventories')
     @api.expect(inventory_args, validate=True)
-    @api.marshal_list_with(inventory_model)
+    @api.header(keys.KEY_NEXT_CURSOR,
+                'Pass as "after" to fetch the next page (only set with "limit")')
+    @api.produces([keys.KEY_CONTENT_TYPE_JSON, keys.KEY_CONTENT_TYPE_NDJSON])
+    @api.response(status.HTTP_304_NOT_MODIFIED,
+                  'Inventories not modified since the If-None-Match ETag')
+    @api.response(status.HTTP_200_OK, 'Success', [inventory_model])
     def get(self):
         """ Returns a collection of the inventory records """
-        msg = "A GET request for ALL inventories."
-        inventories = []
         params = inventory_args.parse_args()
-        if params[keys.KEY_PID]:
-            pid = params[keys.KEY_PID]
-            query = 'Filtering by category: {}'.format(params[keys.KEY_PID])
-            app.logger.info(query)
-            msg = "{} {}".format(msg, query)
-            inventories = Inventory.find_by_product_id(pid)
-        elif params[keys.KEY_CND]:
-            cnd = params[keys.KEY_CND]
-            query = 'Filtering by category: {}'.format(params[keys.KEY_CND])
-            app.logger.info(query)
-            msg = "{} {}".format(msg, query)
-            inventories = Inventory.find_by_condition(cnd)
-        elif params[keys.KEY_QTY] and params[keys.KEY_QTY] >= 0:
-            qty = params[keys.KEY_QTY]
-            query = 'Filtering by category: {}'.format(params[keys.KEY_QTY])
-            app.logger.info(query)
-            msg = "{} {}".format(msg, query)
-            inventories = Inventory.find_by_quantity(qty)
-        elif params[keys.KEY_AVL] in [keys.AVAILABLE_TRUE, keys.AVAILABLE_FALSE]:
-            avl = params[keys.KEY_AVL]
-            query = 'Filtering by category: {}'.format(params[keys.KEY_AVL])
-            app.logger.info(query)
-            msg = "{} {}".format(msg, query)
-            inventories = Inventory.find_by_available(avl)
-        else:
-            inventories = Inventory.find_all()
-        app.logger.info(msg)
-
-
-        results = [inv.serialize() for inv in inventories]
-        app.logger.info("Returning {} inventories".format(len(results)))
-        return results, status.HTTP_200_OK
+        app.logger.debug("A GET request for ALL inventories with: %s", params)
+        inventories = Inventory.find_by_filters(params[keys.KEY_PID], params[keys.KEY_CND],
+                                                params[keys.KEY_QTY], params[keys.KEY_AVL])
+        return list_response(inventories, params)
 
     #------------------------------------------------------------------
     # ADD A NEW INVENTORY
@@ -200,7 +479,7 @@ class InventoryBase(Resource):
         This endpoint will create a Inventory based the data in the body that is posted
         """
         try:
-            app.logger.info("Request to create an Inventory record")
+            app.logger.debug("Request to create an Inventory record")
             inventory = Inventory()
             inventory.deserialize(api.payload)
             inventory.validate_data()
@@ -212,12 +491,246 @@ class InventoryBase(Resource):
             inventory.create()
             location_url = api.url_for(InventoryResource, product_id=inventory.product_id,
                 condition=inventory.condition, _external=True)
-            app.logger.info("Inventory ({}, {}) created."\
-                            .format(inventory.product_id, inventory.condition))
-            return inventory.serialize(), status.HTTP_201_CREATED, {'Location': location_url}
+            app.logger.debug("Inventory (%s, %s) created.",
+                             inventory.product_id, inventory.condition)
+            headers = etag_header(inventory)
+            headers['Location'] = location_url
+            return inventory.serialize(), status.HTTP_201_CREATED, headers
         except DataValidationError as err:
             api.abort(status.HTTP_400_BAD_REQUEST, err)
 
+####################################################################################################
+#  PATH: /inventory/low-stock
+####################################################################################################
+@api.route('/inventory/low-stock', strict_slashes=False)
+class InventoryLowStock(Resource):
+    """
+    GET     /inventory/low-stock - Return the Inventories due for a restock
+    """
+    #------------------------------------------------------------------
+    # LIST INVENTORIES AT OR BELOW THEIR RESTOCK LEVEL
+    #------------------------------------------------------------------
+    @api.doc('list_low_stock_inventories')
+    @api.expect(low_stock_args, validate=True)
+    @api.header(keys.KEY_NEXT_CURSOR,
+                'Pass as "after" to fetch the next page (only set with "limit")')
+    @api.produces([keys.KEY_CONTENT_TYPE_JSON, keys.KEY_CONTENT_TYPE_NDJSON])
+    @api.response(status.HTTP_304_NOT_MODIFIED,
+                  'Inventories not modified since the If-None-Match ETag')
+    @api.response(status.HTTP_200_OK, 'Success', [inventory_model])
+    def get(self):
+        """ Returns the inventory records whose quantity is at or below their restock level """
+        params = low_stock_args.parse_args()
+        app.logger.debug("A GET request for low stock inventories with condition %s",
+                         params[keys.KEY_CND])
+        inventories = Inventory.find_below_restock_level(params[keys.KEY_CND])
+        return list_response(inventories, params)
+
+####################################################################################################
+#  PATH: /inventory/changes
+####################################################################################################
+@api.route('/inventory/changes', strict_slashes=False)
+class InventoryChanges(Resource):
+    """
+    GET     /inventory/changes - Return the changes to the Inventories after a cursor
+    """
+    #------------------------------------------------------------------
+    # LIST THE CHANGES AFTER A CURSOR
+    #------------------------------------------------------------------
+    @api.doc('list_inventory_changes')
+    @api.expect(changes_args, validate=True)
+    @api.header(keys.KEY_NEXT_CURSOR, 'Pass as "since" to fetch the changes that follow')
+    @api.response(status.HTTP_400_BAD_REQUEST, 'The cursor was not valid')
+    @api.response(status.HTTP_410_GONE, 'Changes after the cursor were pruned, start over')
+    @api.response(status.HTTP_200_OK, 'Success', [change_model])
+    def get(self):
+        """
+        Returns the changes to the inventory records after a cursor, oldest first
+        Pass the X-Next-Cursor of every answer as "since" to read on. Fewer changes
+        than "limit" means the reader has caught up for now
+        """
+        params = changes_args.parse_args()
+        since = params[keys.KEY_SINCE]
+        app.logger.debug("A GET request for the inventory changes since %s", since)
+        after = None
+        if since:
+            try:
+                after = decode_change_cursor(since)
+            except ValueError:
+                api.abort(status.HTTP_400_BAD_REQUEST, "Invalid data: malformed cursor")
+        try:
+            changes = InventoryChange.since(after, params[keys.KEY_LIMIT])
+        except ChangesPrunedError as err:
+            api.abort(status.HTTP_410_GONE, str(err))
+        headers = {}
+        if changes:
+            headers[keys.KEY_NEXT_CURSOR] = encode_change_cursor(changes[-1])
+        elif since:
+            headers[keys.KEY_NEXT_CURSOR] = since
+        return json_response(json.dumps([change.serialize() for change in changes]),
+                             headers=headers)
+
+####################################################################################################
+#  PATH: /inventory/stats
+####################################################################################################
+@api.route('/inventory/stats', strict_slashes=False)
+class InventoryStatsResource(Resource):
+    """
+    GET     /inventory/stats - Return the Inventory totals per condition
+    """
+    #------------------------------------------------------------------
+    # RETURN THE INVENTORY TOTALS
+    #------------------------------------------------------------------
+    @api.doc('get_inventory_stats')
+    @api.marshal_with(stats_model)
+    def get(self):
+        """ Returns the record count, total quantity and available count of each condition """
+        app.logger.debug("Request for the inventory stats")
+        return InventoryStats.summary(), status.HTTP_200_OK
+
+####################################################################################################
+#  PATH: /inventory/pool
+####################################################################################################
+@api.route('/inventory/pool', strict_slashes=False)
+class InventoryPool(Resource):
+    """
+    GET     /inventory/pool - Return the database connection pool stats of this worker
+    """
+    #------------------------------------------------------------------
+    # RETURN THE CONNECTION POOL STATS
+    #------------------------------------------------------------------
+    @api.doc('get_pool_stats')
+    @api.marshal_with(pool_model)
+    def get(self):
+        """ Returns the connection counts and checkout waits of this worker's pool """
+        app.logger.debug("Request for the connection pool stats")
+        return DB.engine.pool.stats(), status.HTTP_200_OK
+
+####################################################################################################
+#  PATH: /inventory/bulk
+####################################################################################################
+@api.route('/inventory/bulk', strict_slashes=False)
+class InventoryBulk(Resource):
+    """
+    CREATE  /inventory/bulk - Create many Inventories in one transaction
+    """
+    #------------------------------------------------------------------
+    # ADD A BATCH OF NEW INVENTORIES
+    #------------------------------------------------------------------
+    @api.doc('create_inventories', security='apikey')
+    @api.expect([inventory_model])
+    @api.response(status.HTTP_400_BAD_REQUEST, 'The posted data was not a list')
+    @api.response(status.HTTP_201_CREATED, 'All Inventories created successfully')
+    @api.response(status.HTTP_207_MULTI_STATUS, 'Some Inventories were not created')
+    @api.marshal_with(bulk_model, code=status.HTTP_201_CREATED)
+    # @token_required
+    def post(self):
+        """
+        Creates a batch of Inventories
+        This endpoint will create every valid Inventory in the posted list in one transaction
+        and report the records that were rejected
+        """
+        app.logger.info("Request to create Inventory records in bulk")
+        records = api.payload
+        if not isinstance(records, list):
+            api.abort(status.HTTP_400_BAD_REQUEST, "Invalid data: expected a list of records")
+
+        return bulk_result(*Inventory.create_bulk(records))
+
+####################################################################################################
+#  PATH: /inventory/export
+####################################################################################################
+@api.route('/inventory/export', strict_slashes=False)
+class InventoryExport(Resource):
+    """
+    GET     /inventory/export - Stream a point-in-time dump of the Inventories as a file
+    """
+    #------------------------------------------------------------------
+    # EXPORT THE INVENTORIES
+    #------------------------------------------------------------------
+    @api.doc('export_inventories')
+    @api.expect(export_args, validate=True)
+    @api.produces(sorted(exporter.CONTENT_TYPES.values()))
+    @api.response(status.HTTP_501_NOT_IMPLEMENTED,
+                  'The format needs a library that is not installed')
+    @api.response(status.HTTP_200_OK, 'The inventory records, as a file')
+    def get(self):
+        """
+        Exports the inventory records
+        This endpoint will stream every record matching the list filters from one snapshot
+        """
+        params = export_args.parse_args()
+        export_format = params[keys.KEY_FORMAT]
+        app.logger.info("Request to export inventories as %s. Filtering by: %s", export_format,
+                        {key: params[key] for key in FILTER_KEYS if params[key] is not None})
+        if not exporter.available(export_format):
+            api.abort(status.HTTP_501_NOT_IMPLEMENTED,
+                      "The {} export needs pyarrow, which is not installed".format(export_format))
+        inventories = Inventory.find_by_filters(params[keys.KEY_PID], params[keys.KEY_CND],
+                                                params[keys.KEY_QTY], params[keys.KEY_AVL])
+        rows = Inventory.rows(Inventory.find_page(inventories))
+        response = Response(stream_with_context(exporter.export(rows, export_format)),
+                            mimetype=exporter.CONTENT_TYPES[export_format])
+        response.headers['Content-Disposition'] = 'attachment; filename="inventory.{}"'.format(
+            export_format)
+        return response
+
+####################################################################################################
+#  PATH: /inventory/import
+####################################################################################################
+@api.route('/inventory/import', strict_slashes=False)
+class InventoryImport(Resource):
+    """
+    CREATE  /inventory/import - Create or update Inventories from a CSV file
+    """
+    #------------------------------------------------------------------
+    # IMPORT A CSV OF INVENTORIES
+    #------------------------------------------------------------------
+    @api.doc('import_inventories', security='apikey',
+             description='Posted as the text/csv body, or as the "{}" field of a '
+             'multipart/form-data upload'.format(keys.KEY_FILE))
+    @api.response(status.HTTP_400_BAD_REQUEST, 'The CSV header does not name the columns')
+    @api.response(status.HTTP_200_OK, 'All rows imported')
+    @api.response(status.HTTP_207_MULTI_STATUS, 'Some rows were rejected')
+    @api.marshal_with(import_model)
+    # @token_required
+    def post(self):
+        """
+        Imports a CSV of Inventories
+        This endpoint will create or update the Inventory of every valid row in one transaction
+        and report the rows that were rejected
+        """
+        app.logger.info("Request to import an Inventory CSV")
+        upload = request.files.get(keys.KEY_FILE)
+        stream = upload.stream if upload else request.stream
+        try:
+            report = import_csv(codecs.iterdecode(stream, 'utf-8'))
+        except DataValidationError as err:
+            api.abort(status.HTTP_400_BAD_REQUEST, str(err))
+        except UnicodeDecodeError:
+            api.abort(status.HTTP_400_BAD_REQUEST, "Invalid CSV: not UTF-8 text")
+        code = status.HTTP_207_MULTI_STATUS if report[keys.KEY_REJECTED] \
+            else status.HTTP_200_OK
+        return report, code
+
+####################################################################################################
+#  PATH: /inventory/cache
+####################################################################################################
+@api.route('/inventory/cache', strict_slashes=False)
+class InventoryCache(Resource):
+    """
+    GET     /inventory/cache - Return the lookup cache statistics
+    """
+    #------------------------------------------------------------------
+    # RETRIEVE THE CACHE STATISTICS
+    #------------------------------------------------------------------
+    @api.doc('get_cache_stats')
+    @api.marshal_with(cache_model)
+    def get(self):
+        """ Returns the hit/miss/eviction counters of the single Inventory lookup cache """
+        app.logger.debug("A GET request for the cache statistics")
+        return CACHE.stats(), status.HTTP_200_OK
+
 ####################################################################################################
 #  PATH: /inventory/{product_id}/condition/{condition}
 ####################################################################################################
@@ -235,22 +748,27 @@ class InventoryResource(Resource):
     #------------------------------------------------------------------
     @api.doc('get_inventory')
     @api.response(status.HTTP_404_NOT_FOUND, 'Inventory not found')
-    @api.marshal_with(inventory_model)
+    @api.response(status.HTTP_304_NOT_MODIFIED,
+                  'Inventory not modified since the If-None-Match ETag')
+    @api.response(status.HTTP_200_OK, 'Success', inventory_model)
     def get(self, product_id, condition):
         """
         Retrieve a single Inventory
 
         This endpoint will return a Inventory based on it's id
         """
-        app.logger.info("A GET request for inventories with product_id {} and condition {}"\
-                        .format(product_id, condition))
-        inventory = Inventory.find_by_product_id_condition(product_id, condition)
+        app.logger.debug("A GET request for inventories with product_id %s and condition %s",
+                         product_id, condition)
+        inventory = Inventory.find_cached(product_id, condition)
         if not inventory:
             api.abort(status.HTTP_404_NOT_FOUND,
                 "Inventory ({}, {}) NOT FOUND".format(product_id, condition))
-        app.logger.info("Return inventory with product_id {} and condition {}"\
-                        .format(product_id, condition))
-        return inventory.serialize(), status.HTTP_200_OK
+        etag = Inventory.etag(inventory)
+        if request.if_none_match.contains(etag):
+            return not_modified(etag)
+        app.logger.debug("Return inventory with product_id %s and condition %s",
+                         product_id, condition)
+        return json_response(serializer.dump_record(inventory), headers={'ETag': quote_etag(etag)})
 
     #------------------------------------------------------------------
     # UPDATE AN (EXISTING) INVENTORY
@@ -258,6 +776,8 @@ class InventoryResource(Resource):
     @api.doc('update_inventory', security='apikey')
     @api.response(status.HTTP_404_NOT_FOUND, 'Inventory not found')
     @api.response(status.HTTP_400_BAD_REQUEST, 'The posted Inventory data was not valid')
+    @api.response(status.HTTP_409_CONFLICT, 'Inventory changed while being updated, retry')
+    @api.response(status.HTTP_412_PRECONDITION_FAILED, 'Inventory not at the If-Match version')
     @api.expect(inventory_model)
     @api.marshal_with(inventory_model)
     # @token_required
@@ -266,26 +786,44 @@ class InventoryResource(Resource):
         Update an Inventory
         This endpoint will update a Inventory based the body that is posted
         """
-        app.logger.info("Request to update inventory with key ({}, {})"\
-                        .format(product_id, condition))
+        app.logger.debug("Request to update inventory with key (%s, %s)", product_id, condition)
         try:
             inventory = Inventory.find_by_product_id_condition(product_id, condition)
             if not inventory:
                 api.abort(status.HTTP_404_NOT_FOUND,
                         "Inventory with ({}, {})".format(product_id, condition))
+            versions = expected_versions(api.payload)
+            if versions is not None and inventory.version not in versions:
+                api.abort(status.HTTP_412_PRECONDITION_FAILED,
+                    "Inventory ({}, {}) is at version {}".format(product_id, condition,
+                                                                 inventory.version))
 
             resp_old = inventory.serialize()
             resp_new = api.payload
             for key in resp_old.keys():
                 if key in resp_new:
                     resp_old[key] = resp_new[key]
-            inventory.deserialize(resp_old)
-            inventory.validate_data()
-            inventory.update()
-            app.logger.info("Inventory ({}, {}) updated.".format(product_id, condition))
-            return inventory.serialize(), status.HTTP_200_OK
+            # Validate a detached copy; the guarded UPDATE below is the only write
+            updated = Inventory().deserialize(resp_old)
+            updated.validate_data()
+            inventory = Inventory.update_by_key(product_id, condition, {
+                keys.KEY_PID: updated.product_id,
+                keys.KEY_CND: updated.condition,
+                keys.KEY_QTY: updated.quantity,
+                keys.KEY_LVL: updated.restock_level,
+                keys.KEY_AVL: updated.available
+            }, [inventory.version])
         except DataValidationError as err:
             api.abort(status.HTTP_400_BAD_REQUEST, err)
+        except PreconditionFailedError as err:
+            # Without a client precondition the record simply changed under us
+            api.abort(status.HTTP_409_CONFLICT if versions is None
+                      else status.HTTP_412_PRECONDITION_FAILED, err)
+        if not inventory:
+            api.abort(status.HTTP_404_NOT_FOUND,
+                    "Inventory with ({}, {})".format(product_id, condition))
+        app.logger.debug("Inventory (%s, %s) updated.", product_id, condition)
+        return inventory.serialize(), status.HTTP_200_OK, etag_header(inventory)
 
     #------------------------------------------------------------------
     # DELETE AN INVENTORY
@@ -299,13 +837,12 @@ class InventoryResource(Resource):
 
         This endpoint will delete a Inventory based the id specified in the path
         """
-        app.logger.info("Request to delete inventory with key ({}, {})"\
-                        .format(product_id, condition))
+        app.logger.debug("Request to delete inventory with key (%s, %s)", product_id, condition)
         inventory = Inventory.find_by_product_id_condition(product_id, condition)
         if inventory:
             inventory.delete()
-        app.logger.info("Inventory with product_id {} and condition {} deleted"
-                        .format(product_id, condition))
+        app.logger.debug("Inventory with product_id %s and condition %s deleted",
+                         product_id, condition)
         return '', status.HTTP_204_NO_CONTENT
 
 ####################################################################################################
@@ -323,6 +860,7 @@ class InventoryResourceRestock(Resource):
     @api.doc('update_inventory', security='apikey')
     @api.response(status.HTTP_404_NOT_FOUND, 'Inventory not found')
     @api.response(status.HTTP_400_BAD_REQUEST, 'The posted body was invalid. Please check again.')
+    @api.response(status.HTTP_412_PRECONDITION_FAILED, 'Inventory not at the If-Match version')
     @api.expect(restock_model)
     @api.marshal_with(inventory_model)
     # @token_required
@@ -330,34 +868,61 @@ class InventoryResourceRestock(Resource):
         """
         Restock an Inventory's Quantity
         """
-        app.logger.info("Request to update inventory with key ({}, {})"\
-                        .format(product_id, condition))
-        # Check if the record exists
-        inventory = Inventory.find_by_product_id_condition(product_id, condition)
+        app.logger.debug("Request to update inventory with key (%s, %s)", product_id, condition)
+        body = api.payload
+        amount = amount_from(body, product_id, condition)
+        try:
+            inventory = Inventory.restock(product_id, condition, amount, expected_versions(body))
+        except DataValidationError as err:
+            api.abort(status.HTTP_400_BAD_REQUEST, err)
+        except PreconditionFailedError as err:
+            api.abort(status.HTTP_412_PRECONDITION_FAILED, err)
         if not inventory:
             api.abort(status.HTTP_404_NOT_FOUND,
                 "Inventory with ({}, {})".format(product_id, condition))
+        app.logger.debug("Inventory (%s, %s) restocked.", product_id, condition)
+        return inventory.serialize(), status.HTTP_200_OK, etag_header(inventory)
 
-        # Checking for keys.KEY_AMT keyword
-        json = request.get_json()
-        json = api.payload
-        if "amount" not in json.keys():
-            api.abort(status.HTTP_400_BAD_REQUEST, "Invalid data: Amount missing")
-
-        # Checking for amount >= 0
-        amount = json[keys.KEY_AMT]
-        regex = "^\-?\d+$"
-        if not re.search(regex, str(amount)):
-            api.abort(status.HTTP_400_BAD_REQUEST, "Invalid data: Amount must be an integer")
-        else:
-            if int(amount) <= 0:
-                api.abort(status.HTTP_400_BAD_REQUEST, "Invalid data: Amount <= 0")
-
-        inventory.quantity += int(amount)
-        inventory.validate_data()
-        inventory.update()
-        app.logger.info("Inventory ({}, {}) restocked.".format(product_id, condition))
-        return inventory.serialize(), status.HTTP_200_OK
+####################################################################################################
+#  PATH: /inventory/{product_id}/condition/{condition}/reserve
+####################################################################################################
+@api.route('/inventory/<int:product_id>/condition/<string:condition>/reserve')
+@api.param('product_id, condition', 'The Inventory identifiers')
+class InventoryResourceReserve(Resource):
+    """
+    POST    /inventory/<int:product_id>/condition/<string:condition>/reserve - Reserve stock
+    """
+    #------------------------------------------------------------------
+    # RESERVE (TAKE) STOCK FROM AN (EXISTING) INVENTORY
+    #------------------------------------------------------------------
+    @api.doc('reserve_inventory', security='apikey')
+    @api.response(status.HTTP_404_NOT_FOUND, 'Inventory not found')
+    @api.response(status.HTTP_400_BAD_REQUEST, 'The posted body was invalid. Please check again.')
+    @api.response(status.HTTP_409_CONFLICT, 'Not enough available stock')
+    @api.response(status.HTTP_412_PRECONDITION_FAILED, 'Inventory not at the If-Match version')
+    @api.expect(reserve_model)
+    @api.marshal_with(inventory_model)
+    # @token_required
+    def post(self, product_id, condition):
+        """
+        Reserve an Inventory's Quantity
+        Decrements the quantity only if enough is available, and makes the
+        Inventory unavailable once it runs out
+        """
+        app.logger.debug("Request to reserve inventory with key (%s, %s)", product_id, condition)
+        body = api.payload
+        amount = amount_from(body, product_id, condition)
+        try:
+            inventory = Inventory.reserve(product_id, condition, amount, expected_versions(body))
+        except OutOfStockError as err:
+            api.abort(status.HTTP_409_CONFLICT, err)
+        except PreconditionFailedError as err:
+            api.abort(status.HTTP_412_PRECONDITION_FAILED, err)
+        if not inventory:
+            api.abort(status.HTTP_404_NOT_FOUND,
+                "Inventory with ({}, {})".format(product_id, condition))
+        app.logger.debug("Inventory (%s, %s) reserved.", product_id, condition)
+        return inventory.serialize(), status.HTTP_200_OK, etag_header(inventory)
 
 ####################################################################################################
 #  PATH: /inventory/{product_id}/condition/{condition}/activate
@@ -373,25 +938,26 @@ class InventoryResourceActivate(Resource):
     #------------------------------------------------------------------
     @api.doc('update_inventory', security='apikey')
     @api.response(status.HTTP_404_NOT_FOUND, 'Inventory not found')
+    @api.response(status.HTTP_412_PRECONDITION_FAILED, 'Inventory not at the If-Match version')
     @api.marshal_with(inventory_model)
     # @token_required
     def put(self, product_id, condition):
         """
         Restock an Inventory's Quantity
         """
-        app.logger.info("Request to update inventory with key ({}, {})"\
-                        .format(product_id, condition))
+        app.logger.debug("Request to update inventory with key (%s, %s)", product_id, condition)
+        try:
+            inventory = Inventory.update_by_key(product_id, condition,
+                                                {keys.KEY_AVL: keys.AVAILABLE_TRUE},
+                                                expected_versions())
+        except PreconditionFailedError as err:
+            api.abort(status.HTTP_412_PRECONDITION_FAILED, err)
         # Check if the record exists
-        inventory = Inventory.find_by_product_id_condition(product_id, condition)
         if not inventory:
             api.abort(status.HTTP_404_NOT_FOUND,
                 "Inventory with ({}, {})".format(product_id, condition))
-
-        inventory.available = 1
-        inventory.validate_data()
-        inventory.update()
-        app.logger.info("Inventory ({}, {}) restocked.".format(product_id, condition))
-        return inventory.serialize(), status.HTTP_200_OK
+        app.logger.debug("Inventory (%s, %s) restocked.", product_id, condition)
+        return inventory.serialize(), status.HTTP_200_OK, etag_header(inventory)
 
 ####################################################################################################
 #  PATH: /inventory/{product_id}/condition/{condition}/deactivate
@@ -407,22 +973,23 @@ class InventoryResourceDeactivate(Resource):
     #------------------------------------------------------------------
     @api.doc('update_inventory', security='apikey')
     @api.response(status.HTTP_404_NOT_FOUND, 'Inventory not found')
+    @api.response(status.HTTP_412_PRECONDITION_FAILED, 'Inventory not at the If-Match version')
     @api.marshal_with(inventory_model)
     # @token_required
     def put(self, product_id, condition):
         """
         Restock an Inventory's Quantity
         """
-        app.logger.info("Request to update inventory with key ({}, {})"\
-                        .format(product_id, condition))
+        app.logger.debug("Request to update inventory with key (%s, %s)", product_id, condition)
+        try:
+            inventory = Inventory.update_by_key(product_id, condition,
+                                                {keys.KEY_AVL: keys.AVAILABLE_FALSE},
+                                                expected_versions())
+        except PreconditionFailedError as err:
+            api.abort(status.HTTP_412_PRECONDITION_FAILED, err)
         # Check if the record exists
-        inventory = Inventory.find_by_product_id_condition(product_id, condition)
         if not inventory:
             api.abort(status.HTTP_404_NOT_FOUND,
                 "Inventory with ({}, {})".format(product_id, condition))
-
-        inventory.available = 0
-        inventory.validate_data()
-        inventory.update()
-        app.logger.info("Inventory ({}, {}) restocked.".format(product_id, condition))
-        return inventory.serialize(), status.HTTP_200_OK
+        app.logger.debug("Inventory (%s, %s) restocked.", product_id, condition)
+        return inventory.serialize(), status.HTTP_200_OK, etag_header(inventory)
@@ -0,0 +1,66 @@
+"""
+Serializer for Inventory
+
+Turns Inventory rows, read as plain tuples by Inventory.rows(), straight into
+JSON text in one pass, instead of building a dict per record with serialize()
+that marshal_with then walks again before encoding it. The output is the same
+as marshalling serialize() with the inventory_model of routes.py
+"""
+import json
+from service import keys
+
+# The fields of a serialized record, in the order Inventory.rows() reads them
+FIELDS = (keys.KEY_PID, keys.KEY_CND, keys.KEY_QTY, keys.KEY_LVL, keys.KEY_AVL, keys.KEY_VER)
+STRING_FIELDS = (keys.KEY_CND,)
+
+# '{"product_id":%d,"condition":%s,...}', filled with the JSON encoded strings
+ROW_TEMPLATE = "{" + ",".join('"{}":%{}'.format(field, "s" if field in STRING_FIELDS else "d")
+                              for field in FIELDS) + "}"
+STRING_INDEXES = [FIELDS.index(field) for field in STRING_FIELDS]
+
+# JSON encodings of the few distinct strings (the conditions) seen so far
+_ENCODED = {}
+_ENCODED_MAX = 1024
+
+def encode_string(value):
+    """ Returns the JSON encoding of a string, remembering it while there are few """
+    encoded = _ENCODED.get(value)
+    if encoded is None:
+        encoded = json.dumps(value)
+        if len(_ENCODED) < _ENCODED_MAX:
+            _ENCODED[value] = encoded
+    return encoded
+
+def dump_row(row):
+    """ Returns the JSON object of a row tuple """
+    values = list(row)
+    for index in STRING_INDEXES:
+        values[index] = "null" if values[index] is None else encode_string(values[index])
+    try:
+        return ROW_TEMPLATE % tuple(values)
+    except TypeError:
+        # A NULL column; rare enough to take the slow path
+        return json.dumps(row_dict(row), separators=(",", ":"))
+
+def dump_rows(rows):
+    """ Returns the JSON array of row tuples """
+    return "[" + ",".join([dump_row(row) for row in rows]) + "]"
+
+def dump_record(data):
+    """ Returns the JSON object of a serialized Inventory record """
+    return dump_row(tuple(data[field] for field in FIELDS))
+
+def row_dict(row):
+    """ Returns a row tuple as a serialized Inventory record """
+    return dict(zip(FIELDS, row))
+
+def ndjson_chunks(rows, batch_size=keys.STREAM_BATCH_SIZE):
+    """ Yields the newline delimited JSON of row tuples, batch_size rows per chunk """
+    lines = []
+    for row in rows:
+        lines.append(dump_row(row))
+        if len(lines) == batch_size:
+            yield "\n".join(lines) + "\n"
+            lines = []
+    if lines:
+        yield "\n".join(lines) + "\n"
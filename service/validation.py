@@ -0,0 +1,146 @@
+"""
+Batch validation for Inventory
+
+Validates many Inventory records at once, one column at a time, instead of
+building an Inventory per record and calling its five validate_data_xxx
+methods. Each column is checked by a comprehension over a lookup table that
+is built once at import; only values outside the table (digit strings with
+leading zeros, bools, wrong types) go through the per-value checks, which
+Inventory's own validate_data_xxx methods share.
+
+The report maps the index of every invalid record to the message the
+DataValidationError of deserialize() or validate_data() would carry, e.g.
+    {3: "Error in data: ['Quantity', 'Available']",
+     7: "Invalid Inventory record: missing condition"}
+"""
+from service import keys
+
+# The fields validate_data checks, in the order of its messages
+FIELD_NAMES = [(keys.KEY_PID, "Product ID"), (keys.KEY_CND, "Condition"),
+               (keys.KEY_QTY, "Quantity"), (keys.KEY_LVL, "Restock Level"),
+               (keys.KEY_AVL, "Available")]
+
+# The fields in the order deserialize reads them, which decides the missing one reported
+DESERIALIZE_ORDER = [keys.KEY_PID, keys.KEY_QTY, keys.KEY_LVL, keys.KEY_CND, keys.KEY_AVL]
+
+MALFORMED = "Invalid Inventory record: body contained bad or no data"
+
+# Marks a field a record does not have
+MISSING = object()
+
+# The widest range of values an integer column check builds a lookup table for
+LOOKUP_MAX = 1000
+
+######################################################################
+# PER-VALUE CHECKS
+######################################################################
+def valid_integer(value, low, high=None):
+    """ Returns True if value is an int, or a string of digits, in [low, high] """
+    if isinstance(value, str):
+        if not value.isdigit():
+            return False
+        try:
+            value = int(value)
+        except ValueError:
+            # isdigit() also accepts digits int() does not, like superscripts
+            return False
+    elif not isinstance(value, int):
+        return False
+    return low <= value and (high is None or value <= high)
+
+def valid_condition(value):
+    """ Returns True if value is one of the conditions """
+    return isinstance(value, str) and value in keys.CONDITIONS
+
+######################################################################
+# COLUMN CHECKS
+######################################################################
+def integer_check(low, high=None):
+    """ Returns a function listing the indexes of the invalid values of an integer column """
+    if high is None or high - low > LOOKUP_MAX:
+        def range_check(column):
+            return [index for index, value in enumerate(column)
+                    if not (type(value) is int and low <= value
+                            and (high is None or value <= high))
+                    and not valid_integer(value, low, high)]
+        return range_check
+
+    accepted = frozenset(range(low, high + 1))
+    strings = frozenset(str(value) for value in accepted)
+
+    def lookup_check(column):
+        return [index for index, value in enumerate(column)
+                if not ((type(value) is int and value in accepted)
+                        or (type(value) is str and value in strings))
+                and not valid_integer(value, low, high)]
+    return lookup_check
+
+CONDITIONS = frozenset(keys.CONDITIONS)
+
+def condition_check(column):
+    """ Lists the indexes of the invalid values of a condition column """
+    return [index for index, value in enumerate(column)
+            if not (type(value) is str and value in CONDITIONS)
+            and not valid_condition(value)]
+
+CHECKS = {
+    keys.KEY_PID: integer_check(0, keys.INT_HIGH),
+    keys.KEY_CND: condition_check,
+    keys.KEY_QTY: integer_check(keys.QTY_LOW, keys.QTY_HIGH),
+    keys.KEY_LVL: integer_check(keys.QTY_LOW, keys.RESTOCK_LVL),
+    keys.KEY_AVL: integer_check(keys.AVAILABLE_FALSE, keys.AVAILABLE_TRUE)
+}
+
+######################################################################
+# BATCHES
+######################################################################
+def validate_columns(columns):
+    """
+    Validates a column-oriented batch of records
+    Args: columns (dict): a list of values per field, MISSING where a record
+                          does not have the field; every list is as long
+    Returns: a dict mapping the index of every invalid record to its error message
+    """
+    sizes = {len(column) for column in columns.values()}
+    if len(sizes) > 1:
+        raise ValueError("The columns are not all as long")
+    size = sizes.pop() if sizes else 0
+
+    errors = {}
+    for field in DESERIALIZE_ORDER:
+        column = columns.get(field)
+        if column is None:
+            for index in range(size):
+                errors.setdefault(index, "Invalid Inventory record: missing " + field)
+            continue
+        for index in [index for index, value in enumerate(column) if value is MISSING]:
+            errors.setdefault(index, "Invalid Inventory record: missing " + field)
+    if len(errors) == size:
+        return errors
+
+    failed = {}
+    for field, name in FIELD_NAMES:
+        for index in CHECKS[field](columns[field]):
+            if index not in errors:
+                failed.setdefault(index, []).append(name)
+    for index, names in failed.items():
+        errors[index] = "Error in data: {}".format(names)
+    return errors
+
+def columns_of(records):
+    """ Returns the records as a column-oriented batch, MISSING where a field is absent """
+    rows = [record if isinstance(record, dict) else {} for record in records]
+    return {field: [row.get(field, MISSING) for row in rows] for field in DESERIALIZE_ORDER}
+
+def validate_records(records):
+    """
+    Validates a list of records, as posted to a bulk endpoint
+    Returns: (columns, errors) the records as columns and a dict mapping the
+             index of every invalid record to its error message
+    """
+    columns = columns_of(records)
+    errors = validate_columns(columns)
+    for index, record in enumerate(records):
+        if not isinstance(record, dict):
+            errors[index] = MALFORMED
+    return columns, errors
@@ -0,0 +1,250 @@
+"""
+Test cases for the Inventory ASGI serving mode
+
+"""
+import os
+import json
+import unittest
+from flask_api import status
+from starlette.testclient import TestClient
+from service import app, keys
+from service.asgi import app as asgi_app, compile_statement, pool_options
+from service.model import Inventory, InventoryChange, InventoryChangeHorizon, DB
+from service.routes import encode_change_cursor
+from .inventory_factory import InventoryFactory
+
+DATABASE_URI = os.getenv(keys.KEY_DB_URI, keys.DATABASE_URI_LOCAL)
+URL = "/api/inventory/{}/condition/{}"
+
+################################################################################
+#  ASGI test cases
+################################################################################
+class AsgiTest(unittest.TestCase):
+    """
+    ################################################################################################
+    ASGI Serving Mode Tests
+    ################################################################################################
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        """ These run once before Test suite """
+        app.config[keys.KEY_SQL_ALC] = DATABASE_URI
+        Inventory.init_db(app)
+        cls.client = TestClient(asgi_app)
+        cls.client.__enter__()
+
+    @classmethod
+    def tearDownClass(cls):
+        """ These run once after Test suite """
+        cls.client.__exit__(None, None, None)
+        DB.session.close()
+
+    def setUp(self):
+        DB.drop_all()  # clean up the last tests
+        DB.create_all()  # make our sqlalchemy tables
+
+    def tearDown(self):
+        DB.session.remove()
+
+    def create(self, **fields):
+        """ Creates an Inventory through the ASGI app and returns its JSON """
+        record = InventoryFactory(**fields).serialize()
+        resp = self.client.post("/api/inventory", json=record)
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED, resp.text)
+        return resp.json()
+
+    def test_pool_options(self):
+        """ Map the SQLAlchemy pool settings to asyncpg's """
+        config = dict(app.config, DB_POOL_SIZE=2, DB_MAX_OVERFLOW=3, DB_POOL_RECYCLE=-1)
+        options = pool_options(config)
+        self.assertEqual(options['max_size'], 5)
+        self.assertEqual(options['max_inactive_connection_lifetime'], 0)
+
+    def test_compile_statement(self):
+        """ Compile SQLAlchemy statements with numbered binds """
+        sql, args = compile_statement(Inventory.update_statement(
+            7, "new", {keys.KEY_QTY: 3}, [4, 5]))
+        self.assertIn("quantity=$1", sql.replace(" ", ""))
+        self.assertEqual(sql.count("$"), len(args))
+        self.assertEqual(args, [3, "inventory_version_seq", 7, "new", 4, 5])
+
+    def test_create_and_get(self):
+        """ Create an Inventory and get it back, conditionally """
+        data = self.create(product_id=1, condition="open box")
+        self.assertEqual(data[keys.KEY_PID], 1)
+        resp = self.client.post("/api/inventory", json=data)
+        self.assertEqual(resp.status_code, status.HTTP_409_CONFLICT)
+        resp = self.client.post("/api/inventory", json=dict(data, quantity=-1))
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(resp.json()["message"], "Error in data: ['Quantity']")
+
+        resp = self.client.get(URL.format(1, "open box"))
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.json(), data)
+        etag = resp.headers["ETag"]
+        resp = self.client.get(URL.format(1, "open box"), headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+        resp = self.client.get(URL.format(2, "new"))
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_list(self):
+        """ List, filter and page like the Flask app """
+        for pid in range(5):
+            self.create(product_id=pid, condition="new", available=pid % 2)
+        resp = self.client.get("/api/inventory?available=1")
+        self.assertEqual([inv[keys.KEY_PID] for inv in resp.json()], [1, 3])
+
+        resp = self.client.get("/api/inventory?limit=2")
+        resp = self.client.get("/api/inventory?limit=2&after=" + resp.headers[keys.KEY_NEXT_CURSOR])
+        self.assertEqual([inv[keys.KEY_PID] for inv in resp.json()], [2, 3])
+        resp = self.client.get("/api/inventory?limit=0")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+        resp = self.client.get("/api/inventory", headers={"Accept": keys.KEY_CONTENT_TYPE_NDJSON})
+        lines = resp.text.splitlines()
+        self.assertEqual([json.loads(line)[keys.KEY_PID] for line in lines], list(range(5)))
+
+    def test_update(self):
+        """ Update an Inventory, honoring If-Match """
+        data = self.create(product_id=1, condition="new")
+        resp = self.client.put(URL.format(1, "new"), json={keys.KEY_QTY: 7},
+                               headers={"If-Match": '"{}"'.format(data[keys.KEY_VER])})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.json()[keys.KEY_QTY], 7)
+        resp = self.client.put(URL.format(1, "new"), json={keys.KEY_QTY: 8},
+                               headers={"If-Match": '"{}"'.format(data[keys.KEY_VER])})
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        resp = self.client.put(URL.format(1, "new"), json={keys.KEY_AVL: 5})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.client.put(URL.format(2, "new"), json={keys.KEY_QTY: 8})
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_restock_reserve_and_availability(self):
+        """ Restock, reserve, activate and deactivate an Inventory """
+        self.create(product_id=1, condition="new", quantity=1, available=1)
+        resp = self.client.put(URL.format(1, "new") + "/restock", json={keys.KEY_AMT: 2})
+        self.assertEqual(resp.json()[keys.KEY_QTY], 3)
+        resp = self.client.put(URL.format(1, "new") + "/restock", json={keys.KEY_AMT: 100})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.client.put(URL.format(2, "new") + "/restock", json={})
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+        resp = self.client.post(URL.format(1, "new") + "/reserve", json={keys.KEY_AMT: 3})
+        self.assertEqual((resp.json()[keys.KEY_QTY], resp.json()[keys.KEY_AVL]), (0, 0))
+        resp = self.client.post(URL.format(1, "new") + "/reserve", json={keys.KEY_AMT: 1})
+        self.assertEqual(resp.status_code, status.HTTP_409_CONFLICT)
+
+        resp = self.client.put(URL.format(1, "new") + "/activate")
+        self.assertEqual(resp.json()[keys.KEY_AVL], 1)
+        resp = self.client.put(URL.format(1, "new") + "/deactivate")
+        self.assertEqual(resp.json()[keys.KEY_AVL], 0)
+
+    def test_delete(self):
+        """ Delete an Inventory """
+        self.create(product_id=1, condition="used")
+        resp = self.client.delete(URL.format(1, "used"))
+        self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
+        resp = self.client.get(URL.format(1, "used"))
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_events(self):
+        """ Push the committed changes to the subscribers of their product """
+        broadcaster = asgi_app.state.broadcaster
+        everything = self.client.portal.call(broadcaster.subscribe)
+        product_two = self.client.portal.call(broadcaster.subscribe, {2})
+        self.create(product_id=1, condition="new")
+        self.create(product_id=2, condition="new")
+        events = []
+        while len(events) < 2:
+            events += self.client.portal.call(everything.take, 5)
+        self.assertEqual([event[1] for event in events], [1, 2])
+        events = self.client.portal.call(product_two.take, 5)
+        self.assertEqual([event[1] for event in events], [2])
+        self.assertIn('"operation": "insert"', events[0][2])
+        for subscriber in (everything, product_two):
+            self.client.portal.call(broadcaster.unsubscribe, subscriber)
+
+    def test_events_bad_request(self):
+        """ Refuse malformed and pruned cursors and product_id """
+        resp = self.client.get("/api/inventory/events", headers={"Last-Event-ID": "nope"})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.client.get("/api/inventory/events?product_id=1,x")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        InventoryChangeHorizon.advance((10 ** 12, 1))
+        DB.session.commit()
+        resp = self.client.get("/api/inventory/events?since=" + encode_change_cursor(
+            InventoryChange(txid=1, id=1)))
+        self.assertEqual(resp.status_code, status.HTTP_410_GONE)
+
+    def test_low_stock_and_stats(self):
+        """ List the records due for a restock and total them like the Flask app """
+        for pid in range(4):
+            self.create(product_id=pid, condition="new", quantity=pid, restock_level=1,
+                        available=1)
+        self.create(product_id=9, condition="used", quantity=0, restock_level=2, available=0)
+        resp = self.client.get("/api/inventory/low-stock")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual([(inv[keys.KEY_PID], inv[keys.KEY_CND]) for inv in resp.json()],
+                         [(0, "new"), (1, "new"), (9, "used")])
+        resp = self.client.get("/api/inventory/low-stock?condition=used")
+        self.assertEqual([inv[keys.KEY_PID] for inv in resp.json()], [9])
+        resp = self.client.get("/api/inventory/low-stock?limit=1")
+        self.assertEqual([inv[keys.KEY_PID] for inv in resp.json()], [0])
+        self.assertIn(keys.KEY_NEXT_CURSOR, resp.headers)
+        resp = self.client.get("/api/inventory/low-stock?limit=1",
+                               headers={"If-None-Match": resp.headers["ETag"]})
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        resp = self.client.get("/api/inventory/stats")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(set(resp.json()), set(keys.CONDITIONS))
+        self.assertEqual(resp.json()["used"], {keys.KEY_SKUS: 1, keys.KEY_UNITS: 0,
+                                               keys.KEY_AVL: 0})
+        self.assertEqual(resp.json()["new"], {keys.KEY_SKUS: 4, keys.KEY_UNITS: 6,
+                                              keys.KEY_AVL: 4})
+
+    def test_changes(self):
+        """ Page through the change feed like the Flask app """
+        self.create(product_id=1, condition="new")
+        self.create(product_id=2, condition="new")
+        resp = self.client.get("/api/inventory/changes?limit=1")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual([change[keys.KEY_PID] for change in resp.json()], [1])
+        since = resp.headers[keys.KEY_NEXT_CURSOR]
+        resp = self.client.get("/api/inventory/changes?since=" + since)
+        self.assertEqual(resp.json()[0][keys.KEY_OPERATION], "insert")
+        self.assertEqual([change[keys.KEY_PID] for change in resp.json()], [2])
+        since = resp.headers[keys.KEY_NEXT_CURSOR]
+        resp = self.client.get("/api/inventory/changes?since=" + since)
+        self.assertEqual(resp.json(), [])
+        self.assertEqual(resp.headers[keys.KEY_NEXT_CURSOR], since)
+
+        resp = self.client.get("/api/inventory/changes?since=nope")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        InventoryChangeHorizon.advance((10 ** 12, 1))
+        DB.session.commit()
+        resp = self.client.get("/api/inventory/changes?since=" + since)
+        self.assertEqual(resp.status_code, status.HTTP_410_GONE)
+
+    def test_bulk(self):
+        """ Create a batch of Inventories, reporting the rejected ones """
+        self.create(product_id=1, condition="new")
+        records = [InventoryFactory(product_id=pid, condition="new").serialize()
+                   for pid in range(4)]
+        records[2][keys.KEY_QTY] = -1
+        records.append(dict(records[3]))
+        resp = self.client.post("/api/inventory/bulk", json=records)
+        self.assertEqual(resp.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual(resp.json()[keys.KEY_CREATED], 2)
+        self.assertEqual([(error["index"], error["status"]) for error in resp.json()["errors"]],
+                         [(1, status.HTTP_409_CONFLICT), (2, status.HTTP_400_BAD_REQUEST),
+                          (4, status.HTTP_409_CONFLICT)])
+        resp = self.client.get(URL.format(3, "new"))
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+
+        resp = self.client.post("/api/inventory/bulk", json=[
+            InventoryFactory(product_id=5, condition="new").serialize()])
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        resp = self.client.post("/api/inventory/bulk", json={})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
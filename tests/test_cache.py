@@ -0,0 +1,73 @@
+"""
+Test cases for the Inventory lookup cache
+
+"""
+import time
+import unittest
+from service.cache import LRUCache
+
+################################################################################
+#  LRU Cache test cases
+################################################################################
+class LRUCacheTest(unittest.TestCase):
+    """
+    ################################################################################################
+    LRU Cache Tests
+    ################################################################################################
+    """
+
+    def test_get_set(self):
+        """ Store and read back entries """
+        cache = LRUCache(maxsize=2, ttl=60)
+        self.assertIsNone(cache.get((1, "new")))
+        cache.set((1, "new"), {"quantity": 1})
+        self.assertEqual(cache.get((1, "new")), {"quantity": 1})
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['size']), (1, 1, 1))
+
+    def test_lru_eviction(self):
+        """ The least recently used entry is evicted first """
+        cache = LRUCache(maxsize=2, ttl=60)
+        cache.set(1, "a")
+        cache.set(2, "b")
+        cache.get(1)
+        cache.set(3, "c")
+        self.assertIsNone(cache.get(2))
+        self.assertEqual(cache.get(1), "a")
+        self.assertEqual(cache.get(3), "c")
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_ttl(self):
+        """ Entries expire after the TTL """
+        cache = LRUCache(maxsize=2, ttl=0.01)
+        cache.set(1, "a")
+        time.sleep(0.02)
+        self.assertIsNone(cache.get(1))
+        self.assertEqual(cache.stats()['size'], 0)
+
+    def test_invalidate(self):
+        """ Invalidation drops entries and fills started before it """
+        cache = LRUCache(maxsize=2, ttl=60)
+        cache.set(1, "a")
+        generation = cache.generation
+        cache.invalidate(1)
+        self.assertIsNone(cache.get(1))
+        cache.set(1, "stale", generation)
+        self.assertIsNone(cache.get(1))
+        cache.set(1, "fresh", cache.generation)
+        self.assertEqual(cache.get(1), "fresh")
+        cache.clear()
+        self.assertIsNone(cache.get(1))
+
+    def test_disabled(self):
+        """ A disabled cache stores nothing """
+        cache = LRUCache(maxsize=2, ttl=60, enabled=False)
+        cache.set(1, "a")
+        self.assertIsNone(cache.get(1))
+        self.assertFalse(cache.stats()['enabled'])
+
+################################################################################################
+#   M A I N
+################################################################################################
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,129 @@
+"""
+Test cases for the Inventory Server-Sent Events
+
+"""
+import json
+import asyncio
+import datetime
+import unittest
+from service import keys
+from service.events import ChangeBroadcaster, Subscriber, encode_event
+from service.routes import decode_change_cursor
+
+def record(txid, change_id, product_id=1):
+    """ Returns a change as asyncpg would read it """
+    return {'id': change_id, 'txid': txid, 'operation': 'update', 'product_id': product_id,
+            'condition': 'new', 'quantity': 5, 'restock_level': 2, 'available': 1,
+            'version': change_id, 'changed_at': datetime.datetime(2020, 11, 1)}
+
+class FakeFeed():
+    """ A change feed in memory, read like fetch_changes """
+
+    def __init__(self, records=None):
+        self.records = list(records or [])
+
+    async def fetch(self, after, limit):
+        """ Returns the records after a position """
+        return [change for change in self.records
+                if after is None or (change['txid'], change['id']) > tuple(after)][:limit]
+
+    async def last(self):
+        """ Returns the last record, None if there is none """
+        return max(self.records, key=lambda change: (change['txid'], change['id']),
+                   default=None)
+
+def run(coroutine):
+    """ Runs a coroutine to its end """
+    return asyncio.get_event_loop().run_until_complete(coroutine)
+
+async def collect(stream, count):
+    """ Returns the first count chunks of a stream """
+    chunks = []
+    async for chunk in stream:
+        chunks.append(chunk)
+        if len(chunks) == count:
+            break
+    await stream.aclose()
+    return chunks
+
+################################################################################
+#  Server-Sent Events test cases
+################################################################################
+class EventsTest(unittest.TestCase):
+    """
+    ################################################################################################
+    Server-Sent Events Tests
+    ################################################################################################
+    """
+
+    def test_encode_event(self):
+        """ Encode a change as an event whose id is its feed cursor """
+        position, product_id, text = encode_event(record(7, 3, product_id=42))
+        self.assertEqual(position, (7, 3))
+        self.assertEqual(product_id, 42)
+        lines = text.split("\n")
+        self.assertEqual(decode_change_cursor(lines[0][len("id: "):]), (7, 3))
+        data = json.loads(lines[1][len("data: "):])
+        self.assertEqual(data[keys.KEY_PID], 42)
+        self.assertEqual(data[keys.KEY_QTY], 5)
+        self.assertTrue(text.endswith("\n\n"))
+
+    def test_subscriber_filter_and_overflow(self):
+        """ Buffer the events of the product_ids asked for, up to the buffer size """
+        events = [encode_event(record(1, i, product_id=i % 2)) for i in range(1, 5)]
+        subscriber = Subscriber({1}, 2)
+        self.assertTrue(subscriber.offer(events))
+        self.assertEqual([event[1] for event in subscriber.events], [1, 1])
+        self.assertFalse(subscriber.offer(events[:1]))
+        self.assertTrue(subscriber.dropped)
+
+    def test_broadcast_drops_slow_subscribers(self):
+        """ Hand the changes to every subscriber, dropping the ones that fell behind """
+        feed = FakeFeed()
+        broadcaster = ChangeBroadcaster(feed.fetch, feed.last, 2, 60)
+        self.assertIsNone(run(broadcaster.tail()))
+        feed.records = [record(1, 1)]
+        self.assertEqual(run(broadcaster.tail()), (1, 1))
+        broadcaster.position = (1, 1)
+        fast, slow = broadcaster.subscribe(), broadcaster.subscribe()
+        other = broadcaster.subscribe({2})
+        feed.records += [record(2, 2), record(2, 3)]
+        run(broadcaster.poll())
+        self.assertEqual(broadcaster.position, (2, 3))
+        self.assertEqual(len(run(fast.take(0))), 2)
+        feed.records.append(record(3, 4))
+        run(broadcaster.poll())
+        self.assertTrue(slow.dropped)
+        self.assertEqual(broadcaster.subscribers, {fast, other})
+        self.assertEqual(broadcaster.dropped, 1)
+        self.assertEqual(len(run(fast.take(0))), 1)
+        self.assertEqual(run(other.take(0)), [])
+
+    def test_stream_catches_up(self):
+        """ Stream the missed changes from the feed, then the live ones without repeats """
+        feed = FakeFeed([record(1, 1), record(2, 2), record(3, 3)])
+        broadcaster = ChangeBroadcaster(feed.fetch, feed.last, 10, 60)
+        subscriber = broadcaster.subscribe()
+        # Change 3 was read by the broadcaster as well as by the catch up
+        subscriber.offer([encode_event(record(3, 3)), encode_event(record(4, 4))])
+        chunks = run(collect(broadcaster.stream(subscriber, (1, 1), 60), 3))
+        self.assertEqual(chunks[0], "retry: {}\n\n".format(keys.SSE_RETRY_MS))
+        self.assertEqual(chunks[1].count("id: "), 2)
+        self.assertEqual(chunks[2], encode_event(record(4, 4))[2])
+        self.assertNotIn(subscriber, broadcaster.subscribers)
+
+    def test_stream_keepalive_and_drop(self):
+        """ Send comments while idle and end the stream of a dropped subscriber """
+        feed = FakeFeed()
+        broadcaster = ChangeBroadcaster(feed.fetch, feed.last, 1, 60)
+        subscriber = broadcaster.subscribe()
+
+        async def drop_later(stream):
+            chunks = [await stream.__anext__(), await stream.__anext__()]
+            broadcaster.broadcast([encode_event(record(1, 1)), encode_event(record(1, 2))])
+            chunks += [chunk async for chunk in stream]
+            return chunks
+
+        chunks = run(drop_later(broadcaster.stream(subscriber, None, 0.01)))
+        self.assertEqual(chunks[1:], [": keepalive\n\n"])
+        self.assertTrue(subscriber.dropped)
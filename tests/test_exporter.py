@@ -0,0 +1,86 @@
+"""
+Test cases for the Inventory export
+
+"""
+import io
+import os
+import unittest
+from sqlalchemy import text
+from service import app, keys, exporter, serializer
+from service.importer import import_csv
+from service.model import Inventory, DB
+
+DATABASE_URI = os.getenv(keys.KEY_DB_URI, keys.DATABASE_URI_LOCAL)
+
+CSV = """product_id,condition,quantity,restock_level,available
+1,new,10,5,1
+2,used,3,5,0
+3,open box,4,2,1
+"""
+
+################################################################################
+#  Export test cases
+################################################################################
+class ExporterTest(unittest.TestCase):
+    """
+    ################################################################################################
+    Export Tests
+    ################################################################################################
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        """ These run once before Test suite """
+        app.debug = False
+        app.config[keys.KEY_SQL_ALC] = DATABASE_URI
+        Inventory.init_db(app)
+
+    @classmethod
+    def tearDownClass(cls):
+        """ These run once after Test suite """
+        DB.session.close()
+
+    def setUp(self):
+        DB.drop_all()  # clean up the last tests
+        DB.create_all()  # make our sqlalchemy tables
+        import_csv(io.StringIO(CSV))
+
+    def tearDown(self):
+        DB.session.remove()
+
+    def rows(self):
+        """ Returns the query of every record, in key order """
+        return Inventory.rows(Inventory.find_page(Inventory.query))
+
+    def test_snapshot(self):
+        """ Read the rows from one read only, repeatable read snapshot """
+        settings = text("SELECT current_setting('transaction_isolation'), "
+                        "current_setting('transaction_read_only')")
+        self.assertEqual(list(exporter.snapshot_batches(settings, 10)),
+                         [[("repeatable read", "on")]])
+
+        batches = exporter.snapshot_batches(self.rows().statement, 1)
+        self.assertEqual(next(batches)[0][0], 1)
+        Inventory.restock(2, "used", 1)
+        Inventory.query.filter_by(product_id=3).delete()
+        DB.session.commit()
+        self.assertEqual([batch[0][:3] for batch in batches], [(2, "used", 3), (3, "open box", 4)])
+
+    def test_export_csv(self):
+        """ Export a CSV that imports back unchanged """
+        data = "".join(exporter.export(self.rows(), exporter.FORMAT_CSV))
+        lines = data.splitlines()
+        self.assertEqual(lines[0], ",".join(serializer.FIELDS))
+        self.assertEqual(lines[3].rsplit(",", 1)[0], "3,open box,4,2,1")
+        report = import_csv(io.StringIO(data))
+        self.assertEqual(report[keys.KEY_UNCHANGED], 3)
+
+    @unittest.skipUnless(exporter.available(exporter.FORMAT_PARQUET), "pyarrow is not installed")
+    def test_export_parquet(self):
+        """ Export a Parquet file with the rows of the query """
+        import pyarrow.parquet
+        query = Inventory.rows(Inventory.find_page(Inventory.find_by_condition("used")))
+        data = b"".join(exporter.export(query, exporter.FORMAT_PARQUET))
+        table = pyarrow.parquet.read_table(io.BytesIO(data))
+        self.assertEqual(table.column_names, list(serializer.FIELDS))
+        self.assertEqual(table.to_pydict()[keys.KEY_PID], [2])
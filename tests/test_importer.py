@@ -0,0 +1,113 @@
+"""
+Test cases for the Inventory CSV import
+
+"""
+import io
+import os
+import unittest
+from unittest import mock
+import psycopg2
+from service import app, keys, importer
+from service.importer import import_csv, read_chunks
+from service.model import Inventory, InventoryStats, DB, DataValidationError
+
+DATABASE_URI = os.getenv(keys.KEY_DB_URI, keys.DATABASE_URI_LOCAL)
+
+CSV = """product_id,condition,quantity,restock_level,available
+1,new,10,5,1
+2,used,3,5,0
+2,used,4,5,1
+3,broken,1,1,1
+4,new,1000,1,1
+5,open box,1
+"""
+
+################################################################################
+#  CSV Import test cases
+################################################################################
+class ImporterTest(unittest.TestCase):
+    """
+    ################################################################################################
+    CSV Import Tests
+    ################################################################################################
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        """ These run once before Test suite """
+        app.debug = False
+        app.config[keys.KEY_SQL_ALC] = DATABASE_URI
+        Inventory.init_db(app)
+
+    @classmethod
+    def tearDownClass(cls):
+        """ These run once after Test suite """
+        DB.session.close()
+
+    def setUp(self):
+        DB.drop_all()  # clean up the last tests
+        DB.create_all()  # make our sqlalchemy tables
+
+    def tearDown(self):
+        DB.session.remove()
+
+    def test_import_csv(self):
+        """ Import the valid rows, the last line of a record winning, and report the rest """
+        rejected, reports = [], []
+        report = import_csv(io.StringIO(CSV), chunk_size=2, progress=lambda r: reports.append(
+            r[keys.KEY_ROWS]), reject=lambda line, row, message: rejected.append(line))
+        self.assertEqual(reports, [2, 4, 6])
+        self.assertEqual((report[keys.KEY_ROWS], report[keys.KEY_CREATED],
+                          report[keys.KEY_UPDATED], report[keys.KEY_UNCHANGED],
+                          report[keys.KEY_REJECTED]), (6, 2, 0, 1, 3))
+        self.assertEqual(rejected, [5, 6, 7])
+        self.assertEqual(report[keys.KEY_ERRORS][0],
+                         {keys.KEY_LINE: 5, keys.KEY_MESSAGE: "Error in data: ['Condition']"})
+        self.assertIn("expected 5 fields", report[keys.KEY_ERRORS][2][keys.KEY_MESSAGE])
+        inventory = Inventory.find_by_product_id_condition(2, "used")
+        self.assertEqual((inventory.quantity, inventory.available), (4, 1))
+        self.assertEqual(InventoryStats.summary()["used"][keys.KEY_UNITS], 4)
+
+        # Reimporting only moves the records that change
+        version = Inventory.find_by_product_id_condition(1, "new").version
+        updated_version = Inventory.find_by_product_id_condition(2, "used").version
+        DB.session.remove()
+        columns = "available,condition,product_id,restock_level,quantity\n"
+        report = import_csv(io.StringIO(columns + "1,new,1,5,10\n0,used,2,5,4\n"))
+        self.assertEqual((report[keys.KEY_CREATED], report[keys.KEY_UPDATED],
+                          report[keys.KEY_UNCHANGED]), (0, 1, 1))
+        self.assertEqual(Inventory.find_by_product_id_condition(1, "new").version, version)
+        inventory = Inventory.find_by_product_id_condition(2, "used")
+        self.assertEqual(inventory.available, 0)
+        self.assertGreater(inventory.version, updated_version)
+
+    def test_import_csv_out_of_range(self):
+        """ Reject a product_id too large for the table like any other invalid row """
+        rejected = []
+        report = import_csv(io.StringIO(CSV[:CSV.index("3,broken")] + "99999999999,new,1,1,1\n"),
+                            reject=lambda line, row, message: rejected.append((line, message)))
+        self.assertEqual(rejected, [(5, "Error in data: ['Product ID']")])
+        self.assertEqual(report[keys.KEY_CREATED], 2)
+
+    def test_import_csv_copy_error(self):
+        """ Roll back the whole import when the database refuses a row """
+        with mock.patch.object(importer, 'validate_chunk', return_value={}):
+            self.assertRaises(psycopg2.DataError, import_csv,
+                              io.StringIO(CSV[:CSV.index("3,broken")] + "99999999999,new,1,1,1\n"))
+        # Nothing was imported, and the session is usable again
+        self.assertEqual(Inventory.find_all(), [])
+
+    def test_import_csv_bad_header(self):
+        """ Reject a CSV without the Inventory columns and import nothing """
+        self.assertRaises(DataValidationError, import_csv,
+                          io.StringIO("product_id,condition,quantity\n1,new,2\n"))
+        self.assertRaises(DataValidationError, import_csv, io.StringIO(""))
+        self.assertEqual(Inventory.find_all(), [])
+
+    def test_read_chunks(self):
+        """ Read the rows in column order, in chunks, with their line numbers """
+        stream = io.StringIO('quantity,product_id,condition,restock_level,available\n'
+                             '1,2,"open box",3,1\n\n4,5,new,6,0\n')
+        chunks = list(read_chunks(stream, chunk_size=1))
+        self.assertEqual(chunks, [([2], [["2", "open box", "1", "3", "1"]]),
+                                  ([4], [["5", "new", "4", "6", "0"]])])
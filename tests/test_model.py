@@ -6,8 +6,12 @@ import os
 import sys
 import logging
 import unittest
-from service import app, model, keys
-from service.model import Inventory, DB, DataValidationError, DBError
+from unittest import mock
+from sqlalchemy.exc import DataError
+from sqlalchemy.orm import Query
+from service import app, model, keys, validation
+from service.model import Inventory, DB, DataValidationError, DBError, PreconditionFailedError, \
+    OutOfStockError, InventoryStats, InventoryChange
 from .inventory_factory import InventoryFactory
 
 DATABASE_URI = os.getenv(keys.KEY_DB_URI, keys.DATABASE_URI_LOCAL)
@@ -63,6 +67,14 @@ class InventoryTest(unittest.TestCase):
         app.config[keys.KEY_SQL_ALC] = uri
         self.assertRaises(DBError, Inventory.init_db, app)
 
+    def test_init_db_without_schema(self):
+        """Testing that the schema is only created when asked for"""
+        DB.drop_all()
+        Inventory.init_db(app, create_schema=False)
+        self.assertFalse(DB.engine.has_table(Inventory.__tablename__))
+        Inventory.create_schema()
+        self.assertTrue(DB.engine.has_table(Inventory.__tablename__))
+
     #
     def test_serialize(self):
         """ Test serialization of a Inventory """
@@ -192,6 +204,31 @@ class InventoryTest(unittest.TestCase):
             self.assertEqual(inventory.restock_level, int(lvl))
             self.assertEqual(inventory.available, int(avl))
 
+    ################################################################################################
+    def test_create_bulk(self):
+        """ Create a batch of inventories in one transaction """
+        records = [InventoryFactory().serialize() for _ in range(keys.BULK_BATCH_SIZE + 5)]
+        records.append(dict(records[0]))
+        records.append({keys.KEY_PID: 1})
+        created, invalid, conflicts = Inventory.create_bulk(records)
+        self.assertEqual(len(created), keys.BULK_BATCH_SIZE + 5)
+        self.assertEqual(list(invalid.keys()), [keys.BULK_BATCH_SIZE + 6])
+        self.assertEqual(conflicts, [keys.BULK_BATCH_SIZE + 5])
+        self.assertEqual(len(Inventory.find_all()), keys.BULK_BATCH_SIZE + 5)
+
+        created, invalid, conflicts = Inventory.create_bulk(records[:3])
+        self.assertEqual(created, [])
+        self.assertEqual(conflicts, [0, 1, 2])
+
+    def test_create_bulk_db_error(self):
+        """ Roll back a batch the database refuses """
+        record = dict(InventoryFactory().serialize(), product_id=keys.INT_HIGH + 1)
+        columns = validation.columns_of([record])
+        with mock.patch.object(validation, 'validate_records', return_value=(columns, {})):
+            self.assertRaises(DataError, Inventory.create_bulk, [record])
+        # The session is usable again
+        self.assertEqual(Inventory.find_all(), [])
+
     ################################################################################################
     def test_update(self):
         """Update an Inventory"""
@@ -205,6 +242,54 @@ class InventoryTest(unittest.TestCase):
         self.assertEqual(len(inventories), 1)
         self.assertEqual(inventories[0].product_id, 667)
 
+    ################################################################################################
+    def test_restock(self):
+        """Restock an Inventory in the database"""
+        inventory = Inventory(product_id=888, condition="new", quantity=1,
+                                restock_level=10, available=1)
+        inventory.create()
+        result = Inventory.restock(888, "new", 5)
+        self.assertEqual(result.quantity, 6)
+        self.assertEqual(Inventory.find_by_product_id_condition(888, "new").quantity, 6)
+        self.assertRaises(DataValidationError, Inventory.restock, 888, "new", keys.QTY_HIGH)
+        self.assertEqual(Inventory.find_by_product_id_condition(888, "new").quantity, 6)
+        self.assertIsNone(Inventory.restock(888, "used", 5))
+
+    def test_reserve(self):
+        """Reserve stock of an Inventory in the database"""
+        inventory = Inventory(product_id=888, condition="new", quantity=5,
+                                restock_level=10, available=1)
+        inventory.create()
+        result = Inventory.reserve(888, "new", 3)
+        self.assertEqual(result.quantity, 2)
+        self.assertEqual(result.available, 1)
+        self.assertRaises(OutOfStockError, Inventory.reserve, 888, "new", 3)
+        result = Inventory.reserve(888, "new", 2)
+        self.assertEqual(result.quantity, 0)
+        self.assertEqual(result.available, 0)
+        self.assertRaises(OutOfStockError, Inventory.reserve, 888, "new", 1)
+        self.assertIsNone(Inventory.reserve(888, "used", 1))
+
+    def test_update_by_key(self):
+        """Update an Inventory in the database only at an expected version"""
+        inventory = Inventory(product_id=888, condition="new", quantity=1,
+                                restock_level=10, available=1)
+        inventory.create()
+        version = inventory.version
+        self.assertIsNotNone(version)
+        result = Inventory.update_by_key(888, "new", {keys.KEY_AVL: 0}, [version])
+        self.assertEqual(result.available, 0)
+        self.assertGreater(result.version, version)
+        self.assertRaises(PreconditionFailedError, Inventory.update_by_key,
+                          888, "new", {keys.KEY_AVL: 1}, [version])
+        self.assertRaises(PreconditionFailedError, Inventory.restock, 888, "new", 1, [version])
+        self.assertEqual(Inventory.find_by_product_id_condition(888, "new").available, 0)
+        self.assertIsNone(Inventory.update_by_key(888, "used", {keys.KEY_AVL: 1}, [version]))
+        inventory = Inventory.find_by_product_id_condition(888, "new")
+        inventory.quantity = 2
+        inventory.update()
+        self.assertGreater(inventory.version, result.version)
+
     ################################################################################################
     def test_delete(self):
         """Delete an Inventory"""
@@ -283,6 +368,116 @@ class InventoryTest(unittest.TestCase):
         inventories = Inventory.find_by_quantity(2)
         self.assertEqual(len(list(inventories)), 2)
 
+    def test_find_by_filters(self):
+        """Find Inventories matching several filters at once"""
+        records = [(100, "used", 12, 1), (101, "used", 9, 1), (102, "used", 20, 0),
+                   (103, "new", 30, 1), (104, "used", 10, 1)]
+        for pid, cnd, qty, avl in records:
+            Inventory(product_id=pid, condition=cnd, quantity=qty,
+                      restock_level=10, available=avl).create()
+        inventories = Inventory.find_by_filters(condition="used", quantity=10, available=1)
+        self.assertEqual(sorted(inv.product_id for inv in inventories), [100, 104])
+        inventories = Inventory.find_by_filters(product_id=102, condition="used")
+        self.assertEqual([inv.product_id for inv in inventories], [102])
+        self.assertEqual(len(list(Inventory.find_by_filters(quantity=-1, available=5))), 5)
+        query = Inventory.find_by_condition("used", Inventory.find_by_available(0))
+        self.assertEqual([inv.product_id for inv in query], [102])
+
+    def test_find_by_filters_uses_index(self):
+        """Combined filters are answered from a secondary index"""
+        query = Inventory.find_by_filters(condition="used", quantity=10, available=1)
+        statement = query.statement.compile(dialect=DB.engine.dialect,
+                                            compile_kwargs={"literal_binds": True})
+        DB.session.execute("SET enable_seqscan = off")
+        plan = "\n".join(row[0] for row in DB.session.execute("EXPLAIN {}".format(statement)))
+        DB.session.execute("RESET enable_seqscan")
+        self.assertNotIn("Seq Scan", plan)
+        self.assertIn("ix_inventory_", plan)
+
+    def test_find_below_restock_level(self):
+        """Find the Inventories at or below their restock level"""
+        for pid, cnd, qty in [(1, "new", 5), (2, "new", 10), (3, "new", 11), (4, "used", 0)]:
+            Inventory(product_id=pid, condition=cnd, quantity=qty,
+                      restock_level=10, available=1).create()
+        found = Inventory.find_below_restock_level().order_by(Inventory.product_id).all()
+        self.assertEqual([inv.product_id for inv in found], [1, 2, 4])
+        found = Inventory.find_below_restock_level("new").order_by(Inventory.product_id).all()
+        self.assertEqual([inv.product_id for inv in found], [1, 2])
+
+    def test_find_below_restock_level_uses_index(self):
+        """The low stock query is answered from its partial index"""
+        query = Inventory.find_page(Inventory.find_below_restock_level("used"), 10, (5, "new"))
+        statement = query.statement.compile(dialect=DB.engine.dialect,
+                                            compile_kwargs={"literal_binds": True})
+        DB.session.execute("SET enable_seqscan = off")
+        plan = "\n".join(row[0] for row in DB.session.execute("EXPLAIN {}".format(statement)))
+        DB.session.execute("RESET enable_seqscan")
+        self.assertNotIn("Seq Scan", plan)
+        self.assertIn("ix_inventory_low_stock", plan)
+
+    def test_stats(self):
+        """Keep the per condition stats current through every kind of write"""
+        Inventory(product_id=1, condition="new", quantity=5, restock_level=1, available=1).create()
+        Inventory.create_bulk([
+            {keys.KEY_PID: pid, keys.KEY_CND: "used", keys.KEY_QTY: 2,
+             keys.KEY_LVL: 1, keys.KEY_AVL: pid % 2} for pid in range(1, 41)])
+        Inventory.restock(1, "new", 3)
+        Inventory.reserve(1, "used", 2)
+        Inventory.update_by_key(4, "used", {keys.KEY_AVL: 1})
+        inventory = Inventory.find_by_product_id_condition(3, "used")
+        inventory.condition = "open box"
+        inventory.update()
+        Inventory.find_by_product_id_condition(5, "used").delete()
+
+        expected = {cnd: {keys.KEY_SKUS: 0, keys.KEY_UNITS: 0, keys.KEY_AVL: 0}
+                    for cnd in keys.CONDITIONS}
+        for inv in Inventory.find_all():
+            expected[inv.condition][keys.KEY_SKUS] += 1
+            expected[inv.condition][keys.KEY_UNITS] += inv.quantity
+            expected[inv.condition][keys.KEY_AVL] += inv.available
+        self.assertEqual(InventoryStats.summary(), expected)
+        self.assertEqual(expected["open box"], {keys.KEY_SKUS: 1, keys.KEY_UNITS: 2, keys.KEY_AVL: 1})
+        self.assertEqual(InventoryStats.reconcile(), 0)
+
+        DB.session.execute("UPDATE inventory_stats SET units = units + 7 WHERE condition = 'new'")
+        DB.session.commit()
+        self.assertNotEqual(InventoryStats.summary(), expected)
+        self.assertEqual(InventoryStats.reconcile(), 1)
+        self.assertEqual(InventoryStats.summary(), expected)
+
+    def test_changes_wait_for_older_transactions(self):
+        """ Testing that a change is not read before an older transaction ends """
+        connection = DB.engine.connect()
+        transaction = connection.begin()
+        try:
+            connection.execute("INSERT INTO inventory (product_id, condition, quantity, "
+                               "restock_level, available) VALUES (1, 'new', 1, 1, 1)")
+            # Logged after the open transaction's change, but committed first
+            Inventory(product_id=2, condition="new", quantity=1, restock_level=1,
+                      available=1).create()
+            self.assertEqual(InventoryChange.since(), [])
+            self.assertIsNone(InventoryChange.last().first())
+            transaction.commit()
+        finally:
+            connection.close()
+        changes = InventoryChange.since()
+        self.assertEqual([change.product_id for change in changes], [1, 2])
+        self.assertEqual(InventoryChange.since(changes[0].position()), changes[1:])
+        self.assertEqual(InventoryChange.last().all(), changes[1:])
+
+    def test_changes_after_a_write(self):
+        """ Testing that a write leaves no transaction open to hold the feed back """
+        # The first nextval of the new change marker sequence is WAL-logged, so it takes an xid
+        Inventory(product_id=1, condition="new", quantity=1, restock_level=1,
+                  available=1).create()
+        with DB.engine.begin() as connection:
+            connection.execute("INSERT INTO inventory (product_id, condition, quantity, "
+                               "restock_level, available) VALUES (2, 'new', 1, 1, 1)")
+        # Read by another session, like another worker
+        with DB.engine.connect() as connection:
+            sql = InventoryChange.feed(query=Query(InventoryChange)).statement
+            self.assertEqual([row.product_id for row in connection.execute(sql)], [1, 2])
+
 ################################################################################################
 #   M A I N
 ################################################################################################
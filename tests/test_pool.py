@@ -0,0 +1,47 @@
+"""
+Test cases for the Inventory connection pool
+
+"""
+import sqlite3
+import unittest
+from sqlalchemy import exc
+from service import keys
+from service.pool import TimedQueuePool, engine_options
+
+################################################################################
+#  Timed Queue Pool test cases
+################################################################################
+class TimedQueuePoolTest(unittest.TestCase):
+    """
+    ################################################################################################
+    Timed Queue Pool Tests
+    ################################################################################################
+    """
+
+    def test_stats(self):
+        """ Count connections, checkouts and timeouts """
+        pool = TimedQueuePool(lambda: sqlite3.connect(":memory:"), pool_size=1,
+                              max_overflow=1, timeout=0.05)
+        first = pool.connect()
+        second = pool.connect()
+        stats = pool.stats()
+        self.assertEqual((stats['checked_out'], stats['idle'], stats['overflow']), (2, 0, 1))
+        self.assertRaises(exc.TimeoutError, pool.connect)
+        stats = pool.stats()
+        self.assertEqual((stats['checkouts'], stats['timeouts']), (3, 1))
+        self.assertGreaterEqual(stats['wait_max'], 0.05)
+        self.assertGreater(stats['wait_total'], stats['wait_avg'])
+        first.close()
+        second.close()
+        stats = pool.stats()
+        self.assertEqual((stats['checked_out'], stats['idle'], stats['overflow']), (0, 1, 0))
+
+    def test_engine_options(self):
+        """ Build the engine options from the config """
+        options = engine_options({keys.KEY_DB_POOL_SIZE: 3, keys.KEY_DB_POOL_PRE_PING: True})
+        self.assertIs(options['poolclass'], TimedQueuePool)
+        self.assertEqual(options['pool_size'], 3)
+        self.assertTrue(options['pool_pre_ping'])
+        self.assertNotIn('connect_args', options)
+        options = engine_options({keys.KEY_DB_STATEMENT_TIMEOUT: 500})
+        self.assertEqual(options['connect_args'], {'options': '-c statement_timeout=500'})
@@ -0,0 +1,88 @@
+"""
+Test cases for the Inventory request log
+
+"""
+import logging
+import unittest
+from unittest import mock
+from flask import Response
+from service import app, keys, request_log
+from service.request_log import RequestLog, REQUEST_LOG
+
+class ListHandler(logging.Handler):
+    """ Keeps the records it handles """
+
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+################################################################################
+#  Request log test cases
+################################################################################
+class RequestLogTest(unittest.TestCase):
+    """
+    ################################################################################################
+    Request Log Tests
+    ################################################################################################
+    """
+
+    def request(self, path, code, headers=None):
+        """ Runs the request log hooks around a request answered with code """
+        # Without a real request, so later test classes can still set the app up
+        with app.test_request_context(path, headers=headers):
+            request_log.start_request_log()
+            request_log.log_request(Response(status=code))
+
+    def tearDown(self):
+        request_log.init_app(app)
+
+    def test_level(self):
+        """ Successes are sampled, errors and slow requests always logged """
+        log = RequestLog(sample_rate=0, slow_ms=100)
+        self.assertIsNone(log.level(200, 1))
+        self.assertEqual(log.level(200, 100), logging.INFO)
+        self.assertEqual(log.level(404, 1), logging.WARNING)
+        self.assertEqual(log.level(503, 1), logging.ERROR)
+        log.configure(sample_rate=1, slow_ms=100)
+        self.assertEqual(log.level(304, 1), logging.INFO)
+        # Out of range rates are clamped
+        log.configure(sample_rate=7, slow_ms=100)
+        self.assertEqual(log.sample_rate, 1.0)
+
+    def test_log_request(self):
+        """ Log one structured line per request """
+        with self.assertLogs(request_log.LOGGER, logging.INFO) as logs:
+            self.request("/metrics", 200, headers={keys.KEY_REQUEST_ID_HEADER: "abc"})
+        self.assertEqual(len(logs.records), 1)
+        message = logs.records[0].getMessage()
+        for field in ["method=GET", "path=/metrics", "resource=metrics", "status=200",
+                      "duration_ms=", "request_id=abc"]:
+            self.assertIn(field, message)
+
+    def test_log_through_app_logger(self):
+        """ Emit the line through the handlers and level of app.logger, as under gunicorn """
+        handler = ListHandler()
+        level = app.logger.level
+        app.logger.addHandler(handler)
+        app.logger.setLevel(logging.INFO)
+        try:
+            self.request("/metrics", 200)
+        finally:
+            app.logger.removeHandler(handler)
+            app.logger.setLevel(level)
+        self.assertEqual(len(handler.records), 1)
+        self.assertEqual(handler.records[0].name, "service.requests")
+        self.assertIn("status=200", handler.records[0].getMessage())
+
+    def test_log_sampled(self):
+        """ Drop the successes a zero sample rate leaves out, but not the errors """
+        REQUEST_LOG.configure(sample_rate=0, slow_ms=60000)
+        with mock.patch.object(request_log.LOGGER, 'log') as log:
+            self.request("/metrics", 200)
+            log.assert_not_called()
+            self.request("/no-such-page", 404)
+            self.assertEqual(log.call_count, 1)
+            self.assertEqual(log.call_args[0][0], logging.WARNING)
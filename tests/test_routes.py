@@ -2,14 +2,20 @@
 Inventory API Service Test Suite
 Test cases can be run with the following:
 """
+import io
 import os
 import sys
+import json
+import shutil
+import pstats
 import logging
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from unittest import TestCase
 from flask_api import status
 
 from service import app, routes, keys
-from service.model import Inventory, DB
+from service.model import Inventory, DB, CACHE
 from .inventory_factory import InventoryFactory
 
 DATABASE_URI = os.getenv(keys.KEY_DB_URI, keys.DATABASE_URI_LOCAL)
@@ -44,6 +50,7 @@ class InventoryAPITest(TestCase):
         }
         DB.drop_all()  # clean up the last tests
         DB.create_all()  # create new tables
+        CACHE.clear()
 
     def tearDown(self):
         DB.session.remove()
@@ -154,6 +161,47 @@ class InventoryAPITest(TestCase):
         )
         self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
 
+    def test_create_inventory_bulk(self):
+        """ Create a batch of inventories in one request """
+        N = 25
+        records = [InventoryFactory().serialize() for _ in range(N)]
+        resp = self.app.post(
+            "/api/inventory/bulk", json=records, content_type=keys.KEY_CONTENT_TYPE_JSON
+        )
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        data = resp.get_json()
+        self.assertEqual(data[keys.KEY_CREATED], N)
+        self.assertEqual(data[keys.KEY_ERRORS], [])
+        resp = self.app.get("/api/inventory")
+        self.assertEqual(len(resp.get_json()), N)
+
+    def test_create_inventory_bulk_errors(self):
+        """ Create a batch with invalid and conflicting records """
+        existing = self._create_inventories(1)[0].serialize()
+        valid = InventoryFactory().serialize()
+        invalid = InventoryFactory().serialize()
+        invalid[keys.KEY_CND] = "broken"
+        too_large = dict(valid, product_id=99999999999)
+        records = [valid, existing, invalid, valid, "not a record", too_large]
+        resp = self.app.post(
+            "/api/inventory/bulk", json=records, content_type=keys.KEY_CONTENT_TYPE_JSON
+        )
+        self.assertEqual(resp.status_code, status.HTTP_207_MULTI_STATUS)
+        data = resp.get_json()
+        self.assertEqual(data[keys.KEY_CREATED], 1)
+        errors = [(err[keys.KEY_INDEX], err[keys.KEY_STATUS]) for err in data[keys.KEY_ERRORS]]
+        self.assertEqual(errors, [(1, status.HTTP_409_CONFLICT), (2, status.HTTP_400_BAD_REQUEST),
+                                  (3, status.HTTP_409_CONFLICT), (4, status.HTTP_400_BAD_REQUEST),
+                                  (5, status.HTTP_400_BAD_REQUEST)])
+
+    def test_create_inventory_bulk_bad_req(self):
+        """ Create a batch that is not a list """
+        resp = self.app.post(
+            "/api/inventory/bulk", json=InventoryFactory().serialize(),
+            content_type=keys.KEY_CONTENT_TYPE_JSON
+        )
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
     ##################################################################
     # Testing GET
     def test_list_inventory(self):
@@ -257,6 +305,297 @@ class InventoryAPITest(TestCase):
             count_1 = len(resp.get_json())
             self.assertEqual(count_1, n_1)
 
+    def test_list_inventory_paged(self):
+        """Page through the inventory list with a cursor"""
+        N = 7
+        records = [InventoryFactory().serialize() for _ in range(N)]
+        resp = self.app.post(
+            "/api/inventory/bulk", json=records, content_type=keys.KEY_CONTENT_TYPE_JSON
+        )
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        pages = []
+        url = "/api/inventory?limit=3"
+        while url:
+            resp = self.app.get(url)
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            pages.append(resp.get_json())
+            cursor = resp.headers.get(keys.KEY_NEXT_CURSOR)
+            url = "/api/inventory?limit=3&after={}".format(cursor) if cursor else None
+        self.assertEqual([len(page) for page in pages], [3, 3, 1])
+        found = [(inv[keys.KEY_PID], inv[keys.KEY_CND]) for page in pages for inv in page]
+        self.assertEqual(found, sorted((inv[keys.KEY_PID], inv[keys.KEY_CND]) for inv in records))
+
+    def test_list_inventory_paged_filtered(self):
+        """Page through a filtered inventory list"""
+        records = []
+        for pid in range(5):
+            for cnd in keys.CONDITIONS:
+                record = InventoryFactory(product_id=pid, condition=cnd).serialize()
+                records.append(record)
+        self.app.post("/api/inventory/bulk", json=records, content_type=keys.KEY_CONTENT_TYPE_JSON)
+        resp = self.app.get("/api/inventory?condition=used&limit=2")
+        data = resp.get_json()
+        self.assertEqual([inv[keys.KEY_PID] for inv in data], [0, 1])
+        resp = self.app.get("/api/inventory?condition=used&limit=2&after={}"\
+                            .format(resp.headers[keys.KEY_NEXT_CURSOR]))
+        data = resp.get_json()
+        self.assertEqual([inv[keys.KEY_PID] for inv in data], [2, 3])
+        self.assertTrue(all(inv[keys.KEY_CND] == "used" for inv in data))
+
+    def test_list_low_stock(self):
+        """Page through the inventories due for a restock"""
+        records = []
+        for pid in range(6):
+            for cnd in keys.CONDITIONS[:2]:
+                record = InventoryFactory(product_id=pid, condition=cnd).serialize()
+                record[keys.KEY_LVL] = 5
+                record[keys.KEY_QTY] = pid * 2
+                records.append(record)
+        self.app.post("/api/inventory/bulk", json=records, content_type=keys.KEY_CONTENT_TYPE_JSON)
+        resp = self.app.get("/api/inventory/low-stock")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual([(inv[keys.KEY_PID], inv[keys.KEY_CND]) for inv in resp.get_json()],
+                         [(pid, cnd) for pid in range(3) for cnd in sorted(keys.CONDITIONS[:2])])
+        resp = self.app.get("/api/inventory/low-stock?condition=used&limit=2")
+        self.assertEqual([inv[keys.KEY_PID] for inv in resp.get_json()], [0, 1])
+        resp = self.app.get("/api/inventory/low-stock?condition=used&limit=2&after={}"\
+                            .format(resp.headers[keys.KEY_NEXT_CURSOR]))
+        self.assertEqual([inv[keys.KEY_PID] for inv in resp.get_json()], [2])
+        self.assertNotIn(keys.KEY_NEXT_CURSOR, resp.headers)
+
+    def test_get_inventory_stats(self):
+        """Get the inventory totals per condition"""
+        records = [InventoryFactory(product_id=pid, condition="new").serialize()
+                   for pid in range(4)]
+        self.app.post("/api/inventory/bulk", json=records, content_type=keys.KEY_CONTENT_TYPE_JSON)
+        resp = self.app.get("/api/inventory/stats")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual(sorted(data), sorted(keys.CONDITIONS))
+        self.assertEqual(data["new"][keys.KEY_SKUS], 4)
+        self.assertEqual(data["new"][keys.KEY_UNITS], sum(rec[keys.KEY_QTY] for rec in records))
+        self.assertEqual(data["new"][keys.KEY_AVL], sum(rec[keys.KEY_AVL] for rec in records))
+        self.assertEqual(data["used"][keys.KEY_SKUS], 0)
+
+        result = app.test_cli_runner().invoke(args=["reconcile-stats"])
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn("0 counters had drifted", result.output)
+
+    def test_import_inventory(self):
+        """Import a CSV of inventories as the body or as an upload"""
+        header = "product_id,condition,quantity,restock_level,available\n"
+        resp = self.app.post("/api/inventory/import", data=header + "1,new,10,5,1\n",
+                             content_type=keys.KEY_CONTENT_TYPE_CSV)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json()[keys.KEY_CREATED], 1)
+
+        upload = io.BytesIO((header + "1,new,12,5,1\n2,new,-1,5,1\n").encode())
+        resp = self.app.post("/api/inventory/import",
+                             data={keys.KEY_FILE: (upload, "inventory.csv")},
+                             content_type="multipart/form-data")
+        self.assertEqual(resp.status_code, status.HTTP_207_MULTI_STATUS)
+        data = resp.get_json()
+        self.assertEqual((data[keys.KEY_UPDATED], data[keys.KEY_REJECTED]), (1, 1))
+        self.assertEqual(data[keys.KEY_ERRORS][0][keys.KEY_LINE], 3)
+        resp = self.app.get("/api/inventory/1/condition/new")
+        self.assertEqual(resp.get_json()[keys.KEY_QTY], 12)
+
+        resp = self.app.post("/api/inventory/import", data="pid,cnd\n1,new\n",
+                             content_type=keys.KEY_CONTENT_TYPE_CSV)
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_export_inventory(self):
+        """Export the inventories as a CSV file, filtered like the list"""
+        records = [InventoryFactory(product_id=pid, condition=cnd).serialize()
+                   for pid in range(3) for cnd in ["new", "used"]]
+        self.app.post("/api/inventory/bulk", json=records, content_type=keys.KEY_CONTENT_TYPE_JSON)
+        resp = self.app.get("/api/inventory/export?condition=used")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.mimetype, keys.KEY_CONTENT_TYPE_CSV)
+        self.assertIn("inventory.csv", resp.headers["Content-Disposition"])
+        lines = resp.get_data(as_text=True).splitlines()
+        self.assertEqual(len(lines), 4)
+        self.assertTrue(all(",used," in line for line in lines[1:]))
+
+        resp = self.app.get("/api/inventory/export?format=xml")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_inventory_changes(self):
+        """Read the changes to the inventories with a cursor"""
+        path = "/api/inventory/1/condition/new"
+        self.app.post("/api/inventory", json=InventoryFactory(product_id=1, condition="new",
+                                                              quantity=2).serialize(),
+                      headers=self.headers)
+        self.app.put(path + "/restock", json={keys.KEY_AMT: 3})
+        self.app.put(path + "/deactivate")
+        self.app.delete(path)
+
+        resp = self.app.get("/api/inventory/changes?limit=3")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        changes = resp.get_json()
+        self.assertEqual([change[keys.KEY_OPERATION] for change in changes],
+                         ["insert", "update", "update"])
+        self.assertEqual([change[keys.KEY_QTY] for change in changes], [2, 5, 5])
+        self.assertEqual(changes[2][keys.KEY_AVL], 0)
+        versions = [change[keys.KEY_VER] for change in changes]
+        self.assertEqual(versions, sorted(versions))
+
+        cursor = resp.headers[keys.KEY_NEXT_CURSOR]
+        resp = self.app.get("/api/inventory/changes?since=" + cursor)
+        changes = resp.get_json()
+        self.assertEqual(len(changes), 1)
+        self.assertEqual(changes[0][keys.KEY_OPERATION], "delete")
+        self.assertEqual(changes[0][keys.KEY_PID], 1)
+
+        # Caught up: nothing new, and the same place to read on from
+        cursor = resp.headers[keys.KEY_NEXT_CURSOR]
+        resp = self.app.get("/api/inventory/changes?since=" + cursor)
+        self.assertEqual(resp.get_json(), [])
+        self.assertEqual(resp.headers[keys.KEY_NEXT_CURSOR], cursor)
+
+        resp = self.app.get("/api/inventory/changes?since=bogus")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_inventory_changes_pruned(self):
+        """Tell readers whose cursor is behind pruned changes"""
+        records = [InventoryFactory(product_id=pid, condition="new").serialize()
+                   for pid in range(3)]
+        self.app.post("/api/inventory/bulk", json=records, content_type=keys.KEY_CONTENT_TYPE_JSON)
+        first = self.app.get("/api/inventory/changes?limit=1").headers[keys.KEY_NEXT_CURSOR]
+        last = self.app.get("/api/inventory/changes").headers[keys.KEY_NEXT_CURSOR]
+
+        result = app.test_cli_runner().invoke(args=["prune-changes", "--retention", "0"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("3 inventory changes pruned", result.output)
+        resp = self.app.get("/api/inventory/changes?since=" + first)
+        self.assertEqual(resp.status_code, status.HTTP_410_GONE)
+        resp = self.app.get("/api/inventory/changes?since=" + last)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json(), [])
+
+    def test_create_schema_cli(self):
+        """Create the schema from the command line"""
+        DB.drop_all()
+        result = app.test_cli_runner().invoke(args=["create-schema"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        resp = self.app.get("/api/inventory/stats")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+
+    def test_import_inventory_cli(self):
+        """Import a CSV of inventories from the command line"""
+        directory = tempfile.mkdtemp()
+        try:
+            source = os.path.join(directory, "inventory.csv")
+            rejects = os.path.join(directory, "rejects.csv")
+            with open(source, "w") as csv_file:
+                csv_file.write("product_id,condition,quantity,restock_level,available\n"
+                               "1,new,10,5,1\n1,old,10,5,1\n")
+            result = app.test_cli_runner().invoke(
+                args=["import-csv", source, "--rejects", rejects])
+            self.assertEqual(result.exit_code, 0, result.output)
+            self.assertIn("1 created, 0 updated, 0 unchanged, 1 rejected", result.output)
+            with open(rejects) as rejects_file:
+                lines = rejects_file.read().splitlines()
+            self.assertEqual(lines[1], "3,Error in data: ['Condition'],1,old,10,5,1")
+        finally:
+            shutil.rmtree(directory)
+
+    def test_get_pool_stats(self):
+        """Get the connection pool stats"""
+        self.app.get("/api/inventory")
+        resp = self.app.get("/api/inventory/pool")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual(data['size'], app.config[keys.KEY_DB_POOL_SIZE])
+        self.assertGreater(data['checkouts'], 0)
+        self.assertGreaterEqual(data['checked_out'], 0)
+
+    def test_metrics(self):
+        """Get the request and database metrics in the Prometheus format"""
+        self.app.get("/api/inventory")
+        self.app.get("/api/inventory/1/condition/new")
+        resp = self.app.get("/metrics")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertTrue(resp.content_type.startswith("text/plain"))
+        text = resp.get_data(as_text=True)
+        self.assertIn('inventory_http_requests_total{method="GET",resource="InventoryBase",'
+                      'status="200"}', text)
+        self.assertIn('inventory_http_requests_total{method="GET",resource="InventoryResource",'
+                      'status="404"}', text)
+        self.assertIn('inventory_http_request_duration_seconds_bucket{le="0.005",method="GET",'
+                      'resource="InventoryBase"}', text)
+        self.assertIn('inventory_db_query_duration_seconds_count{statement="SELECT"}', text)
+
+    def test_profile_request(self):
+        """Profile a request on demand"""
+        test_inventory = self._create_inventories(1)[0]
+        url = "/api/inventory/{}/condition/{}".format(test_inventory.product_id,
+                                                      test_inventory.condition)
+        profile_dir = tempfile.mkdtemp()
+        app.config[keys.KEY_PROFILE_DIR] = profile_dir
+        app.config[keys.KEY_PROFILING_ENABLED] = True
+        try:
+            headers = {keys.KEY_PROFILE_HEADER: "1"}
+            resp = self.app.put(url, json=test_inventory.serialize(), headers=headers)
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            self.assertNotIn(keys.KEY_PROFILE_ID_HEADER, resp.headers)
+
+            headers.update(self.headers)
+            resp = self.app.put(url, json=test_inventory.serialize(), headers=headers)
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            path = os.path.join(profile_dir, resp.headers[keys.KEY_PROFILE_ID_HEADER])
+            stats = pstats.Stats(path + ".pstats")
+            self.assertTrue(any(func[2] == "validate_data" for func in stats.stats))
+            with open(path + ".collapsed") as collapsed:
+                stacks = collapsed.read()
+            self.assertRegex(stacks, r"routes.py:\d+:put;.*model.py:\d+:validate_data")
+            with open(path + ".sql.json") as sql:
+                statements = json.load(sql)
+            self.assertTrue(any(stmt["statement"].startswith("UPDATE") for stmt in statements))
+
+            # A profile that cannot be stored does not fail the request
+            app.config[keys.KEY_PROFILE_DIR] = os.path.join(path + ".pstats", "not-a-directory")
+            resp = self.app.put(url, json=test_inventory.serialize(), headers=headers)
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        finally:
+            app.config[keys.KEY_PROFILING_ENABLED] = False
+            shutil.rmtree(profile_dir)
+
+    def test_list_inventory_ndjson(self):
+        """Stream the inventory list as newline delimited JSON"""
+        N = keys.STREAM_BATCH_SIZE + 3
+        records = [InventoryFactory().serialize() for _ in range(N)]
+        self.app.post("/api/inventory/bulk", json=records, content_type=keys.KEY_CONTENT_TYPE_JSON)
+        resp = self.app.get("/api/inventory", headers={"Accept": keys.KEY_CONTENT_TYPE_NDJSON})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.mimetype, keys.KEY_CONTENT_TYPE_NDJSON)
+        lines = resp.get_data(as_text=True).splitlines()
+        self.assertEqual(len(lines), N)
+        self.assertEqual(json.loads(lines[0]), self.app.get("/api/inventory?limit=1").get_json()[0])
+
+        resp = self.app.get("/api/inventory?condition=new",
+                            headers={"Accept": keys.KEY_CONTENT_TYPE_NDJSON})
+        lines = resp.get_data(as_text=True).splitlines()
+        self.assertEqual(len(lines), len([inv for inv in records if inv[keys.KEY_CND] == "new"]))
+
+    def test_list_inventory_paged_bad_req(self):
+        """Page through the inventory list with bad parameters"""
+        for query in ["limit=0", "limit={}".format(keys.PAGE_LIMIT_MAX + 1), "after=bogus",
+                      "after=WzEsIDJd"]:
+            resp = self.app.get("/api/inventory?{}".format(query))
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_get_inventory_by_filters(self):
+        """Get inventory details by several filters at once"""
+        inventories = self._create_inventories(20)
+        expected = [inv for inv in inventories
+                    if inv.condition == "used" and inv.available == 1 and inv.quantity >= 10]
+        resp = self.app.get("/api/inventory?condition=used&available=1&quantity=10")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual(sorted(inv[keys.KEY_PID] for inv in data),
+                         sorted(inv.product_id for inv in expected))
+
     def test_get_inventory_by_pid_condition(self):
         """Get inventory details by [product_id, condition]"""
         test_inventory = self._create_inventories(1)[0]
@@ -268,6 +607,121 @@ class InventoryAPITest(TestCase):
         self.assertEqual(data[keys.KEY_PID], pid)
         self.assertEqual(data[keys.KEY_CND], cnd)
 
+    def test_get_inventory_cached(self):
+        """Get inventory details from the cache until the record changes"""
+        test_inventory = self._create_inventories(1)[0]
+        url = "/api/inventory/{}/condition/{}".format(test_inventory.product_id,
+                                                      test_inventory.condition)
+        # Off by default
+        CACHE.configure(app.config[keys.KEY_CACHE_MAXSIZE], app.config[keys.KEY_CACHE_TTL])
+        self.addCleanup(CACHE.configure, app.config[keys.KEY_CACHE_MAXSIZE],
+                        app.config[keys.KEY_CACHE_TTL], app.config[keys.KEY_CACHE_ENABLED])
+        hits = CACHE.stats()['hits']
+        self.assertEqual(self.app.get(url).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.app.get(url).status_code, status.HTTP_200_OK)
+        self.assertEqual(CACHE.stats()['hits'], hits + 1)
+
+        resp = self.app.put("{}/deactivate".format(url))
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.app.get(url).get_json()[keys.KEY_AVL], 0)
+        self.app.delete(url)
+        self.assertEqual(self.app.get(url).status_code, status.HTTP_404_NOT_FOUND)
+
+        resp = self.app.get("/api/inventory/cache")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json()['hits'], hits + 1)
+
+    def test_get_inventory_etag(self):
+        """Get inventory details conditionally with If-None-Match"""
+        test_inventory = self._create_inventories(1)[0]
+        url = "/api/inventory/{}/condition/{}".format(test_inventory.product_id,
+                                                      test_inventory.condition)
+        resp = self.app.get(url)
+        etag = resp.headers["ETag"]
+        self.assertTrue(etag)
+        resp = self.app.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(resp.get_data(), b"")
+
+        # Any write moves the version on, even one that leaves the data as it was
+        resp = self.app.put(url, json=test_inventory.serialize(),
+                            content_type=keys.KEY_CONTENT_TYPE_JSON)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        resp = self.app.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(resp.headers["ETag"], etag)
+
+    def test_update_inventory_if_match(self):
+        """Update an Inventory only at the version in If-Match"""
+        test_inventory = self._create_inventories(1)[0]
+        url = "/api/inventory/{}/condition/{}".format(test_inventory.product_id,
+                                                      test_inventory.condition)
+        resp = self.app.get(url)
+        etag = resp.headers["ETag"]
+        data = resp.get_json()
+        data[keys.KEY_QTY] = 7
+        resp = self.app.put(url, json=data, headers={"If-Match": etag},
+                            content_type=keys.KEY_CONTENT_TYPE_JSON)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json()[keys.KEY_QTY], 7)
+        self.assertGreater(resp.get_json()[keys.KEY_VER], data[keys.KEY_VER])
+        self.assertNotEqual(resp.headers["ETag"], etag)
+        # The tag is stale now, so every conditional write is refused
+        resp = self.app.put(url, json=data, headers={"If-Match": etag},
+                            content_type=keys.KEY_CONTENT_TYPE_JSON)
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        resp = self.app.put("{}/restock".format(url), json={keys.KEY_AMT: 1},
+                            headers={"If-Match": etag}, content_type=keys.KEY_CONTENT_TYPE_JSON)
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        resp = self.app.put("{}/deactivate".format(url), headers={"If-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        resp = self.app.put("{}/activate".format(url), headers={"If-Match": '"junk"'})
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        resp = self.app.get(url)
+        self.assertEqual(resp.get_json()[keys.KEY_QTY], 7)
+        # Any version matches "*"
+        resp = self.app.put("{}/deactivate".format(url), headers={"If-Match": "*"})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json()[keys.KEY_AVL], 0)
+
+    def test_update_inventory_version_in_body(self):
+        """Update an Inventory only at the version sent in the body"""
+        test_inventory = self._create_inventories(1)[0]
+        url = "/api/inventory/{}/condition/{}".format(test_inventory.product_id,
+                                                      test_inventory.condition)
+        data = self.app.get(url).get_json()
+        resp = self.app.put("{}/restock".format(url),
+                            json={keys.KEY_AMT: 1, keys.KEY_VER: data[keys.KEY_VER]},
+                            content_type=keys.KEY_CONTENT_TYPE_JSON)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        resp = self.app.put("{}/restock".format(url),
+                            json={keys.KEY_AMT: 1, keys.KEY_VER: data[keys.KEY_VER]},
+                            content_type=keys.KEY_CONTENT_TYPE_JSON)
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        resp = self.app.put(url, json=data, content_type=keys.KEY_CONTENT_TYPE_JSON)
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        del data[keys.KEY_VER]
+        resp = self.app.put(url, json=data, content_type=keys.KEY_CONTENT_TYPE_JSON)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+
+    def test_list_inventory_etag(self):
+        """Get the inventory list conditionally with If-None-Match"""
+        self._create_inventories(2)
+        resp = self.app.get("/api/inventory")
+        etag = resp.headers["ETag"]
+        resp = self.app.get("/api/inventory", headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+        resp = self.app.get("/api/inventory?limit=1", headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        resp = self.app.get("/api/inventory", headers={"If-None-Match": etag,
+                                                       "Accept": keys.KEY_CONTENT_TYPE_NDJSON})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+
+        self._create_inventories(1)
+        resp = self.app.get("/api/inventory", headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(resp.get_json()), 3)
+
     def test_get_inventory_by_pid_condition_not_found(self):
         """Get inventory details by [product_id, condition]: NOT FOUND"""
         test_inventory = self._create_inventories(1)[0]
@@ -390,6 +844,77 @@ class InventoryAPITest(TestCase):
             else:
                 self.assertEqual(resp.status_code, status.HTTP_200_OK)
 
+    def test_update_inventory_restock_concurrent(self):
+        """Restock the same inventory from many parallel clients"""
+        test_inventory = InventoryFactory()
+        test_inventory.quantity = 0
+        resp = self.app.post(
+            "/api/inventory", json=test_inventory.serialize(), content_type=keys.KEY_CONTENT_TYPE_JSON
+        )
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        url = "/api/inventory/{}/condition/{}/restock".format(test_inventory.product_id,
+                                                               test_inventory.condition)
+
+        def restock(_):
+            return app.test_client().put(url, json={keys.KEY_AMT: 1},
+                                         content_type=keys.KEY_CONTENT_TYPE_JSON).status_code
+
+        attempts = keys.QTY_HIGH + 10
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            codes = list(pool.map(restock, range(attempts)))
+        self.assertEqual(codes.count(status.HTTP_200_OK), keys.QTY_HIGH)
+        self.assertEqual(codes.count(status.HTTP_400_BAD_REQUEST), attempts - keys.QTY_HIGH)
+
+        resp = self.app.get("/api/inventory/{}/condition/{}".format(test_inventory.product_id,
+                                                                    test_inventory.condition))
+        self.assertEqual(resp.get_json()[keys.KEY_QTY], keys.QTY_HIGH)
+
+    def test_reserve_inventory(self):
+        """Reserve stock of an Inventory"""
+        test_inventory = self._create_inventories(1)[0]
+        url = "/api/inventory/{}/condition/{}/reserve".format(test_inventory.product_id,
+                                                              test_inventory.condition)
+        Inventory.update_by_key(test_inventory.product_id, test_inventory.condition,
+                                {keys.KEY_QTY: 3, keys.KEY_AVL: keys.AVAILABLE_TRUE})
+        resp = self.app.post(url, json={keys.KEY_AMT: 2}, content_type=keys.KEY_CONTENT_TYPE_JSON)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json()[keys.KEY_QTY], 1)
+        self.assertEqual(resp.get_json()[keys.KEY_AVL], 1)
+        resp = self.app.post(url, json={keys.KEY_AMT: 2}, content_type=keys.KEY_CONTENT_TYPE_JSON)
+        self.assertEqual(resp.status_code, status.HTTP_409_CONFLICT)
+        resp = self.app.post(url, json={keys.KEY_AMT: 0}, content_type=keys.KEY_CONTENT_TYPE_JSON)
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.post(url, json={keys.KEY_AMT: 1}, content_type=keys.KEY_CONTENT_TYPE_JSON)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json()[keys.KEY_QTY], 0)
+        self.assertEqual(resp.get_json()[keys.KEY_AVL], 0)
+        resp = self.app.post("/api/inventory/9999/condition/new/reserve", json={keys.KEY_AMT: 1},
+                             content_type=keys.KEY_CONTENT_TYPE_JSON)
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_reserve_inventory_concurrent(self):
+        """Reserve the same inventory from many parallel clients without overselling"""
+        test_inventory = self._create_inventories(1)[0]
+        Inventory.update_by_key(test_inventory.product_id, test_inventory.condition,
+                                {keys.KEY_QTY: keys.QTY_HIGH, keys.KEY_AVL: keys.AVAILABLE_TRUE})
+        url = "/api/inventory/{}/condition/{}/reserve".format(test_inventory.product_id,
+                                                              test_inventory.condition)
+
+        def reserve(_):
+            return app.test_client().post(url, json={keys.KEY_AMT: 1},
+                                          content_type=keys.KEY_CONTENT_TYPE_JSON).status_code
+
+        attempts = keys.QTY_HIGH + 10
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            codes = list(pool.map(reserve, range(attempts)))
+        self.assertEqual(codes.count(status.HTTP_200_OK), keys.QTY_HIGH)
+        self.assertEqual(codes.count(status.HTTP_409_CONFLICT), attempts - keys.QTY_HIGH)
+
+        inventory = Inventory.find_by_product_id_condition(test_inventory.product_id,
+                                                           test_inventory.condition)
+        self.assertEqual(inventory.quantity, 0)
+        self.assertEqual(inventory.available, keys.AVAILABLE_FALSE)
+
     def test_updates_not_found(self):
         """Testing Updates NOT found"""
         pid = 9999
@@ -0,0 +1,58 @@
+"""
+Test cases for the Inventory serializer
+
+"""
+import json
+import unittest
+from service import keys, serializer
+from service.model import Inventory
+from service.routes import api, inventory_model
+from .inventory_factory import InventoryFactory
+
+################################################################################
+#  Serializer test cases
+################################################################################
+class SerializerTest(unittest.TestCase):
+    """
+    ################################################################################################
+    Serializer Tests
+    ################################################################################################
+    """
+
+    def marshalled(self, row):
+        """ Returns a row as marshal_with would send it """
+        inventory = Inventory(**serializer.row_dict(row))
+        return json.loads(json.dumps(api.marshal(inventory.serialize(), inventory_model)))
+
+    def test_fields_match_model(self):
+        """ The serialized fields are the fields of the documented model """
+        self.assertEqual(serializer.FIELDS, tuple(inventory_model.keys()))
+        self.assertEqual(set(serializer.FIELDS), set(Inventory(version=1).serialize()))
+
+    def test_dump_row(self):
+        """ Serialize rows the same as marshal_with """
+        rows = [(inv.product_id, inv.condition, inv.quantity, inv.restock_level,
+                 inv.available, i + 1) for i, inv in enumerate(InventoryFactory.build_batch(10))]
+        for row in rows:
+            self.assertEqual(json.loads(serializer.dump_row(row)), self.marshalled(row))
+        self.assertEqual(json.loads(serializer.dump_rows(rows)),
+                         [self.marshalled(row) for row in rows])
+        self.assertEqual(serializer.dump_rows([]), "[]")
+
+    def test_dump_row_escapes_and_nulls(self):
+        """ Escape strings and serialize NULL columns """
+        rows = [(1, 'open "box"\\', 5, 2, 1, 7), (2, "new", None, 2, None, 8),
+                (3, None, 1, 1, 0, 9)]
+        for row in rows:
+            self.assertEqual(json.loads(serializer.dump_row(row)), self.marshalled(row))
+        record = serializer.row_dict(rows[1])
+        self.assertEqual(json.loads(serializer.dump_record(record)), record)
+
+    def test_ndjson_chunks(self):
+        """ Serialize rows as newline delimited JSON in batches """
+        rows = [(i, "new", i, 1, keys.AVAILABLE_TRUE, i) for i in range(5)]
+        chunks = list(serializer.ndjson_chunks(rows, batch_size=2))
+        self.assertEqual(len(chunks), 3)
+        lines = "".join(chunks).splitlines()
+        self.assertEqual([json.loads(line) for line in lines],
+                         [serializer.row_dict(row) for row in rows])
@@ -0,0 +1,65 @@
+"""
+Test cases for the Inventory batch validation
+
+"""
+import unittest
+import itertools
+from service import keys, validation
+from service.model import Inventory, DataValidationError
+
+################################################################################
+#  Batch Validation test cases
+################################################################################
+class ValidationTest(unittest.TestCase):
+    """
+    ################################################################################################
+    Batch Validation Tests
+    ################################################################################################
+    """
+
+    @staticmethod
+    def validate_one(record):
+        """ Returns the error of validating a record on its own, None if it is valid """
+        try:
+            Inventory().deserialize(record).validate_data()
+        except DataValidationError as err:
+            return str(err)
+        return None
+
+    def test_matches_validate_data(self):
+        """ Report the errors validate_data reports """
+        numbers = [0, 1, 7, 50, 51, -1, "1", "007", "51", "-1", "x", "", 1.0, True, None]
+        product_ids = [1, 1234567, "42", -3, "a", keys.INT_HIGH, keys.INT_HIGH + 1, "99999999999"]
+        conditions = ["new", "open box", "old", "", 1, None]
+        records = [{keys.KEY_PID: pid, keys.KEY_CND: cnd, keys.KEY_QTY: qty,
+                    keys.KEY_LVL: qty, keys.KEY_AVL: avl}
+                   for pid, cnd, qty, avl in itertools.product(
+                       product_ids, conditions, numbers, [0, 1, "1", 2])]
+        columns, errors = validation.validate_records(records)
+        self.assertEqual(len(columns[keys.KEY_PID]), len(records))
+        for index, record in enumerate(records):
+            self.assertEqual(errors.get(index), self.validate_one(record), record)
+
+    def test_missing_and_malformed(self):
+        """ Report missing fields and records that are not objects like deserialize """
+        record = {keys.KEY_PID: 1, keys.KEY_CND: "new", keys.KEY_QTY: 2,
+                  keys.KEY_LVL: 3, keys.KEY_AVL: 1}
+        partial = dict(record)
+        del partial[keys.KEY_LVL], partial[keys.KEY_CND]
+        records = [record, partial, [1, 2], None, {}]
+        _, errors = validation.validate_records(records)
+        self.assertNotIn(0, errors)
+        for index in range(1, len(records)):
+            self.assertEqual(errors[index], self.validate_one(records[index]))
+        self.assertEqual(validation.validate_records([]), (validation.columns_of([]), {}))
+
+    def test_validate_columns(self):
+        """ Validate column-oriented batches """
+        columns = {keys.KEY_PID: [1, 2], keys.KEY_CND: ["new", "used"],
+                   keys.KEY_QTY: ["5", 60], keys.KEY_LVL: [1, 1], keys.KEY_AVL: [1, 0]}
+        self.assertEqual(validation.validate_columns(columns), {1: "Error in data: ['Quantity']"})
+        del columns[keys.KEY_AVL]
+        self.assertEqual(validation.validate_columns(columns)[0],
+                         "Invalid Inventory record: missing available")
+        columns[keys.KEY_AVL] = [1]
+        self.assertRaises(ValueError, validation.validate_columns, columns)